@@ -0,0 +1,7 @@
+#!/bin/bash
+
+PYTHONPATH=src/ \
+nohup python src/export_ruler.py \
+  data/power/ruler/cde-50.pkl \
+  data/power/ruler/cde-50-export/ \
+> logs/export_ruler_$(date +'%Y-%m-%d_%H-%M-%S').stdout &
@@ -0,0 +1,7 @@
+#!/bin/bash
+
+PYTHONPATH=src/ \
+nohup python src/export_texter.py \
+  data/power/texter/cde-irt-5-marked.pkl \
+  data/power/texter/cde-irt-5-marked/ \
+> logs/export_texter_$(date +'%Y-%m-%d_%H-%M-%S').stdout &
@@ -0,0 +1,10 @@
+#!/bin/bash
+
+PYTHONPATH=src/ \
+nohup python src/quantize_texter.py \
+  data/power/texter/cde-irt-5-marked.pkl \
+  data/power/samples/cde-irt-5-marked/ \
+  100 \
+  5 \
+  data/power/texter/cde-irt-5-marked-int8.pkl \
+> logs/quantize_texter_$(date +'%Y-%m-%d_%H-%M-%S').stdout &
@@ -2,4 +2,6 @@
 
 PYTHONPATH=src/ \
 nohup python src/train_texter_datasets.py \
+  scripts/train_texter_datasets.tsv \
+  --jobs 1 \
 > logs/train_texter_datasets_$(date +'%Y-%m-%d_%H-%M-%S').stdout &
@@ -6,9 +6,13 @@ from pathlib import Path
 from random import sample
 from typing import Dict, Set, List, Tuple
 
+import numpy as np
+
 from data.irt.split.split_dir import SplitDir
 from data.irt.text.text_dir import TextDir
 from data.power.samples.samples_dir import SamplesDir
+from data.power.samples.toks_dir import ToksDir
+from power.texter import Texter
 
 
 def main():
@@ -51,6 +55,14 @@ def parse_args():
                         help='Number of sentences per entity. Entities for which not enough sentences'
                              ' are availabe are dropped. (default: {})'.format(default_sent_count))
 
+    default_sent_len = 64
+    parser.add_argument('--sent-len', dest='sent_len', type=int, metavar='INT', default=default_sent_len,
+                        help='Sentence length short sentences are padded and long sentences cropped to'
+                             ' when tokenizing (default: {})'.format(default_sent_len))
+
+    parser.add_argument('--tokenize', dest='tokenize', action='store_true',
+                        help='Also save the samples with pre-tokenized sentences to POWER Tokens Directories')
+
     args = parser.parse_args()
 
     # Log applied config
@@ -63,6 +75,8 @@ def parse_args():
     logging.info('    {:24} {}'.format('--overwrite', args.overwrite))
     logging.info('    {:24} {}'.format('--random-seed', args.random_seed))
     logging.info('    {:24} {}'.format('--sent-count', args.sent_count))
+    logging.info('    {:24} {}'.format('--sent-len', args.sent_len))
+    logging.info('    {:24} {}'.format('--tokenize', args.tokenize))
 
     logging.info('Environment variables:')
     logging.info('    {:24} {}'.format('PYTHONHASHSEED', os.getenv('PYTHONHASHSEED')))
@@ -78,6 +92,8 @@ def create_texter_dataset(args):
     class_count = args.class_count
     overwrite = args.overwrite
     sent_count = args.sent_count
+    sent_len = args.sent_len
+    tokenize = args.tokenize
 
     #
     # Check that (input) IRT Split Directory exists
@@ -221,6 +237,48 @@ def create_texter_dataset(args):
     samples_dir.valid_samples_tsv.save(valid_samples)
     samples_dir.test_samples_tsv.save(test_samples)
 
+    #
+    # Create POWER Tokens Directories
+    #
+
+    if tokenize:
+        logging.info('Create POWER Tokens Directories ...')
+
+        pre_trained = 'distilbert-base-uncased'
+        tokenizer = Texter.create_tokenizer(pre_trained)
+
+        def save_toks(toks_dir: ToksDir, samples: List[Tuple[int, str, List[int], List[str]]]) -> None:
+            """
+            :param samples: [(ent, label, [has class], [sent])
+            """
+
+            toks_dir.create(overwrite=overwrite)
+
+            toks_dir.ents_npy.save(np.array([ent for ent, _, _, _ in samples], dtype=np.int64))
+            toks_dir.classes_npy.save(np.array([classes for _, _, classes, _ in samples], dtype=np.uint8))
+
+            toks = toks_dir.toks_npy.create((len(samples), sent_count, sent_len), np.int32)
+            lens = toks_dir.lens_npy.create((len(samples), sent_count), np.int32)
+
+            # Tokenize in chunks to limit memory usage
+            chunk_size = 1024
+            for i in range(0, len(samples), chunk_size):
+                chunk = samples[i:i + chunk_size]
+                flat_sents = [sent for _, _, _, sents in chunk for sent in sents]
+
+                encoded = tokenizer(flat_sents, padding='max_length', truncation=True, max_length=sent_len,
+                                    return_tensors='np')
+
+                toks[i:i + len(chunk)] = encoded.input_ids.reshape(len(chunk), sent_count, sent_len)
+                lens[i:i + len(chunk)] = encoded.attention_mask.sum(axis=1).reshape(len(chunk), sent_count)
+
+            toks.flush()
+            lens.flush()
+
+        save_toks(samples_dir.train_toks_dir, train_samples)
+        save_toks(samples_dir.valid_toks_dir, valid_samples)
+        save_toks(samples_dir.test_toks_dir, test_samples)
+
 
 if __name__ == '__main__':
     main()
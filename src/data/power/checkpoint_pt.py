@@ -0,0 +1,31 @@
+"""
+The `POWER Checkpoint PT` contains the state of an interrupted Texter
+training, i.e. the Texter's and the optimizer's state dicts, the training
+progress and the RNG states.
+
+|
+"""
+
+import os
+from pathlib import Path
+from typing import Dict
+
+import torch
+
+from data.base_file import BaseFile
+
+
+class CheckpointPt(BaseFile):
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+
+    def save(self, checkpoint: Dict) -> None:
+        # Replace the previous checkpoint only after the new one has been written completely
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        torch.save(checkpoint, tmp_path)
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> Dict:
+        # The checkpoint only contains tensors and plain Python containers and numbers
+        return torch.load(self.path, map_location='cpu', weights_only=True)
@@ -0,0 +1,73 @@
+"""
+The `POWER Ruler Export Directory` contains the `Ruler`'s CSR-like arrays
+as separate .npy files, so that they can be memory-mapped instead of being
+unpickled as a whole. Several processes that load the same export share
+the arrays through the page cache.
+
+**Structure**
+
+::
+
+    ruler/                   # POWER Ruler Export Directory
+
+        confs.npy            # POWER Array NPY, float64 (fact count)
+        ents.npy             # POWER Array NPY, int32 (ent count), sorted
+        entities.tsv         # POWER Labels TSV
+        offsets.npy          # POWER Array NPY, int64 (ent count + 1), index into facts
+        relations.tsv        # POWER Labels TSV
+        rels.npy             # POWER Array NPY, int32 (fact count)
+        rule_ids.npy         # POWER Array NPY, int32 (rule ref count), index into rules.pkl
+        rule_offsets.npy     # POWER Array NPY, int64 (fact count + 1), index into rule_ids.npy
+        rules.pkl            # POWER Rules PKL
+        tails.npy            # POWER Array NPY, int32 (fact count)
+
+|
+"""
+
+from pathlib import Path
+
+from data.base_dir import BaseDir
+from data.power.ruler_export.rules_pkl import RulesPkl
+from data.power.samples.array_npy import ArrayNpy
+from data.power.split.labels_tsv import LabelsTsv
+
+
+class RulerExportDir(BaseDir):
+    confs_npy: ArrayNpy
+    ents_npy: ArrayNpy
+    entities_tsv: LabelsTsv
+    offsets_npy: ArrayNpy
+    relations_tsv: LabelsTsv
+    rels_npy: ArrayNpy
+    rule_ids_npy: ArrayNpy
+    rule_offsets_npy: ArrayNpy
+    rules_pkl: RulesPkl
+    tails_npy: ArrayNpy
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+
+        self.confs_npy = ArrayNpy(path.joinpath('confs.npy'))
+        self.ents_npy = ArrayNpy(path.joinpath('ents.npy'))
+        self.entities_tsv = LabelsTsv(path.joinpath('entities.tsv'))
+        self.offsets_npy = ArrayNpy(path.joinpath('offsets.npy'))
+        self.relations_tsv = LabelsTsv(path.joinpath('relations.tsv'))
+        self.rels_npy = ArrayNpy(path.joinpath('rels.npy'))
+        self.rule_ids_npy = ArrayNpy(path.joinpath('rule_ids.npy'))
+        self.rule_offsets_npy = ArrayNpy(path.joinpath('rule_offsets.npy'))
+        self.rules_pkl = RulesPkl(path.joinpath('rules.pkl'))
+        self.tails_npy = ArrayNpy(path.joinpath('tails.npy'))
+
+    def check(self) -> None:
+        super().check()
+
+        self.confs_npy.check()
+        self.ents_npy.check()
+        self.entities_tsv.check()
+        self.offsets_npy.check()
+        self.relations_tsv.check()
+        self.rels_npy.check()
+        self.rule_ids_npy.check()
+        self.rule_offsets_npy.check()
+        self.rules_pkl.check()
+        self.tails_npy.check()
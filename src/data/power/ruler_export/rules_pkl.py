@@ -0,0 +1,27 @@
+"""
+The `POWER Rules PKL` contains the pickled table of the distinct `Rule`s
+that are referenced by a `Ruler`'s predictions.
+
+|
+"""
+
+import pickle
+from pathlib import Path
+from typing import List
+
+from data.base_file import BaseFile
+from models.rule import Rule
+
+
+class RulesPkl(BaseFile):
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+
+    def save(self, rules: List[Rule]) -> None:
+        with open(self.path, 'wb') as f:
+            pickle.dump(rules, f)
+
+    def load(self) -> List[Rule]:
+        with open(self.path, 'rb') as f:
+            return pickle.load(f)
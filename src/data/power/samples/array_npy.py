@@ -0,0 +1,36 @@
+"""
+The `POWER Array NPY` stores a NumPy array in the .npy format so that it
+can be memory-mapped.
+
+|
+"""
+
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+
+from data.base_file import BaseFile
+
+
+class ArrayNpy(BaseFile):
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+
+    def save(self, array: np.ndarray) -> None:
+        np.save(self.path, array)
+
+    def create(self, shape: Tuple[int, ...], dtype) -> np.memmap:
+        """
+        :return: Writable memory map of the new array, for arrays that do not fit into memory
+        """
+
+        return np.lib.format.open_memmap(self.path, mode='w+', dtype=dtype, shape=shape)
+
+    def load(self) -> np.ndarray:
+        """
+        :return: Read-only memory map
+        """
+
+        return np.load(self.path, mmap_mode='r')
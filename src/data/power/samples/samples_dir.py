@@ -1,7 +1,8 @@
 """
 The `POWER Samples Directory` contains the input files required for training the
 `POWER Classifier`. The `POWER Temp Directory` keeps intermediate files
-for debugging purposes.
+for debugging purposes. The optional `POWER Tokens Directories` contain the
+samples with pre-tokenized sentences.
 
 **Structure**
 
@@ -17,6 +18,10 @@ for debugging purposes.
         train_samples.tsv  # POWER Train Samples TSV
         valid_samples.tsv  # POWER Valid Samples TSV
 
+        test_toks/         # POWER Test Tokens Directory (optional)
+        train_toks/        # POWER Train Tokens Directory (optional)
+        valid_toks/        # POWER Valid Tokens Directory (optional)
+
 |
 """
 
@@ -26,6 +31,7 @@ from data.base_dir import BaseDir
 from data.power.samples.classes_tsv import ClassesTsv
 from data.power.samples.samples_tsv import SamplesTsv
 from data.power.samples.tmp.tmp_dir import TmpDir
+from data.power.samples.toks_dir import ToksDir
 
 
 class SamplesDir(BaseDir):
@@ -37,6 +43,10 @@ class SamplesDir(BaseDir):
     valid_samples_tsv: SamplesTsv
     test_samples_tsv: SamplesTsv
 
+    train_toks_dir: ToksDir
+    valid_toks_dir: ToksDir
+    test_toks_dir: ToksDir
+
     def __init__(self, path: Path):
         super().__init__(path)
 
@@ -48,6 +58,10 @@ class SamplesDir(BaseDir):
         self.valid_samples_tsv = SamplesTsv(path.joinpath('valid.tsv'))
         self.test_samples_tsv = SamplesTsv(path.joinpath('test.tsv'))
 
+        self.train_toks_dir = ToksDir(path.joinpath('train_toks'))
+        self.valid_toks_dir = ToksDir(path.joinpath('valid_toks'))
+        self.test_toks_dir = ToksDir(path.joinpath('test_toks'))
+
     def check(self) -> None:
         super().check()
 
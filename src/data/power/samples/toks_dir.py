@@ -0,0 +1,46 @@
+"""
+The `POWER Tokens Directory` contains the samples of a `POWER Samples TSV`
+with pre-tokenized sentences. All files are `POWER Array NPY`s, so that
+they can be memory-mapped.
+
+**Structure**
+
+::
+
+    train_toks/         # POWER Tokens Directory
+
+        classes.npy     # (sample_count, class_count) uint8, whether entity has class
+        ents.npy        # (sample_count) int64, entity RIDs
+        lens.npy        # (sample_count, sent_count) int32, token count per sentence
+        toks.npy        # (sample_count, sent_count, sent_len) int32, padded token IDs
+
+|
+"""
+
+from pathlib import Path
+
+from data.base_dir import BaseDir
+from data.power.samples.array_npy import ArrayNpy
+
+
+class ToksDir(BaseDir):
+    classes_npy: ArrayNpy
+    ents_npy: ArrayNpy
+    lens_npy: ArrayNpy
+    toks_npy: ArrayNpy
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+
+        self.classes_npy = ArrayNpy(path.joinpath('classes.npy'))
+        self.ents_npy = ArrayNpy(path.joinpath('ents.npy'))
+        self.lens_npy = ArrayNpy(path.joinpath('lens.npy'))
+        self.toks_npy = ArrayNpy(path.joinpath('toks.npy'))
+
+    def check(self) -> None:
+        super().check()
+
+        self.classes_npy.check()
+        self.ents_npy.check()
+        self.lens_npy.check()
+        self.toks_npy.check()
@@ -0,0 +1,43 @@
+"""
+The `POWER Embeddings BIN` stores a float32 matrix of shape (row count,
+emb size) as raw bytes in row-major order, without header. It can be
+appended to and memory-mapped.
+
+|
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+
+from data.base_file import BaseFile
+
+
+class EmbsBin(BaseFile):
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+
+    def append(self, embs: np.ndarray) -> None:
+        """
+        :param embs: (row count, emb size)
+        """
+
+        with open(self.path, 'ab') as f:
+            f.write(np.ascontiguousarray(embs, dtype=np.float32).tobytes())
+
+    def truncate(self, row_count: int, emb_size: int) -> None:
+        os.truncate(self.path, row_count * 4 * emb_size)
+
+    def load(self, emb_size: int) -> np.ndarray:
+        """
+        :return: Read-only memory map (row count, emb size), without a trailing partial row
+        """
+
+        row_count = self.path.stat().st_size // (4 * emb_size)
+
+        if row_count == 0:
+            return np.empty((0, emb_size), dtype=np.float32)
+
+        return np.memmap(self.path, dtype=np.float32, mode='r', shape=(row_count, emb_size))
@@ -0,0 +1,41 @@
+"""
+The `POWER Keys TXT` contains one key per line.
+
+**Example**
+
+::
+
+    3f0c8e3d9b2a...
+    a41b07c5e6d1...
+
+|
+"""
+
+from pathlib import Path
+from typing import List
+
+from data.base_file import BaseFile
+
+
+class KeysTxt(BaseFile):
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+
+    def save(self, keys: List[str]) -> None:
+        with open(self.path, 'w', encoding='utf-8') as f:
+            for key in keys:
+                f.write(f'{key}\n')
+
+    def append(self, keys: List[str]) -> None:
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for key in keys:
+                f.write(f'{key}\n')
+
+    def load(self) -> List[str]:
+        """
+        :return: [key], without a trailing partial line
+        """
+
+        with open(self.path, encoding='utf-8') as f:
+            return [line[:-1] for line in f if line.endswith('\n')]
@@ -0,0 +1,66 @@
+"""
+The `POWER Sentence Embeddings Directory` caches the sentence embeddings
+calculated by the `Texter`'s encoder across runs. Row i of the `POWER
+Embeddings BIN` holds the embedding for the key in line i of the `POWER
+Keys TXT`. Processes that share the directory serialize their appends
+with an exclusive lock on the lock file.
+
+**Structure**
+
+::
+
+    sent_embs/      # POWER Sentence Embeddings Directory
+
+        embs.bin    # POWER Embeddings BIN
+        keys.txt    # POWER Keys TXT
+        lock        # Empty lock file
+
+|
+"""
+
+import fcntl
+from contextlib import contextmanager
+from pathlib import Path
+
+from data.base_dir import BaseDir
+from data.power.sent_embs.embs_bin import EmbsBin
+from data.power.sent_embs.keys_txt import KeysTxt
+
+
+class SentEmbsDir(BaseDir):
+    embs_bin: EmbsBin
+    keys_txt: KeysTxt
+    lock_path: Path
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+
+        self.embs_bin = EmbsBin(path.joinpath('embs.bin'))
+        self.keys_txt = KeysTxt(path.joinpath('keys.txt'))
+        self.lock_path = path.joinpath('lock')
+
+    def check(self) -> None:
+        super().check()
+
+        self.embs_bin.check()
+        self.keys_txt.check()
+
+    def create(self, overwrite=False) -> None:
+        super().create(overwrite=overwrite)
+
+        self.embs_bin.path.touch()
+        self.keys_txt.path.touch()
+
+    @contextmanager
+    def lock(self):
+        """
+        Hold an exclusive lock on the directory, wait while another process holds it
+        """
+
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
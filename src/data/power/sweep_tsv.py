@@ -0,0 +1,58 @@
+"""
+The `POWER Sweep TSV` defines the `train_texter` jobs run by
+`train_texter_datasets`.
+
+* Tabular separated
+* 1 Header Row with the names of `train_texter`'s args
+* 1 Row per job
+* Python literals (e.g. `128`, `1e-5`, `True`, `None`) are parsed,
+  everything else is taken as string
+
+**Example**
+
+::
+
+    samples_dir	sent_count	split_dir	texter_pkl	batch_size	log_dir
+    data/power/samples/cde-cde-1-clean/	1	data/power/split/cde-0/	data/power/texter/cde-cde-1-clean.pkl	128	runs/cde-cde-1-clean/
+    data/power/samples/cde-cde-5-clean/	5	data/power/split/cde-0/	data/power/texter/cde-cde-5-clean.pkl	32	runs/cde-cde-5-clean/
+
+|
+"""
+
+import csv
+from ast import literal_eval
+from pathlib import Path
+from typing import List, Dict, Any
+
+from data.base_file import BaseFile
+
+
+class SweepTsv(BaseFile):
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+
+    def save(self, jobs: List[Dict[str, Any]]) -> None:
+        with open(self.path, 'w', encoding='utf-8', newline='') as f:
+            csv_writer = csv.writer(f, delimiter='\t')
+            csv_writer.writerow(jobs[0].keys())
+
+            for job in jobs:
+                csv_writer.writerow(job.values())
+
+    def load(self) -> List[Dict[str, Any]]:
+        with open(self.path, encoding='utf-8') as f:
+            csv_reader = csv.reader(f, delimiter='\t')
+            names = next(csv_reader)
+
+            jobs = [{name: parse_value(value) for name, value in zip(names, row)}
+                    for row in csv_reader if row]
+
+        return jobs
+
+
+def parse_value(value: str) -> Any:
+    try:
+        return literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
@@ -0,0 +1,51 @@
+"""
+The `POWER Class Labels TSV` contains the `Texter`'s classes in order,
+together with their relation and tail labels.
+
+**Example**
+
+::
+
+    rel rel_lbl     tail    tail_lbl
+    7   occupation  13      actor
+    2   gender      4       male
+
+|
+"""
+
+import csv
+from pathlib import Path
+from typing import List, Tuple
+
+from data.base_file import BaseFile
+
+
+class ClassLabelsTsv(BaseFile):
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+
+    def save(self, rows: List[Tuple[int, str, int, str]]) -> None:
+        """
+        :param rows: [(rel, rel_lbl, tail, tail_lbl)]
+        """
+
+        with open(self.path, 'w', encoding='utf-8', newline='') as f:
+            csv_writer = csv.writer(f, delimiter='\t')
+            csv_writer.writerow(('rel', 'rel_lbl', 'tail', 'tail_lbl'))
+
+            for row in rows:
+                csv_writer.writerow(row)
+
+    def load(self) -> List[Tuple[int, str, int, str]]:
+        """
+        :return: [(rel, rel_lbl, tail, tail_lbl)]
+        """
+
+        with open(self.path, encoding='utf-8') as f:
+            csv_reader = csv.reader(f, delimiter='\t')
+            next(csv_reader)
+
+            rows = [(int(rel), rel_lbl, int(tail), tail_lbl) for rel, rel_lbl, tail, tail_lbl in csv_reader]
+
+        return rows
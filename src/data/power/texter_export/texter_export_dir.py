@@ -0,0 +1,52 @@
+"""
+The `POWER Texter Export Directory` contains a traced `Texter` that can be
+used for prediction without the `Texter` class and the transformers package.
+
+**Structure**
+
+::
+
+    texter/                  # POWER Texter Export Directory
+
+        classes.tsv          # POWER Class Labels TSV
+        special_tokens.txt   # POWER Tokens TXT, tokens that must not be split
+        texter.pt            # POWER Texter PT
+        tokenizer.tsv        # POWER Tokenizer TSV, lower casing and max length
+        vocab.txt            # POWER Tokens TXT, token with ID i in line i
+
+|
+"""
+
+from pathlib import Path
+
+from data.base_dir import BaseDir
+from data.power.texter_export.class_labels_tsv import ClassLabelsTsv
+from data.power.texter_export.texter_pt import TexterPt
+from data.power.texter_export.tokenizer_tsv import TokenizerTsv
+from data.power.texter_export.tokens_txt import TokensTxt
+
+
+class TexterExportDir(BaseDir):
+    classes_tsv: ClassLabelsTsv
+    special_tokens_txt: TokensTxt
+    texter_pt: TexterPt
+    tokenizer_tsv: TokenizerTsv
+    vocab_txt: TokensTxt
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+
+        self.classes_tsv = ClassLabelsTsv(path.joinpath('classes.tsv'))
+        self.special_tokens_txt = TokensTxt(path.joinpath('special_tokens.txt'))
+        self.texter_pt = TexterPt(path.joinpath('texter.pt'))
+        self.tokenizer_tsv = TokenizerTsv(path.joinpath('tokenizer.tsv'))
+        self.vocab_txt = TokensTxt(path.joinpath('vocab.txt'))
+
+    def check(self) -> None:
+        super().check()
+
+        self.classes_tsv.check()
+        self.special_tokens_txt.check()
+        self.texter_pt.check()
+        self.tokenizer_tsv.check()
+        self.vocab_txt.check()
@@ -0,0 +1,25 @@
+"""
+The `POWER Texter PT` contains the TorchScript module traced from
+`Texter.forward()`.
+
+|
+"""
+
+from pathlib import Path
+
+import torch
+from torch.jit import ScriptModule
+
+from data.base_file import BaseFile
+
+
+class TexterPt(BaseFile):
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+
+    def save(self, traced_texter: ScriptModule) -> None:
+        torch.jit.save(traced_texter, str(self.path))
+
+    def load(self) -> ScriptModule:
+        return torch.jit.load(str(self.path), map_location='cpu')
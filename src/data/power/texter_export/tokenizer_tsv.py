@@ -0,0 +1,48 @@
+"""
+The `POWER Tokenizer TSV` contains the settings that the `Texter`'s
+tokenizer is used with.
+
+* Tabular separated
+* 1 Header Row
+* 1 Row with the settings
+
+**Example**
+
+::
+
+    do_lower_case   max_length
+    True            64
+
+|
+"""
+
+import csv
+from pathlib import Path
+from typing import Tuple
+
+from data.base_file import BaseFile
+
+
+class TokenizerTsv(BaseFile):
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+
+    def save(self, do_lower_case: bool, max_length: int) -> None:
+        with open(self.path, 'w', encoding='utf-8', newline='') as f:
+            csv_writer = csv.writer(f, delimiter='\t')
+            csv_writer.writerow(('do_lower_case', 'max_length'))
+            csv_writer.writerow((do_lower_case, max_length))
+
+    def load(self) -> Tuple[bool, int]:
+        """
+        :return: do_lower_case, max_length
+        """
+
+        with open(self.path, encoding='utf-8') as f:
+            csv_reader = csv.reader(f, delimiter='\t')
+            next(csv_reader)
+
+            do_lower_case, max_length = next(csv_reader)
+
+        return do_lower_case == 'True', int(max_length)
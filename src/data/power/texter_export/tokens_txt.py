@@ -0,0 +1,33 @@
+"""
+The `POWER Tokens TXT` contains one token per line.
+
+**Example**
+
+::
+
+    [PAD]
+    [unused0]
+    [unused1]
+
+|
+"""
+
+from pathlib import Path
+from typing import List
+
+from data.base_file import BaseFile
+
+
+class TokensTxt(BaseFile):
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+
+    def save(self, tokens: List[str]) -> None:
+        with open(self.path, 'w', encoding='utf-8') as f:
+            for token in tokens:
+                f.write(f'{token}\n')
+
+    def load(self) -> List[str]:
+        with open(self.path, encoding='utf-8') as f:
+            return [line.rstrip('\n') for line in f]
@@ -10,13 +10,17 @@ import numpy as np
 from sklearn.metrics import precision_recall_fscore_support
 
 from data.irt.text.text_dir import TextDir
+from data.power.ruler_export.ruler_export_dir import RulerExportDir
 from data.power.ruler_pkl import RulerPkl
+from data.power.sent_embs.sent_embs_dir import SentEmbsDir
 from data.power.split.split_dir import SplitDir
 from data.power.texter_pkl import TexterPkl
 from models.ent import Ent
 from models.fact import Fact
 from models.pred import Pred
 from power.aggregator import Aggregator
+from power.ruler import Ruler
+from power.sent_cache import SentCache
 from util import calc_ap
 
 
@@ -36,8 +40,9 @@ def main():
 def parse_args():
     parser = ArgumentParser()
 
-    parser.add_argument('ruler_pkl', metavar='ruler-pkl',
-                        help='Path to (input) POWER Ruler PKL')
+    parser.add_argument('ruler', metavar='ruler',
+                        help='Path to (input) POWER Ruler PKL or POWER Ruler Export Directory, the latter is'
+                             ' memory-mapped instead of being loaded as a whole')
 
     parser.add_argument('texter_pkl', metavar='texter-pkl',
                         help='Path to (input) POWER Texter PKL')
@@ -51,15 +56,34 @@ def parse_args():
     parser.add_argument('text_dir', metavar='text-dir',
                         help='Path to (input) IRT Text Directory')
 
+    default_batch_size = 64
+    parser.add_argument('--batch-size', dest='batch_size', type=int, metavar='INT', default=default_batch_size,
+                        help='Number of entities predicted per forward pass (default: {})'.format(default_batch_size))
+
     parser.add_argument('--filter-known', dest='filter_known', action='store_true',
                         help='Filter out known valid triples')
 
+    precision_choices = ['fp32', 'bf16']
+    default_precision = 'fp32'
+    parser.add_argument('--precision', dest='precision', choices=precision_choices, default=default_precision,
+                        help='Precision of the encoder (default: {})'.format(default_precision))
+
     parser.add_argument('--random-seed', dest='random_seed', metavar='STR',
                         help='Use together with PYTHONHASHSEED for reproducibility')
 
+    parser.add_argument('--sent-cache', dest='sent_cache', metavar='STR',
+                        help='Path to (input/output) POWER Sentence Embeddings Directory that caches'
+                             ' the sentence embeddings across runs')
+
+    parser.add_argument('--stochastic', dest='stochastic', action='store_true',
+                        help='Predict in train mode, i.e. with dropout, as before the deterministic eval mode')
+
     parser.add_argument('--test', dest='test', action='store_true',
                         help='Evaluate on test data')
 
+    parser.add_argument('--top-rules', dest='top_rules', type=int, metavar='INT',
+                        help='Number of most confident rules that explain each prediction, all if not specified')
+
     args = parser.parse_args()
 
     #
@@ -67,13 +91,18 @@ def parse_args():
     #
 
     logging.info('Applied config:')
-    logging.info('    {:24} {}'.format('ruler-pkl', args.ruler_pkl))
+    logging.info('    {:24} {}'.format('ruler', args.ruler))
     logging.info('    {:24} {}'.format('texter-pkl', args.texter_pkl))
     logging.info('    {:24} {}'.format('sent-count', args.sent_count))
     logging.info('    {:24} {}'.format('split-dir', args.split_dir))
     logging.info('    {:24} {}'.format('text-dir', args.text_dir))
+    logging.info('    {:24} {}'.format('--batch-size', args.batch_size))
     logging.info('    {:24} {}'.format('--filter-known', args.filter_known))
+    logging.info('    {:24} {}'.format('--precision', args.precision))
+    logging.info('    {:24} {}'.format('--sent-cache', args.sent_cache))
+    logging.info('    {:24} {}'.format('--stochastic', args.stochastic))
     logging.info('    {:24} {}'.format('--test', args.test))
+    logging.info('    {:24} {}'.format('--top-rules', args.top_rules))
 
     logging.info('Environment variables:')
     logging.info('    {:24} {}'.format('PYTHONHASHSEED', os.getenv('PYTHONHASHSEED')))
@@ -82,23 +111,34 @@ def parse_args():
 
 
 def eval_power(args):
-    ruler_pkl_path = args.ruler_pkl
+    ruler_path = args.ruler
     texter_pkl_path = args.texter_pkl
     sent_count = args.sent_count
     split_dir_path = args.split_dir
     text_dir_path = args.text_dir
 
+    batch_size = args.batch_size
     filter_known = args.filter_known
+    precision = args.precision
+    sent_cache_path = args.sent_cache
+    stochastic = args.stochastic
     test = args.test
+    top_rules = args.top_rules
 
     #
-    # Check that (input) POWER Ruler PKL exists
+    # Check that (input) POWER Ruler PKL or POWER Ruler Export Directory exists
     #
 
-    logging.info('Check that (input) POWER Ruler PKL exists ...')
+    logging.info('Check that (input) POWER Ruler PKL or POWER Ruler Export Directory exists ...')
 
-    ruler_pkl = RulerPkl(Path(ruler_pkl_path))
-    ruler_pkl.check()
+    if Path(ruler_path).is_dir():
+        ruler_pkl = None
+        ruler_export_dir = RulerExportDir(Path(ruler_path))
+        ruler_export_dir.check()
+    else:
+        ruler_pkl = RulerPkl(Path(ruler_path))
+        ruler_pkl.check()
+        ruler_export_dir = None
 
     #
     # Check that (input) POWER Texter PKL exists
@@ -133,7 +173,10 @@ def eval_power(args):
 
     logging.info('Load ruler ...')
 
-    ruler = ruler_pkl.load()
+    if ruler_export_dir:
+        ruler = Ruler.load(ruler_export_dir)
+    else:
+        ruler = ruler_pkl.load()
 
     #
     # Load texter
@@ -142,12 +185,25 @@ def eval_power(args):
     logging.info('Load texter ...')
 
     texter = texter_pkl.load().cpu()
+    texter.precision = precision
+
+    #
+    # Attach sentence cache
+    #
+
+    if sent_cache_path:
+        logging.info('Attach sentence cache ...')
+
+        sent_embs_dir = SentEmbsDir(Path(sent_cache_path))
+        sent_embs_dir.create(overwrite=True)
+
+        texter.sent_cache = SentCache(sent_embs_dir, texter.fingerprint(), texter.bert.config.dim)
 
     #
     # Build POWER
     #
 
-    power = Aggregator(texter, ruler)
+    power = Aggregator(texter, ruler, top_rules)
 
     #
     # Load facts
@@ -202,6 +258,30 @@ def eval_power(args):
     else:
         eval_ent_to_sents = text_dir.ow_valid_sents_txt.load()
 
+    #
+    # Predict facts in batches of entities
+    #
+
+    logging.info('Predict facts ...')
+
+    pred_ents = []
+    sents_per_ent = []
+
+    for ent in eval_ents:
+        sents = list(eval_ent_to_sents[ent.id])[:sent_count]
+        if len(sents) < sent_count:
+            logging.warning(f'Only {len(sents)} sentences for entity "{ent.lbl}" ({ent.id}). Skipping.')
+            continue
+
+        pred_ents.append(ent)
+        sents_per_ent.append(sents)
+
+    preds_per_ent: List[List[Pred]] = []
+
+    for i in range(0, len(pred_ents), batch_size):
+        preds_per_ent += power.predict_batch(pred_ents[i:i + batch_size], sents_per_ent[i:i + batch_size],
+                                             stochastic)
+
     #
     # Evaluate
     #
@@ -213,20 +293,9 @@ def eval_power(args):
 
     all_ap = []
 
-    for ent in eval_ents:
+    for ent, preds in zip(pred_ents, preds_per_ent):
         logging.debug(f'Evaluate entity {ent} ...')
 
-        #
-        # Predict entity facts
-        #
-
-        sents = list(eval_ent_to_sents[ent.id])[:sent_count]
-        if len(sents) < sent_count:
-            logging.warning(f'Only {len(sents)} sentences for entity "{ent.lbl}" ({ent.id}). Skipping.')
-            continue
-
-        preds: List[Pred] = power.predict(ent, sents)
-
         if filter_known:
             preds = [pred for pred in preds if pred.fact not in known_facts]
 
@@ -8,11 +8,13 @@ from typing import List
 
 from sklearn.metrics import precision_recall_fscore_support
 
+from data.power.ruler_export.ruler_export_dir import RulerExportDir
 from data.power.ruler_pkl import RulerPkl
 from data.power.split.split_dir import SplitDir
 from models.ent import Ent
 from models.fact import Fact
 from models.pred import Pred
+from power.ruler import Ruler
 from util import calc_ap
 import numpy as np
 
@@ -33,8 +35,9 @@ def main():
 def parse_args():
     parser = ArgumentParser()
 
-    parser.add_argument('ruler_pkl', metavar='ruler-pkl',
-                        help='Path to (input) POWER Ruler PKL')
+    parser.add_argument('ruler', metavar='ruler',
+                        help='Path to (input) POWER Ruler PKL or POWER Ruler Export Directory, the latter is'
+                             ' memory-mapped instead of being loaded as a whole')
 
     parser.add_argument('split_dir', metavar='split-dir',
                         help='Path to (input) POWER Split Directory')
@@ -55,7 +58,7 @@ def parse_args():
     #
 
     logging.info('Applied config:')
-    logging.info('    {:24} {}'.format('ruler-pkl', args.ruler_pkl))
+    logging.info('    {:24} {}'.format('ruler', args.ruler))
     logging.info('    {:24} {}'.format('split-dir', args.split_dir))
     logging.info('    {:24} {}'.format('--filter-known', args.filter_known))
     logging.info('    {:24} {}'.format('--test', args.test))
@@ -67,20 +70,26 @@ def parse_args():
 
 
 def eval_ruler(args):
-    ruler_pkl_path = args.ruler_pkl
+    ruler_path = args.ruler
     split_dir_path = args.split_dir
 
     filter_known = args.filter_known
     test = args.test
 
     #
-    # Check that (input) POWER Ruler PKL exists
+    # Check that (input) POWER Ruler PKL or POWER Ruler Export Directory exists
     #
 
-    logging.info('Check that (input) POWER Ruler PKL exists ...')
+    logging.info('Check that (input) POWER Ruler PKL or POWER Ruler Export Directory exists ...')
 
-    ruler_pkl = RulerPkl(Path(ruler_pkl_path))
-    ruler_pkl.check()
+    if Path(ruler_path).is_dir():
+        ruler_pkl = None
+        ruler_export_dir = RulerExportDir(Path(ruler_path))
+        ruler_export_dir.check()
+    else:
+        ruler_pkl = RulerPkl(Path(ruler_path))
+        ruler_pkl.check()
+        ruler_export_dir = None
 
     #
     # Check that (input) POWER Split Directory exists
@@ -97,7 +106,10 @@ def eval_ruler(args):
 
     logging.info('Load ruler ...')
 
-    ruler = ruler_pkl.load()
+    if ruler_export_dir:
+        ruler = Ruler.load(ruler_export_dir)
+    else:
+        ruler = ruler_pkl.load()
 
     #
     # Load facts
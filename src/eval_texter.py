@@ -10,11 +10,13 @@ import numpy as np
 from sklearn.metrics import precision_recall_fscore_support
 
 from data.irt.text.text_dir import TextDir
+from data.power.sent_embs.sent_embs_dir import SentEmbsDir
 from data.power.split.split_dir import SplitDir
 from data.power.texter_pkl import TexterPkl
 from models.ent import Ent
 from models.fact import Fact
 from models.pred import Pred
+from power.sent_cache import SentCache
 from util import calc_ap
 
 
@@ -46,12 +48,29 @@ def parse_args():
     parser.add_argument('text_dir', metavar='text-dir',
                         help='Path to (input) IRT Text Directory')
 
+    default_batch_size = 64
+    parser.add_argument('--batch-size', dest='batch_size', type=int, metavar='INT', default=default_batch_size,
+                        help='Number of entities predicted per forward pass (default: {})'.format(default_batch_size))
+
     parser.add_argument('--filter-known', dest='filter_known', action='store_true',
                         help='Filter out known valid triples')
 
+    precision_choices = ['fp32', 'bf16']
+    default_precision = 'fp32'
+    parser.add_argument('--precision', dest='precision', choices=precision_choices, default=default_precision,
+                        help='Precision of the encoder, bf16 requires torch>=1.10 (default: {})'.format(
+                            default_precision))
+
     parser.add_argument('--random-seed', dest='random_seed', metavar='STR',
                         help='Use together with PYTHONHASHSEED for reproducibility')
 
+    parser.add_argument('--sent-cache', dest='sent_cache', metavar='STR',
+                        help='Path to (input/output) POWER Sentence Embeddings Directory that caches'
+                             ' the sentence embeddings across runs')
+
+    parser.add_argument('--stochastic', dest='stochastic', action='store_true',
+                        help='Predict in train mode, i.e. with dropout, as before the deterministic eval mode')
+
     parser.add_argument('--test', dest='test', action='store_true',
                         help='Evaluate on test data')
 
@@ -66,7 +85,11 @@ def parse_args():
     logging.info('    {:24} {}'.format('sent-count', args.sent_count))
     logging.info('    {:24} {}'.format('split-dir', args.split_dir))
     logging.info('    {:24} {}'.format('text-dir', args.text_dir))
+    logging.info('    {:24} {}'.format('--batch-size', args.batch_size))
     logging.info('    {:24} {}'.format('--filter-known', args.filter_known))
+    logging.info('    {:24} {}'.format('--precision', args.precision))
+    logging.info('    {:24} {}'.format('--sent-cache', args.sent_cache))
+    logging.info('    {:24} {}'.format('--stochastic', args.stochastic))
     logging.info('    {:24} {}'.format('--test', args.test))
 
     logging.info('Environment variables:')
@@ -81,7 +104,11 @@ def eval_texter(args):
     split_dir_path = args.split_dir
     text_dir_path = args.text_dir
 
+    batch_size = args.batch_size
     filter_known = args.filter_known
+    precision = args.precision
+    sent_cache_path = args.sent_cache
+    stochastic = args.stochastic
     test = args.test
 
     #
@@ -118,6 +145,19 @@ def eval_texter(args):
     logging.info('Load texter ...')
 
     texter = texter_pkl.load().cpu()
+    texter.precision = precision
+
+    #
+    # Attach sentence cache
+    #
+
+    if sent_cache_path:
+        logging.info('Attach sentence cache ...')
+
+        sent_embs_dir = SentEmbsDir(Path(sent_cache_path))
+        sent_embs_dir.create(overwrite=True)
+
+        texter.sent_cache = SentCache(sent_embs_dir, texter.fingerprint(), texter.bert.config.dim)
 
     #
     # Load facts
@@ -172,6 +212,30 @@ def eval_texter(args):
     else:
         eval_ent_to_sents = text_dir.ow_valid_sents_txt.load()
 
+    #
+    # Predict facts in batches of entities
+    #
+
+    logging.info('Predict facts ...')
+
+    pred_ents = []
+    sents_per_ent = []
+
+    for ent in eval_ents:
+        sents = list(eval_ent_to_sents[ent.id])[:sent_count]
+        if len(sents) < sent_count:
+            logging.warning(f'Only {len(sents)} sentences for entity "{ent.lbl}" ({ent.id}). Skipping.')
+            continue
+
+        pred_ents.append(ent)
+        sents_per_ent.append(sents)
+
+    preds_per_ent: List[List[Pred]] = []
+
+    for i in range(0, len(pred_ents), batch_size):
+        preds_per_ent += texter.predict_batch(pred_ents[i:i + batch_size], sents_per_ent[i:i + batch_size],
+                                              stochastic)
+
     #
     # Evaluate
     #
@@ -183,20 +247,9 @@ def eval_texter(args):
 
     all_ap = []
 
-    for ent in eval_ents:
+    for ent, preds in zip(pred_ents, preds_per_ent):
         logging.debug(f'Evaluate entity {ent} ...')
 
-        #
-        # Predict entity facts
-        #
-
-        sents = list(eval_ent_to_sents[ent.id])[:sent_count]
-        if len(sents) < sent_count:
-            logging.warning(f'Only {len(sents)} sentences for entity "{ent.lbl}" ({ent.id}). Skipping.')
-            continue
-
-        preds: List[Pred] = texter.predict(ent, sents)
-
         if filter_known:
             preds = [pred for pred in preds if pred.fact not in known_facts]
 
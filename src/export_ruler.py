@@ -0,0 +1,106 @@
+import logging
+import os
+import random
+from argparse import ArgumentParser
+from collections import defaultdict
+from pathlib import Path
+
+from data.power.ruler_export.ruler_export_dir import RulerExportDir
+from data.power.ruler_pkl import RulerPkl
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s | %(levelname)-7s | %(message)s', level=logging.INFO)
+
+    args = parse_args()
+
+    if args.random_seed:
+        random.seed(args.random_seed)
+
+    export_ruler(args)
+
+    logging.info('Finished successfully')
+
+
+def parse_args():
+    parser = ArgumentParser()
+
+    parser.add_argument('ruler_pkl', metavar='ruler-pkl',
+                        help='Path to (input) POWER Ruler PKL')
+
+    parser.add_argument('ruler_export_dir', metavar='ruler-export-dir',
+                        help='Path to (output) POWER Ruler Export Directory')
+
+    parser.add_argument('--overwrite', dest='overwrite', action='store_true',
+                        help='Overwrite output files if they already exist')
+
+    parser.add_argument('--random-seed', dest='random_seed', metavar='STR',
+                        help='Use together with PYTHONHASHSEED for reproducibility')
+
+    args = parser.parse_args()
+
+    #
+    # Log applied config
+    #
+
+    logging.info('Applied config:')
+    logging.info('    {:24} {}'.format('ruler-pkl', args.ruler_pkl))
+    logging.info('    {:24} {}'.format('ruler-export-dir', args.ruler_export_dir))
+    logging.info('    {:24} {}'.format('--overwrite', args.overwrite))
+    logging.info('    {:24} {}'.format('--random-seed', args.random_seed))
+
+    logging.info('Environment variables:')
+    logging.info('    {:24} {}'.format('PYTHONHASHSEED', os.getenv('PYTHONHASHSEED')))
+
+    return args
+
+
+def export_ruler(args):
+    ruler_pkl_path = args.ruler_pkl
+    ruler_export_dir_path = args.ruler_export_dir
+
+    overwrite = args.overwrite
+
+    #
+    # Check that (input) POWER Ruler PKL exists
+    #
+
+    logging.info('Check that (input) POWER Ruler PKL exists ...')
+
+    ruler_pkl = RulerPkl(Path(ruler_pkl_path))
+    ruler_pkl.check()
+
+    #
+    # Create (output) POWER Ruler Export Directory
+    #
+
+    logging.info('Create (output) POWER Ruler Export Directory ...')
+
+    ruler_export_dir = RulerExportDir(Path(ruler_export_dir_path))
+    ruler_export_dir.create(overwrite=overwrite)
+
+    #
+    # Load ruler
+    #
+
+    logging.info('Load ruler ...')
+
+    ruler = ruler_pkl.load()
+
+    #
+    # Save export
+    #
+
+    logging.info('Save export ...')
+
+    ruler.save(ruler_export_dir)
+
+    logging.info(f'Exported {len(ruler.ents)} entities, {len(ruler.rels)} facts and {len(ruler.rules)} rules')
+
+
+def get_defaultdict():
+    return defaultdict(list)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import logging
+import os
+import random
+from argparse import ArgumentParser
+from pathlib import Path
+
+import torch
+
+from data.power.texter_export.texter_export_dir import TexterExportDir
+from data.power.texter_pkl import TexterPkl
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s | %(levelname)-7s | %(message)s', level=logging.INFO)
+
+    args = parse_args()
+
+    if args.random_seed:
+        random.seed(args.random_seed)
+
+    export_texter(args)
+
+    logging.info('Finished successfully')
+
+
+def parse_args():
+    parser = ArgumentParser()
+
+    parser.add_argument('texter_pkl', metavar='texter-pkl',
+                        help='Path to (input) POWER Texter PKL')
+
+    parser.add_argument('texter_export_dir', metavar='texter-export-dir',
+                        help='Path to (output) POWER Texter Export Directory')
+
+    parser.add_argument('--overwrite', dest='overwrite', action='store_true',
+                        help='Overwrite output files if they already exist')
+
+    parser.add_argument('--random-seed', dest='random_seed', metavar='STR',
+                        help='Use together with PYTHONHASHSEED for reproducibility')
+
+    args = parser.parse_args()
+
+    #
+    # Log applied config
+    #
+
+    logging.info('Applied config:')
+    logging.info('    {:24} {}'.format('texter-pkl', args.texter_pkl))
+    logging.info('    {:24} {}'.format('texter-export-dir', args.texter_export_dir))
+    logging.info('    {:24} {}'.format('--overwrite', args.overwrite))
+    logging.info('    {:24} {}'.format('--random-seed', args.random_seed))
+
+    logging.info('Environment variables:')
+    logging.info('    {:24} {}'.format('PYTHONHASHSEED', os.getenv('PYTHONHASHSEED')))
+
+    return args
+
+
+def export_texter(args):
+    texter_pkl_path = args.texter_pkl
+    texter_export_dir_path = args.texter_export_dir
+
+    overwrite = args.overwrite
+
+    #
+    # Check that (input) POWER Texter PKL exists
+    #
+
+    logging.info('Check that (input) POWER Texter PKL exists ...')
+
+    texter_pkl = TexterPkl(Path(texter_pkl_path))
+    texter_pkl.check()
+
+    #
+    # Create (output) POWER Texter Export Directory
+    #
+
+    logging.info('Create (output) POWER Texter Export Directory ...')
+
+    texter_export_dir = TexterExportDir(Path(texter_export_dir_path))
+    texter_export_dir.create(overwrite=overwrite)
+
+    #
+    # Load texter
+    #
+
+    logging.info('Load texter ...')
+
+    texter = texter_pkl.load().cpu()
+    texter.eval()
+
+    #
+    # Trace texter
+    #
+
+    logging.info('Trace texter ...')
+
+    # The traced graph generalizes to other batch sizes, sentence counts and sentence lengths
+    encoded = texter.tokenizer(['Trace me.', 'Trace me as well.'] * 2, padding=True, return_tensors='pt')
+    toks_batch = encoded.input_ids.reshape(2, 2, -1)
+    masks_batch = encoded.attention_mask.reshape(2, 2, -1)
+
+    with torch.no_grad():
+        traced_texter = torch.jit.trace(texter, (toks_batch, masks_batch))
+
+    #
+    # Save export
+    #
+
+    logging.info('Save export ...')
+
+    texter_export_dir.texter_pt.save(traced_texter)
+
+    texter_export_dir.classes_tsv.save([(rel.id, rel.lbl, tail.id, tail.lbl) for rel, tail in texter.classes])
+
+    tok_to_id = texter.tokenizer.get_vocab()
+    texter_export_dir.vocab_txt.save(sorted(tok_to_id, key=tok_to_id.get))
+    texter_export_dir.special_tokens_txt.save(list(texter.tokenizer.get_added_vocab()))
+
+    # Texter.predict() crops sentences to Texter.embed()'s default sent_len of 64 tokens
+    texter_export_dir.tokenizer_tsv.save(texter.tokenizer.do_lower_case, 64)
+
+
+if __name__ == '__main__':
+    main()
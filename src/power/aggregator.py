@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 
 from models.ent import Ent
 from models.pred import Pred
@@ -9,18 +9,28 @@ from power.texter import Texter
 class Aggregator:
     texter: Texter
     ruler: Ruler
+    top_rules: Optional[int]  # Rules per Pred, all if None
 
-    def __init__(self, texter: Texter, ruler: Ruler):
+    def __init__(self, texter: Texter, ruler: Ruler, top_rules: int = None):
         super().__init__()
 
         self.texter = texter
         self.ruler = ruler
+        self.top_rules = top_rules
 
-    def predict(self, ent: Ent, sents: List[str]) -> List[Pred]:
-        preds = []
+    def predict(self, ent: Ent, sents: List[str], stochastic: bool = False) -> List[Pred]:
+        return self.predict_batch([ent], [sents], stochastic)[0]
+
+    def predict_batch(self, ents: List[Ent], sents_per_ent: List[List[str]], stochastic: bool = False) \
+            -> List[List[Pred]]:
+        texter_preds_per_ent = self.texter.predict_batch(ents, sents_per_ent, stochastic)
 
-        texter_preds = self.texter.predict(ent, sents)
-        ruler_preds = self.ruler.predict(ent)
+        return [self.aggregate(texter_preds, self.ruler.predict(ent, self.top_rules))
+                for ent, texter_preds in zip(ents, texter_preds_per_ent)]
+
+    @staticmethod
+    def aggregate(texter_preds: List[Pred], ruler_preds: List[Pred]) -> List[Pred]:
+        preds = []
 
         texter_fact_to_pred = {pred.fact: pred for pred in texter_preds}
         ruler_fact_to_pred = {pred.fact: pred for pred in ruler_preds}
@@ -0,0 +1,386 @@
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import List, Dict, Tuple, Optional, Set
+
+import numpy as np
+from neo4j import GraphDatabase
+from scipy.sparse import csr_matrix, diags, spmatrix
+
+from models.ent import Ent
+from models.fact import Fact
+from models.rel import Rel
+from models.rule import Rule
+from models.var import Var
+
+
+class Grounder(ABC):
+    """
+    Grounds rules in the knowledge graph, i.e. in the train facts and the
+    known valid (or test) facts. Subclasses provide the graph lookups.
+
+    Like AnyBURL, rules are grounded under object identity, i.e. different
+    variables are bound to different entities, and no variable is bound to
+    an entity that occurs in the rule.
+    """
+
+    ent_to_lbl: Dict[int, str]
+
+    def __init__(self, ent_to_lbl: Dict[int, str]):
+        self.ent_to_lbl = ent_to_lbl
+
+    @abstractmethod
+    def query_heads(self, rel: Rel, tail: Ent) -> List[int]:
+        """
+        :return: [head], the heads of the facts (head, rel, tail)
+        """
+
+        pass
+
+    @abstractmethod
+    def query_tails(self, head: Ent, rel: Rel) -> List[int]:
+        """
+        :return: [tail], the tails of the facts (head, rel, tail)
+        """
+
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def ground(self, rule: Rule, max_facts: int = None) -> Optional[List[Fact]]:
+        """
+        Supports rules with a single body fact whose head and rule head both
+        contain one variable and one entity.
+
+        :param max_facts: Maximum number of facts per rule, all if None. The facts
+                          are cut arbitrarily, i.e. the ones for the lowest entity
+                          IDs are kept.
+        :return: Facts predicted by the rule, None if the rule is not supported
+        """
+
+        if len(rule.body) != 1:
+            return None
+
+        #
+        # Ground rule body
+        #
+
+        body_fact = rule.body[0]
+
+        if type(body_fact.head) == Var and type(body_fact.tail) == Ent:
+            ents = self.query_heads(body_fact.rel, body_fact.tail)
+
+        elif type(body_fact.head) == Ent and type(body_fact.tail) == Var:
+            ents = self.query_tails(body_fact.head, body_fact.rel)
+
+        else:
+            return None
+
+        ents = sorted(set(ents) - get_rule_ents(rule))[:max_facts]
+        ents = [Ent(ent, self.ent_to_lbl[ent]) for ent in ents]
+
+        #
+        # Instantiate rule head
+        #
+
+        head_fact = rule.head
+
+        if type(head_fact.head) == Var and type(head_fact.tail) == Ent:
+            return [Fact(ent, head_fact.rel, head_fact.tail) for ent in ents]
+
+        elif type(head_fact.head) == Ent and type(head_fact.tail) == Var:
+            return [Fact(head_fact.head, head_fact.rel, ent) for ent in ents]
+
+        else:
+            return None
+
+
+class IndexGrounder(Grounder):
+    """
+    Looks up the facts in in-memory indexes over the triples, built once,
+    instead of querying a database per rule
+    """
+
+    rel_tail_to_heads: Dict[Tuple[int, int], List[int]]
+    head_rel_to_tails: Dict[Tuple[int, int], List[int]]
+
+    def __init__(self, triples: List[Tuple[int, int, int]], ent_to_lbl: Dict[int, str]):
+        """
+        :param triples: [(head, rel, tail)]
+        """
+
+        super().__init__(ent_to_lbl)
+
+        self.rel_tail_to_heads = defaultdict(list)
+        self.head_rel_to_tails = defaultdict(list)
+
+        for head, rel, tail in set(triples):
+            self.rel_tail_to_heads[(rel, tail)].append(head)
+            self.head_rel_to_tails[(head, rel)].append(tail)
+
+    def query_heads(self, rel: Rel, tail: Ent) -> List[int]:
+        return self.rel_tail_to_heads.get((rel.id, tail.id), [])
+
+    def query_tails(self, head: Ent, rel: Rel) -> List[int]:
+        return self.head_rel_to_tails.get((head.id, rel.id), [])
+
+
+class MatrixGrounder(Grounder):
+    """
+    Represents each relation as a sparse adjacency matrix over the entities
+    and grounds a rule's body path by multiplying the matrices of its facts,
+    transposed for facts that are traversed from tail to head. Besides the
+    single body fact rules, supports
+
+    * cyclic rules with up to 3 body facts, e.g. `r(X,Y) <= s(X,A), t(A,Y)`,
+      whose path leads from X to Y and gives a matrix of (X, Y) pairs
+    * acyclic rules whose path leads from the rule head's variable to an
+      entity, e.g. `r(X,c) <= s(X,A), t(A,d)`, with up to 3 body facts, or
+      to a variable that only occurs once, e.g. `r(X,c) <= s(X,A)`, with up
+      to 2 body facts. They give a vector over the head variable.
+
+    Vectors are evaluated from the end of the path, so that no entity x entity
+    matrix has to be multiplied.
+
+    For object identity, the matrices count paths. The rule's entities are
+    masked, and the diagonals are removed for adjacent variables. Paths that
+    bind non-adjacent variables to the same entity are subtracted.
+    """
+
+    ent_count: int
+    rel_to_adj: Dict[int, csr_matrix]
+
+    def __init__(self, triples: List[Tuple[int, int, int]], ent_to_lbl: Dict[int, str]):
+        """
+        :param triples: [(head, rel, tail)]
+        """
+
+        super().__init__(ent_to_lbl)
+
+        self.ent_count = max(ent_to_lbl) + 1
+
+        rel_to_heads = defaultdict(list)
+        rel_to_tails = defaultdict(list)
+
+        for head, rel, tail in set(triples):
+            rel_to_heads[rel].append(head)
+            rel_to_tails[rel].append(tail)
+
+        self.rel_to_adj = {rel: csr_matrix((np.ones(len(rel_to_heads[rel]), dtype=np.int64),
+                                            (rel_to_heads[rel], rel_to_tails[rel])),
+                                           shape=(self.ent_count, self.ent_count))
+                           for rel in rel_to_heads}
+
+    def get_adj(self, rel: Rel) -> spmatrix:
+        if rel.id not in self.rel_to_adj:
+            return csr_matrix((self.ent_count, self.ent_count), dtype=np.int64)
+
+        return self.rel_to_adj[rel.id]
+
+    def query_heads(self, rel: Rel, tail: Ent) -> List[int]:
+        return self.get_adj(rel)[:, tail.id].nonzero()[0].tolist()
+
+    def query_tails(self, head: Ent, rel: Rel) -> List[int]:
+        return self.get_adj(rel)[head.id].nonzero()[1].tolist()
+
+    def ground(self, rule: Rule, max_facts: int = None) -> Optional[List[Fact]]:
+        head_fact = rule.head
+
+        #
+        # Start the body path at the rule head's variable, which is X for cyclic rules
+        #
+
+        if type(head_fact.head) == Var:
+            start_var = head_fact.head
+            end_var = head_fact.tail if type(head_fact.tail) == Var else None
+
+        elif type(head_fact.tail) == Var:
+            start_var = head_fact.tail
+            end_var = None
+
+        else:
+            return None
+
+        if not 1 <= len(rule.body) <= 3:
+            return None
+
+        # Body paths are usually written from the start variable, otherwise follow them backwards
+        body = rule.body
+        if start_var not in (body[0].head, body[0].tail):
+            body = body[::-1]
+
+        #
+        # Follow the body path: [adj], matrices from the current variable to the next node
+        #
+
+        # Variables must not be bound to the rule's entities
+        var_mask = np.ones(self.ent_count, dtype=np.int64)
+        var_mask[list(get_rule_ents(rule))] = 0
+        var_mask = diags(var_mask, dtype=np.int64)
+
+        adjs = []
+        path_vars = [start_var]
+
+        for i, body_fact in enumerate(body):
+            if body_fact.head == path_vars[-1]:
+                adj = self.get_adj(body_fact.rel)
+                next_node = body_fact.tail
+
+            elif body_fact.tail == path_vars[-1]:
+                adj = self.get_adj(body_fact.rel).T
+                next_node = body_fact.head
+
+            else:
+                return None
+
+            adj = var_mask @ adj
+
+            if type(next_node) == Ent:
+                if end_var is not None or i < len(body) - 1:
+                    return None
+
+                adjs.append(adj[:, next_node.id].toarray().ravel())
+
+            else:
+                if next_node in path_vars or next_node == end_var and i < len(body) - 1:
+                    return None
+
+                adj = (adj @ var_mask).tocsr()
+                adj.setdiag(0)
+                adj.eliminate_zeros()
+
+                adjs.append(adj)
+                path_vars.append(next_node)
+
+        #
+        # Cyclic rule: multiply path matrices to get the (start, end) pairs
+        #
+
+        if end_var is not None:
+            if path_vars[-1] != end_var:
+                return None
+
+            if len(adjs) == 1:
+                path = adjs[0]
+
+            elif len(adjs) == 2:
+                path = adjs[0] @ adjs[1]
+
+            else:
+                first, second, third = adjs
+
+                # Paths X-A-B-Y with B != X
+                first_second = (first @ second).tocsr()
+                first_second.setdiag(0)
+
+                # Minus paths X-Y-B-Y, i.e. with A == Y
+                ends_with_loop = np.asarray(second.multiply(third.T).sum(axis=1)).ravel()
+                path = first_second @ third - first @ diags(ends_with_loop, dtype=np.int64) \
+                    + first.multiply(second.T).multiply(third)
+
+            path = path.tocsr()
+            path.setdiag(0)
+            path.eliminate_zeros()
+            path.sort_indices()
+
+            starts, ends = path.nonzero()
+            starts, ends = starts[:max_facts].tolist(), ends[:max_facts].tolist()
+
+            return [Fact(Ent(start, self.ent_to_lbl[start]), head_fact.rel, Ent(end, self.ent_to_lbl[end]))
+                    for start, end in zip(starts, ends)]
+
+        #
+        # Acyclic rule: multiply path matrices from the end with the vector that counts the
+        # last variable's bindings to the body's entity, or to any entity for a dangling variable
+        #
+
+        dangling = type(adjs[-1]) != np.ndarray
+
+        if dangling and len(adjs) == 3:
+            return None
+
+        if dangling:
+            vec = adjs[-1].getnnz(axis=1)
+        else:
+            vec = adjs[-1]
+
+        if len(adjs) == 2:
+            vec = adjs[0] @ vec
+
+            # Minus paths X-A-X, whose dangling variable is bound to X
+            if dangling:
+                vec = vec - np.asarray(adjs[0].multiply(adjs[1].T).sum(axis=1)).ravel()
+
+        elif len(adjs) == 3:
+            # Paths X-A-B with B != X
+            first_second = (adjs[0] @ adjs[1]).tocsr()
+            first_second.setdiag(0)
+
+            vec = first_second @ vec
+
+        starts = np.flatnonzero(vec > 0)[:max_facts].tolist()
+        ents = [Ent(start, self.ent_to_lbl[start]) for start in starts]
+
+        if start_var == head_fact.head:
+            return [Fact(ent, head_fact.rel, head_fact.tail) for ent in ents]
+        else:
+            return [Fact(head_fact.head, head_fact.rel, ent) for ent in ents]
+
+
+class Neo4jGrounder(Grounder):
+    """
+    Queries the facts from a running Neo4j instance into which
+    `load_neo4j_graph.py` has loaded the graph
+    """
+
+    def __init__(self, url: str, username: str, password: str, ent_to_lbl: Dict[int, str]):
+        super().__init__(ent_to_lbl)
+
+        self.driver = GraphDatabase.driver(url, auth=(username, password))
+        self.session = self.driver.session()
+
+    def query_heads(self, rel: Rel, tail: Ent) -> List[int]:
+        records = self.session.write_transaction(query_facts_by_rel_tail, rel=rel, tail=tail)
+
+        return [head['id'] for head, _, _ in records]
+
+    def query_tails(self, head: Ent, rel: Rel) -> List[int]:
+        records = self.session.write_transaction(query_facts_by_head_rel, head=head, rel=rel)
+
+        return [tail['id'] for _, _, tail in records]
+
+    def close(self) -> None:
+        self.session.close()
+        self.driver.close()
+
+
+def get_rule_ents(rule: Rule) -> Set[int]:
+    """
+    :return: IDs of the entities that occur in the rule's head or body
+    """
+
+    return {node.id for fact in [rule.head] + rule.body for node in (fact.head, fact.tail) if type(node) == Ent}
+
+
+def query_facts_by_rel_tail(tx, rel: Rel, tail: Ent):
+    cypher = f'''
+        MATCH (head)-[rel:R_{rel.id}]->(tail)
+        WHERE tail.id = $tail_id
+        RETURN head, rel, tail
+    '''
+
+    records = tx.run(cypher, tail_id=tail.id)
+
+    return list(records)
+
+
+def query_facts_by_head_rel(tx, head: Ent, rel: Rel):
+    cypher = f'''
+        MATCH (head)-[rel:R_{rel.id}]->(tail)
+        WHERE head.id = $head_id
+        RETURN head, rel, tail
+    '''
+
+    records = tx.run(cypher, head_id=head.id)
+
+    return list(records)
@@ -1,5 +1,8 @@
 from typing import List, Dict, Tuple
 
+import numpy as np
+
+from data.power.ruler_export.ruler_export_dir import RulerExportDir
 from models.ent import Ent
 from models.fact import Fact
 from models.pred import Pred
@@ -8,15 +11,191 @@ from models.rule import Rule
 
 
 class Ruler:
-    pred: Dict[Ent, Dict[Tuple[Rel, Ent], List[Rule]]]
+    """
+    Frozen, CSR-like store of the facts predicted by the rules. The facts
+    predicted for the i-th entity in `ents` are the slice
+    `offsets[i]:offsets[i + 1]` of `rels`, `tails` and `confs`. The rules that
+    predict the j-th fact are the slice `rule_offsets[j]:rule_offsets[j + 1]`
+    of `rule_ids`, which point into the table of distinct `rules`. A fact's
+    rules are ranked by descending confidence, so that `confs` holds the
+    first rule's confidence.
+
+    The predicted facts' Ents and Rels are only created, with their labels,
+    when an entity is predicted.
+
+    A Ruler loaded from a `POWER Ruler Export Directory` memory-maps the
+    arrays. Its rules and labels are only loaded on first access.
+    """
+
+    ents: np.ndarray  # int32 (ent count), sorted
+    offsets: np.ndarray  # int64 (ent count + 1)
+
+    rels: np.ndarray  # int32 (fact count)
+    tails: np.ndarray  # int32 (fact count)
+    confs: np.ndarray  # float64 (fact count), best rule's confidence
+
+    rule_offsets: np.ndarray  # int64 (fact count + 1)
+    rule_ids: np.ndarray  # int32 (rule ref count), ranked per fact
+    rules: List[Rule]
+
+    ent_to_lbl: Dict[int, str]
+    rel_to_lbl: Dict[int, str]
+
+    @staticmethod
+    def from_pred(pred: Dict[Ent, Dict[Tuple[Rel, Ent], List[Rule]]]) -> 'Ruler':
+        """
+        Build the Ruler from the nested dicts that mapped entities to their
+        predicted (rel, tail)s and those to their rules
+
+        :param pred: {head: {(rel, tail): [rule]}}
+        """
+
+        ruler = Ruler()
+
+        heads = sorted(pred, key=lambda ent: ent.id)
+
+        offsets = [0]
+        rels = []
+        tails = []
+        confs = []
+
+        rule_offsets = [0]
+        rule_ids = []
+
+        # The same Rule objects are referenced by many facts. Rules are unhashable
+        # because of their body list, so they are interned by identity.
+        rule_to_id: Dict[int, int] = {}
+        rules = []
+
+        ent_to_lbl = {}
+        rel_to_lbl = {}
+
+        for head in heads:
+            ent_to_lbl[head.id] = head.lbl
+
+            for (rel, tail), fact_rules in pred[head].items():
+                fact_rules = sorted(fact_rules, key=lambda rule: rule.conf, reverse=True)
+
+                rels.append(rel.id)
+                tails.append(tail.id)
+                confs.append(fact_rules[0].conf)
+
+                rel_to_lbl[rel.id] = rel.lbl
+                ent_to_lbl[tail.id] = tail.lbl
+
+                for rule in fact_rules:
+                    if id(rule) not in rule_to_id:
+                        rule_to_id[id(rule)] = len(rules)
+                        rules.append(rule)
+
+                    rule_ids.append(rule_to_id[id(rule)])
+
+                rule_offsets.append(len(rule_ids))
+
+            offsets.append(len(rels))
+
+        ruler.ents = np.array([head.id for head in heads], dtype=np.int32)
+        ruler.offsets = np.array(offsets, dtype=np.int64)
+
+        ruler.rels = np.array(rels, dtype=np.int32)
+        ruler.tails = np.array(tails, dtype=np.int32)
+        ruler.confs = np.array(confs, dtype=np.float64)
+
+        ruler.rule_offsets = np.array(rule_offsets, dtype=np.int64)
+        ruler.rule_ids = np.array(rule_ids, dtype=np.int32)
+        ruler.rules = rules
+
+        ruler.ent_to_lbl = ent_to_lbl
+        ruler.rel_to_lbl = rel_to_lbl
+
+        return ruler
+
+    @staticmethod
+    def load(ruler_export_dir: RulerExportDir) -> 'Ruler':
+        ruler = Ruler()
+
+        ruler.ents = ruler_export_dir.ents_npy.load()
+        ruler.offsets = ruler_export_dir.offsets_npy.load()
+
+        ruler.rels = ruler_export_dir.rels_npy.load()
+        ruler.tails = ruler_export_dir.tails_npy.load()
+        ruler.confs = ruler_export_dir.confs_npy.load()
+
+        ruler.rule_offsets = ruler_export_dir.rule_offsets_npy.load()
+        ruler.rule_ids = ruler_export_dir.rule_ids_npy.load()
+
+        ruler._ruler_export_dir = ruler_export_dir
+
+        return ruler
+
+    def save(self, ruler_export_dir: RulerExportDir) -> None:
+        ruler_export_dir.ents_npy.save(self.ents)
+        ruler_export_dir.offsets_npy.save(self.offsets)
+
+        ruler_export_dir.rels_npy.save(self.rels)
+        ruler_export_dir.tails_npy.save(self.tails)
+        ruler_export_dir.confs_npy.save(self.confs)
+
+        ruler_export_dir.rule_offsets_npy.save(self.rule_offsets)
+        ruler_export_dir.rule_ids_npy.save(self.rule_ids)
+        ruler_export_dir.rules_pkl.save(self.rules)
+
+        ruler_export_dir.entities_tsv.save(self.ent_to_lbl)
+        ruler_export_dir.relations_tsv.save(self.rel_to_lbl)
+
+    def __getattr__(self, name: str):
+        # Only called for missing attributes, i.e. for the lazily loaded parts of an export
+        if name in ('rules', 'ent_to_lbl', 'rel_to_lbl') and '_ruler_export_dir' in self.__dict__:
+            ruler_export_dir = self.__dict__['_ruler_export_dir']
+
+            if name == 'rules':
+                self.rules = ruler_export_dir.rules_pkl.load()
+            elif name == 'ent_to_lbl':
+                self.ent_to_lbl = ruler_export_dir.entities_tsv.load()
+            else:
+                self.rel_to_lbl = ruler_export_dir.relations_tsv.load()
+
+            return self.__dict__[name]
+
+        raise AttributeError(name)
+
+    def __setstate__(self, state: Dict) -> None:
+        # Convert Rulers that were pickled with the nested dicts
+        if 'pred' in state:
+            state = Ruler.from_pred(state['pred']).__dict__
+
+        self.__dict__.update(state)
+
+    def predict(self, ent: Ent, top_rules: int = None) -> List[Pred]:
+        """
+        :param top_rules: Maximum number of most confident rules per Pred, all if None
+        """
+
+        i = np.searchsorted(self.ents, ent.id)
+
+        if i == len(self.ents) or self.ents[i] != ent.id:
+            return []
+
+        start, end = self.offsets[i], self.offsets[i + 1]
+
+        rels = self.rels[start:end].tolist()
+        tails = self.tails[start:end].tolist()
+        confs = self.confs[start:end].tolist()
+        rule_offsets = self.rule_offsets[start:end + 1].tolist()
 
-    def predict(self, ent: Ent) -> List[Pred]:
         preds = []
 
-        for (rel, tail), rules in self.pred[ent].items():
-            rules = list(rules)
-            rules.sort(key=lambda rule: rule.conf, reverse=True)
+        for j, (rel_id, tail_id, conf) in enumerate(zip(rels, tails, confs)):
+            rel = Rel(rel_id, self.rel_to_lbl[rel_id])
+            tail = Ent(tail_id, self.ent_to_lbl[tail_id])
+
+            rule_start, rule_end = rule_offsets[j], rule_offsets[j + 1]
+
+            if top_rules is not None:
+                rule_end = min(rule_end, rule_start + top_rules)
+
+            rules = [self.rules[rule_id] for rule_id in self.rule_ids[rule_start:rule_end].tolist()]
 
-            preds.append(Pred(Fact(ent, rel, tail), rules[0].conf, [], rules))
+            preds.append(Pred(Fact(ent, rel, tail), conf, [], rules))
 
         return preds
@@ -0,0 +1,133 @@
+from collections import OrderedDict
+from hashlib import sha256
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from data.power.sent_embs.sent_embs_dir import SentEmbsDir
+
+
+class SentCache:
+    """
+    Two-tier cache for the sentence embeddings calculated by the `Texter`'s
+    encoder. Recently used embeddings are kept in an in-memory LRU, all
+    embeddings are persisted to a `POWER Sentence Embeddings Directory`
+    that is memory-mapped on lookup.
+
+    The keys include the fingerprint of the model the cache was created for.
+    Therefore, a cache directory can be shared by multiple models, also by
+    concurrent processes, which append under the directory's lock.
+    """
+
+    sent_embs_dir: SentEmbsDir
+    fingerprint: str
+    emb_size: int
+    max_size: int
+
+    lru: OrderedDict
+    key_to_row: Dict[str, int]
+    disk_embs: np.ndarray
+    file_sizes: Tuple[int, int]  # (keys size, embs size) after the last sync
+
+    def __init__(self, sent_embs_dir: SentEmbsDir, fingerprint: str, emb_size: int, max_size: int = 100000):
+        self.sent_embs_dir = sent_embs_dir
+        self.fingerprint = fingerprint
+        self.emb_size = emb_size
+        self.max_size = max_size
+
+        self.lru = OrderedDict()
+
+        self.key_to_row = {}
+        self.disk_embs = np.empty((0, emb_size), dtype=np.float32)
+        self.file_sizes = (-1, -1)
+
+        with sent_embs_dir.lock():
+            self.sync()
+
+    def sync(self) -> None:
+        """
+        Reload the keys and embeddings if the files have been changed by
+        another process. A crash during an append can leave embeddings without
+        keys, or a partial key or embedding. Both files are cut to the
+        complete rows that have a key, so that later appends stay aligned.
+
+        Must be called while holding the directory's lock.
+        """
+
+        keys_txt = self.sent_embs_dir.keys_txt
+        embs_bin = self.sent_embs_dir.embs_bin
+
+        if self.get_file_sizes() == self.file_sizes:
+            return
+
+        keys = keys_txt.load()
+        embs = embs_bin.load(self.emb_size)
+
+        row_count = min(len(keys), len(embs))
+        keys = keys[:row_count]
+
+        keys_size, embs_size = self.get_file_sizes()
+
+        if keys_size != sum(len(key.encode('utf-8')) + 1 for key in keys):
+            keys_txt.save(keys)
+
+        if embs_size != row_count * 4 * self.emb_size:
+            embs_bin.truncate(row_count, self.emb_size)
+
+        self.key_to_row = {key: row for row, key in enumerate(keys)}
+        self.disk_embs = embs_bin.load(self.emb_size)
+        self.file_sizes = self.get_file_sizes()
+
+    def get_file_sizes(self) -> Tuple[int, int]:
+        return (self.sent_embs_dir.keys_txt.path.stat().st_size,
+                self.sent_embs_dir.embs_bin.path.stat().st_size)
+
+    def key(self, sent: str, pool_len: int) -> str:
+        return sha256(f'{self.fingerprint}\t{pool_len}\t{sent}'.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        if key in self.lru:
+            self.lru.move_to_end(key)
+            return self.lru[key]
+
+        if key in self.key_to_row:
+            emb = np.array(self.disk_embs[self.key_to_row[key]])
+            self.remember(key, emb)
+            return emb
+
+        return None
+
+    def put(self, keys: List[str], embs: np.ndarray) -> None:
+        """
+        :param keys: [key]
+        :param embs: (key count, emb size)
+        """
+
+        for key, emb in zip(keys, embs):
+            self.remember(key, emb)
+
+        with self.sent_embs_dir.lock():
+            self.sync()
+
+            new_keys = []
+            new_rows = []
+
+            for key, emb in zip(keys, embs):
+                if key not in self.key_to_row:
+                    self.key_to_row[key] = len(self.disk_embs) + len(new_keys)
+                    new_keys.append(key)
+                    new_rows.append(emb)
+
+            if new_keys:
+                self.sent_embs_dir.embs_bin.append(np.stack(new_rows))
+                self.sent_embs_dir.keys_txt.append(new_keys)
+
+                self.disk_embs = self.sent_embs_dir.embs_bin.load(self.emb_size)
+                self.file_sizes = self.get_file_sizes()
+
+    def remember(self, key: str, emb: np.ndarray) -> None:
+        self.lru[key] = emb
+        self.lru.move_to_end(key)
+
+        if len(self.lru) > self.max_size:
+            self.lru.popitem(last=False)
@@ -1,14 +1,19 @@
-from typing import List, Tuple
+from copy import deepcopy
+from hashlib import sha256
+from typing import List, Tuple, Optional
 
+import numpy as np
 import torch
 from torch import Tensor
-from torch.nn import Parameter, Softmax, Module, Sigmoid
+from torch.nn import Parameter, Softmax, Module, Sigmoid, Linear
+from torch.quantization import quantize_dynamic
 from transformers import DistilBertModel, DistilBertTokenizer
 
 from models.ent import Ent
 from models.fact import Fact
 from models.pred import Pred
 from models.rel import Rel
+from power.sent_cache import SentCache
 
 
 class Texter(Module):
@@ -21,11 +26,16 @@ class Texter(Module):
 
     classes: List[Tuple[Rel, Ent]]
 
+    # Not set by the constructor, assign a SentCache created for this Texter's fingerprint()
+    sent_cache: Optional[SentCache] = None
+
+    # 'fp32' or 'bf16', the encoder's compute precision. The class head always runs in fp32.
+    precision: str = 'fp32'
+
     def __init__(self, pre_trained: str, classes: List[Tuple[Rel, Ent]]):
         super().__init__()
 
-        self.tokenizer = DistilBertTokenizer.from_pretrained(pre_trained)
-        self.tokenizer.add_tokens(['[MENTION_START]', '[MENTION_END]'], special_tokens=True)
+        self.tokenizer = self.create_tokenizer(pre_trained)
 
         self.bert = DistilBertModel.from_pretrained(pre_trained)
 
@@ -38,24 +48,122 @@ class Texter(Module):
 
         self.classes = classes
 
-    def predict(self, ent: Ent, sents: List[str]) -> List[Pred]:
-        encoded = self.tokenizer(sents, padding=True, truncation=True, max_length=64, return_tensors='pt')
+    @staticmethod
+    def create_tokenizer(pre_trained: str) -> DistilBertTokenizer:
+        tokenizer = DistilBertTokenizer.from_pretrained(pre_trained)
+        tokenizer.add_tokens(['[MENTION_START]', '[MENTION_END]'], special_tokens=True)
+
+        return tokenizer
+
+    def predict(self, ent: Ent, sents: List[str], stochastic: bool = False, top_k: int = None,
+                threshold: float = 0.5) -> List[Pred]:
+        return self.predict_batch([ent], [sents], stochastic, top_k=top_k, threshold=threshold)[0]
+
+    def predict_batch(self, ents: List[Ent], sents_per_ent: List[List[str]], stochastic: bool = False,
+                      bucket_size: int = 256, top_k: int = None, threshold: float = 0.5) -> List[List[Pred]]:
+        """
+        Predict the facts of multiple entities in a single forward pass. The entities
+        may come with different numbers of sentences, but each needs at least one.
+
+        By default, the prediction runs in eval mode without tracking gradients
+        and is therefore deterministic. Set <stochastic> to predict in train mode,
+        i.e. with dropout and gradients.
+
+        :param ents: [ent]
+        :param sents_per_ent: [[sent]], one list of sentences per entity
+        :param stochastic: Predict in train mode
+        :param bucket_size: Maximum number of sentences per encoder pass, see encode_bucketed()
+        :param top_k: Only predict the <top_k> most probable classes, if given
+        :param threshold: Only predict classes whose probability exceeds <threshold>
+        :return: [[pred]], one list of predictions per entity, sorted by confidence
+        """
+
+        sent_counts = [len(sents) for sents in sents_per_ent]
+
+        was_training = self.training
+        self.train(stochastic)
+
+        with torch.set_grad_enabled(stochastic):
+            flat_sent_batch, _ = self.embed(sents_per_ent, bucket_size)
+
+            sents_batch, sent_masks_batch = self.scatter_sents(flat_sent_batch, sent_counts)
+
+            logits_batch, softs_batch = self.classify(sents_batch, sent_masks_batch)
+
+        self.train(was_training)
+
+        probs_batch = Sigmoid()(logits_batch).detach()
+        softs_batch = softs_batch.detach()
+
+        # Select the most probable classes above the threshold, sorted by probability
+        #
+        # < probs_batch         (batch_size, class_count)
+        # > top_probs_batch     (batch_size, k)
+        # > top_classes_batch   (batch_size, k)
+        # > top_counts          [top_count], number of selected classes per entity
+
+        class_count = len(self.classes)
+        k = class_count if top_k is None else min(top_k, class_count)
+
+        top_probs_batch, top_classes_batch = probs_batch.topk(k, dim=1)
+        top_counts = (top_probs_batch > threshold).sum(dim=1).tolist()
+
+        preds_per_ent = []
+
+        for b, (ent, sents, top_count) in enumerate(zip(ents, sents_per_ent, top_counts)):
+            top_classes = top_classes_batch[b, :top_count]
+
+            # Gather the sentence attentions of the selected classes only
+            #
+            # < softs_batch  (batch_size, class_count, sent_count)
+            # > top_softs    (top_count, ent_sent_count)
+
+            top_softs = softs_batch[b, top_classes, :len(sents)]
+
+            preds = []
 
-        self.train()
+            for c, prob, softs in zip(top_classes.tolist(), top_probs_batch[b, :top_count].tolist(),
+                                      top_softs.tolist()):
+                rel, tail = self.classes[c]
+                preds.append(Pred(Fact(ent, rel, tail), prob, list(zip(sents, softs)), []))
 
-        logits_batch, softs_batch, = self.forward(encoded.input_ids.unsqueeze(0), encoded.attention_mask.unsqueeze(0))
-        logits = logits_batch[0]
-        probs = Sigmoid()(logits).detach().numpy()
-        softs = softs_batch[0].detach().numpy()
+            preds_per_ent.append(preds)
 
-        pred = {Fact(ent, rel, tail): (probs[c].item(), [(sents[i], softs[c][i].item()) for i in range(len(sents))])
-                for c, (rel, tail) in enumerate(self.classes) if probs[c] > 0.5}
+        return preds_per_ent
 
-        preds = [Pred(fact, conf, sents, []) for fact, (conf, sents) in pred.items()]
+    def embed(self, sents_per_ent: List[List[str]], bucket_size: int = 256, sent_len: int = 64) \
+            -> Tuple[Tensor, Tensor]:
+        """
+        Embed the entities' sentences on the Texter's device, in the current mode.
+        In eval mode, the sentence cache is used if set.
+
+        :param sents_per_ent: [[sent]], one list of sentences per entity
+        :param bucket_size: Maximum number of sentences per encoder pass, see encode_bucketed()
+        :param sent_len: Length long sentences are cropped to
+        :return: flat_sent_batch (total sent count, emb_size), pool_lens (total sent count)
+        """
+
+        flat_sents = [sent for sents in sents_per_ent for sent in sents]
+        sent_counts = [len(sents) for sents in sents_per_ent]
+
+        encoded = self.tokenizer(flat_sents, padding=True, truncation=True, max_length=sent_len,
+                                 return_tensors='pt')
+
+        device = self.class_embs.device
+        flat_tok_batch = encoded.input_ids.to(device)
+        flat_mask_batch = encoded.attention_mask.to(device)
 
-        preds.sort(key=lambda pred: pred.conf, reverse=True)
+        # Pool each sentence over the length it would be padded to if its entity was predicted alone
+        sent_lens = flat_mask_batch.sum(dim=1)
+        pool_lens = torch.cat([ent_sent_lens.max().repeat(len(ent_sent_lens))
+                               for ent_sent_lens in sent_lens.split(sent_counts)])
 
-        return preds
+        if self.sent_cache is not None and not self.training:
+            flat_sent_batch = self.encode_cached(flat_sents, flat_tok_batch, flat_mask_batch, pool_lens, bucket_size)
+        else:
+            flat_sent_batch = self.encode_bucketed(flat_tok_batch, flat_mask_batch, pool_lens, bucket_size)
+
+        return flat_sent_batch, pool_lens
 
     def forward(self, toks_batch: Tensor, masks_batch: Tensor) -> Tuple[Tensor, Tensor]:
         """
@@ -80,9 +188,9 @@ class Texter(Module):
         #
         # < flat_tok_batch   (batch_size * sent_count, sent_len)
         # < flat_mask_batch  (batch_size * sent_count, sent_len)
+        # > flat_sent_batch  (batch_size * sent_count, emb_size)
 
-        flat_sent_batch = self.bert(input_ids=flat_tok_batch, attention_mask=flat_mask_batch) \
-            .last_hidden_state.mean(dim=1)
+        flat_sent_batch = self.encode(flat_tok_batch, flat_mask_batch)
 
         # Restore batch shape
         #
@@ -93,6 +201,177 @@ class Texter(Module):
 
         sents_batch = flat_sent_batch.reshape(batch_size, sent_count, emb_size)
 
+        return self.classify(sents_batch)
+
+    def encode(self, flat_tok_batch: Tensor, flat_mask_batch: Tensor, pool_lens: Tensor = None) -> Tensor:
+        """
+        The sentence embedding is the mean over all token positions, including
+        padding. Therefore, it depends on the length the sentence was padded to.
+        To get the same embedding as with less padding, pass that length in
+        <pool_lens> to only average the leading positions. Those are not affected
+        by the extra padding as it is masked out in BERT's self-attention.
+
+        :param flat_tok_batch: (sent_count, sent_len)
+        :param flat_mask_batch: (sent_count, sent_len)
+        :param pool_lens: (sent_count), number of leading positions to average
+        :return (sent_count, emb_size)
+        """
+
+        if self.precision == 'bf16':
+            with torch.autocast(flat_tok_batch.device.type, dtype=torch.bfloat16):
+                hiddens_batch = self.bert(input_ids=flat_tok_batch, attention_mask=flat_mask_batch).last_hidden_state
+
+            hiddens_batch = hiddens_batch.float()
+
+        else:
+            hiddens_batch = self.bert(input_ids=flat_tok_batch, attention_mask=flat_mask_batch).last_hidden_state
+
+        if pool_lens is None:
+            return hiddens_batch.mean(dim=1)
+
+        _, sent_len, _ = hiddens_batch.shape
+
+        positions = torch.arange(sent_len, device=hiddens_batch.device)
+        pool_masks_batch = (positions.unsqueeze(0) < pool_lens.unsqueeze(1)).unsqueeze(-1)
+
+        return (hiddens_batch * pool_masks_batch).sum(dim=1) / pool_lens.unsqueeze(1)
+
+    def encode_bucketed(self, flat_tok_batch: Tensor, flat_mask_batch: Tensor, pool_lens: Tensor,
+                        bucket_size: int) -> Tensor:
+        """
+        Like encode(), but sort the sentences by pool length and encode them in
+        buckets of up to <bucket_size> sentences. Each bucket is cropped to its
+        longest pool length, so that short sentences are not padded to the
+        length of the longest sentence in the batch.
+
+        :param flat_tok_batch: (sent_count, sent_len)
+        :param flat_mask_batch: (sent_count, sent_len)
+        :param pool_lens: (sent_count)
+        :return (sent_count, emb_size)
+        """
+
+        order = pool_lens.argsort()
+
+        bucket_embs = []
+
+        for bucket in order.split(bucket_size):
+            bucket_pool_lens = pool_lens[bucket]
+
+            # Positions behind the longest pool length do not affect the embeddings
+            bucket_len = bucket_pool_lens.max().item()
+
+            bucket_embs.append(self.encode(flat_tok_batch[bucket, :bucket_len],
+                                           flat_mask_batch[bucket, :bucket_len],
+                                           bucket_pool_lens))
+
+        sorted_flat_sent_batch = torch.cat(bucket_embs)
+
+        # Restore original sentence order
+        flat_sent_batch = torch.empty_like(sorted_flat_sent_batch)
+        flat_sent_batch[order] = sorted_flat_sent_batch
+
+        return flat_sent_batch
+
+    def encode_cached(self, flat_sents: List[str], flat_tok_batch: Tensor, flat_mask_batch: Tensor,
+                      pool_lens: Tensor, bucket_size: int) -> Tensor:
+        """
+        Like encode_bucketed(), but look up the sentence embeddings in the sentence
+        cache first and only run BERT on the missing sentences.
+
+        :param flat_sents: [sent]
+        :param flat_tok_batch: (sent_count, sent_len)
+        :param flat_mask_batch: (sent_count, sent_len)
+        :param pool_lens: (sent_count)
+        :return (sent_count, emb_size)
+        """
+
+        keys = [self.sent_cache.key(sent, pool_len) for sent, pool_len in zip(flat_sents, pool_lens.tolist())]
+        embs = [self.sent_cache.get(key) for key in keys]
+
+        misses = [i for i, emb in enumerate(embs) if emb is None]
+
+        if misses:
+            miss_embs = self.encode_bucketed(flat_tok_batch[misses], flat_mask_batch[misses], pool_lens[misses],
+                                             bucket_size).cpu().numpy()
+
+            self.sent_cache.put([keys[i] for i in misses], miss_embs)
+
+            for i, emb in zip(misses, miss_embs):
+                embs[i] = emb
+
+        return torch.from_numpy(np.stack(embs)).to(flat_tok_batch.device)
+
+    def fingerprint(self) -> str:
+        """
+        :return: Hash over the tokenizer's vocabulary size, BERT's weights and the precision
+        """
+
+        sha = sha256(f'{len(self.tokenizer)}\t{self.precision}'.encode('utf-8'))
+
+        # Quantized layers' state contains quantized tensors, packed params tuples and dtypes
+        def update(value):
+            if isinstance(value, Tensor):
+                tensor = value.dequantize() if value.is_quantized else value
+                sha.update(tensor.detach().cpu().numpy().tobytes())
+            elif isinstance(value, tuple):
+                for item in value:
+                    update(item)
+            else:
+                sha.update(str(value).encode('utf-8'))
+
+        for name, value in self.bert.state_dict().items():
+            sha.update(name.encode('utf-8'))
+            update(value)
+
+        return sha.hexdigest()
+
+    def quantize(self) -> 'Texter':
+        """
+        :return: Copy of this Texter whose encoder's linear layers are dynamically
+                 quantized to int8. The class head stays in fp32. CPU only.
+        """
+
+        texter = deepcopy(self).cpu()
+        texter.sent_cache = None
+
+        texter.bert = quantize_dynamic(texter.bert, {Linear}, dtype=torch.qint8)
+
+        return texter
+
+    @staticmethod
+    def scatter_sents(flat_sent_batch: Tensor, sent_counts: List[int]) -> Tuple[Tensor, Tensor]:
+        """
+        Distribute the flat sentence embeddings of multiple entities over a
+        zero-padded batch, e.g. for entities with different sentence counts.
+
+        :param flat_sent_batch: (sum(sent_counts), emb_size)
+        :param sent_counts: [sent_count], one per entity
+        :return sents_batch (batch_size, max_sent_count, emb_size),
+                sent_masks_batch (batch_size, max_sent_count)
+        """
+
+        batch_size = len(sent_counts)
+        max_sent_count = max(sent_counts)
+        _, emb_size = flat_sent_batch.shape
+
+        sents_batch = flat_sent_batch.new_zeros(batch_size, max_sent_count, emb_size)
+        sent_masks_batch = torch.zeros(batch_size, max_sent_count, dtype=torch.bool, device=flat_sent_batch.device)
+
+        offset = 0
+        for b, sent_count in enumerate(sent_counts):
+            sents_batch[b, :sent_count] = flat_sent_batch[offset:offset + sent_count]
+            sent_masks_batch[b, :sent_count] = True
+            offset += sent_count
+
+        return sents_batch, sent_masks_batch
+
+    def classify(self, sents_batch: Tensor, sent_masks_batch: Tensor = None) -> Tuple[Tensor, Tensor]:
+        """
+        :param sents_batch: (batch_size, sent_count, emb_size)
+        :param sent_masks_batch: (batch_size, sent_count), False for padding sentences
+        :return (batch_size, class_count)
+        """
+
         # Calculate sent-class attentions
         #
         # < sents_batch      (batch_size, sent_count, emb_size)
@@ -101,6 +380,15 @@ class Texter(Module):
 
         atts_batch = torch.einsum('bse, ce -> bcs', sents_batch, self.class_embs)
 
+        # Ignore padding sentences
+        #
+        # < atts_batch        (batch_size, class_count, sent_count)
+        # < sent_masks_batch  (batch_size, sent_count)
+        # > atts_batch        (batch_size, class_count, sent_count)
+
+        if sent_masks_batch is not None:
+            atts_batch = atts_batch.masked_fill(~sent_masks_batch.unsqueeze(1), float('-inf'))
+
         # Softmax over sentences
         #
         # < atts_batch   (batch_size, class_count, sent_count)
@@ -108,24 +396,26 @@ class Texter(Module):
 
         softs_batch = Softmax(dim=-1)(atts_batch)
 
-        # For each class, mix sentences according to attention
+        # Push each sentence through each class's single-output linear layer,
+        # i.e. scalar multiply each sentence vector (of size <emb_size>) with
+        # each class's weight vector (of size <emb_size>).
         #
-        # < softs_batch  (batch_size, class_count, sent_count)
-        # < sents_batch  (batch_size, sent_count, emb_size)
-        # > mixes_batch  (batch_size, class_count, emb_size)
+        # < sents_batch        (batch_size, sent_count, emb_size)
+        # < self.multi_weight  (class_count, emb_size)
+        # > projs_batch        (batch_size, class_count, sent_count)
 
-        mixes_batch = torch.bmm(softs_batch, sents_batch)
+        projs_batch = torch.einsum('bse, ce -> bcs', sents_batch, self.multi_weight)
 
-        # Push each mix throug its respective single-output linear layer,
-        # i.e. scalar multiply each mix vector (of size <emb_size>) with
-        # its respective weight vector (of size <emb_size>) and add the
-        # bias afterwards.
+        # For each class, mix the sentences' outputs according to attention and
+        # add the bias. As the linear layers are linear, this equals mixing the
+        # sentences first and pushing the mixes through the linear layers, but it
+        # avoids a (batch_size, class_count, emb_size) tensor.
         #
-        # < mixes_batch        (batch_size, class_count, emb_size)
-        # < self.multi_weight  (class_count, emb_size)
-        # < self.multi_bias    (class_count)
-        # > logits_batch       (batch_size, class_count)
+        # < softs_batch       (batch_size, class_count, sent_count)
+        # < projs_batch       (batch_size, class_count, sent_count)
+        # < self.multi_bias   (class_count)
+        # > logits_batch      (batch_size, class_count)
 
-        logits_batch = torch.einsum('bce, ce -> bc', mixes_batch, self.multi_weight) + self.multi_bias
+        logits_batch = (softs_batch * projs_batch).sum(dim=-1) + self.multi_bias
 
         return logits_batch, softs_batch
@@ -0,0 +1,103 @@
+from collections import defaultdict
+from typing import List, Tuple, Dict
+
+import torch
+from tokenizers import BertWordPieceTokenizer
+from torch.jit import ScriptModule
+from torch.nn import Sigmoid
+
+from data.power.texter_export.texter_export_dir import TexterExportDir
+from models.ent import Ent
+from models.fact import Fact
+from models.pred import Pred
+from models.rel import Rel
+
+
+class TracedTexter:
+    """
+    Lightweight counterpart of the `Texter` that predicts using the traced
+    `Texter.forward()` from a `POWER Texter Export Directory`. It does not
+    depend on the transformers package and gives the same predictions as
+    `Texter.predict()`.
+    """
+
+    tokenizer: BertWordPieceTokenizer
+    traced_texter: ScriptModule
+
+    classes: List[Tuple[Rel, Ent]]
+
+    def __init__(self, texter_export_dir: TexterExportDir):
+        do_lower_case, max_length = texter_export_dir.tokenizer_tsv.load()
+
+        self.tokenizer = BertWordPieceTokenizer(str(texter_export_dir.vocab_txt.path), lowercase=do_lower_case)
+        self.tokenizer.add_special_tokens(texter_export_dir.special_tokens_txt.load())
+        self.tokenizer.enable_truncation(max_length=max_length)
+
+        self.traced_texter = texter_export_dir.texter_pt.load()
+
+        self.classes = [(Rel(rel, rel_lbl), Ent(tail, tail_lbl))
+                        for rel, rel_lbl, tail, tail_lbl in texter_export_dir.classes_tsv.load()]
+
+    def predict(self, ent: Ent, sents: List[str]) -> List[Pred]:
+        return self.predict_batch([ent], [sents])[0]
+
+    def predict_batch(self, ents: List[Ent], sents_per_ent: List[List[str]]) -> List[List[Pred]]:
+        """
+        Entities with the same number of sentences and the same padded sentence
+        length are predicted together.
+
+        :param ents: [ent]
+        :param sents_per_ent: [[sent]], one list of sentences per entity
+        :return: [[pred]], one list of predictions per entity
+        """
+
+        #
+        # Tokenize and group entities by shape
+        #
+
+        shape_to_idxs: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        ent_tok_lists = []
+
+        for i, sents in enumerate(sents_per_ent):
+            tok_lists = [encoding.ids for encoding in self.tokenizer.encode_batch(sents)]
+            ent_tok_lists.append(tok_lists)
+
+            sent_len = max(len(toks) for toks in tok_lists)
+            shape_to_idxs[(len(sents), sent_len)].append(i)
+
+        #
+        # Predict each group
+        #
+
+        preds_per_ent: List[List[Pred]] = [[] for _ in ents]
+
+        for (sent_count, sent_len), idxs in shape_to_idxs.items():
+            toks_batch = torch.full((len(idxs), sent_count, sent_len), self.tokenizer.token_to_id('[PAD]'),
+                                    dtype=torch.long)
+            masks_batch = torch.zeros(len(idxs), sent_count, sent_len, dtype=torch.long)
+
+            for b, i in enumerate(idxs):
+                for s, toks in enumerate(ent_tok_lists[i]):
+                    toks_batch[b, s, :len(toks)] = torch.tensor(toks)
+                    masks_batch[b, s, :len(toks)] = 1
+
+            with torch.no_grad():
+                logits_batch, softs_batch = self.traced_texter(toks_batch, masks_batch)
+
+            probs_batch = Sigmoid()(logits_batch).numpy()
+            softs_batch = softs_batch.numpy()
+
+            for i, probs, softs in zip(idxs, probs_batch, softs_batch):
+                ent, sents = ents[i], sents_per_ent[i]
+
+                pred = {Fact(ent, rel, tail): (probs[c].item(), [(sents[j], softs[c][j].item())
+                                                                 for j in range(len(sents))])
+                        for c, (rel, tail) in enumerate(self.classes) if probs[c] > 0.5}
+
+                preds = [Pred(fact, conf, sents, []) for fact, (conf, sents) in pred.items()]
+
+                preds.sort(key=lambda pred: pred.conf, reverse=True)
+
+                preds_per_ent[i] = preds
+
+        return preds_per_ent
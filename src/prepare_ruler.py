@@ -6,16 +6,12 @@ from collections import defaultdict
 from pathlib import Path
 from typing import List
 
-from neo4j import GraphDatabase
-
 from data.anyburl.rules_tsv import RulesTsv
 from data.power.ruler_pkl import RulerPkl
 from data.power.split.split_dir import SplitDir
-from models.ent import Ent
 from models.fact import Fact
-from models.rel import Rel
 from models.rule import Rule
-from models.var import Var
+from power.grounder import IndexGrounder, MatrixGrounder, Neo4jGrounder
 from power.ruler import Ruler
 
 
@@ -38,31 +34,40 @@ def parse_args():
     parser.add_argument('rules_tsv', metavar='rules-tsv',
                         help='Path to (input) AnyBURL Rules TSV')
 
-    parser.add_argument('url', metavar='url',
-                        help='URL of running Neo4j instance')
-
-    parser.add_argument('username', metavar='username',
-                        help='Username for running Neo4j instance')
-
-    parser.add_argument('password', metavar='password',
-                        help='Password for running Neo4j instance')
-
     parser.add_argument('split_dir', metavar='split-dir',
                         help='Path to (input) POWER Split Directory')
 
     parser.add_argument('ruler_pkl', metavar='ruler-pkl',
                         help='Path to (output) POWER Ruler PKL')
 
+    grounder_choices = ['index', 'matrix']
+    default_grounder = 'matrix'
+    parser.add_argument('--grounder', dest='grounder', choices=grounder_choices, default=default_grounder,
+                        help='In-memory grounder if --neo4j is not specified. "index" supports single body fact'
+                             ' rules, "matrix" also cyclic and acyclic rules of length 2-3 (default: {})'.format(
+                            default_grounder))
+
+    parser.add_argument('--max-facts', dest='max_facts', type=int, metavar='INT',
+                        help='Maximum number of facts predicted per rule, all if not specified. The cut is'
+                             ' arbitrary, the facts for the lowest entity IDs are kept')
+
     default_min_conf = 0.5
     parser.add_argument('--min-conf', dest='min_conf', type=int, metavar='INT', default=default_min_conf,
                         help='Minimum confidence rules need to be considered (default:{})'.format(default_min_conf))
 
+    parser.add_argument('--neo4j', dest='neo4j', nargs=3, metavar=('URL', 'USERNAME', 'PASSWORD'),
+                        help='Ground the rules by querying a running Neo4j instance instead of in-memory indexes'
+                             ' over the POWER Split Directory\'s facts')
+
     parser.add_argument('--overwrite', dest='overwrite', action='store_true',
                         help='Overwrite output files if they already exist')
 
     parser.add_argument('--random-seed', dest='random_seed', metavar='STR',
                         help='Use together with PYTHONHASHSEED for reproducibility')
 
+    parser.add_argument('--test', dest='test', action='store_true',
+                        help='Ground in known test facts instead of known valid facts, like load_neo4j_graph --test')
+
     args = parser.parse_args()
 
     #
@@ -71,14 +76,15 @@ def parse_args():
 
     logging.info('Applied config:')
     logging.info('    {:24} {}'.format('rules-tsv', args.rules_tsv))
-    logging.info('    {:24} {}'.format('url', args.url))
-    logging.info('    {:24} {}'.format('username', args.username))
-    logging.info('    {:24} {}'.format('password', args.password))
     logging.info('    {:24} {}'.format('split-dir', args.split_dir))
     logging.info('    {:24} {}'.format('ruler-pkl', args.ruler_pkl))
+    logging.info('    {:24} {}'.format('--grounder', args.grounder))
+    logging.info('    {:24} {}'.format('--max-facts', args.max_facts))
     logging.info('    {:24} {}'.format('--min-conf', args.min_conf))
+    logging.info('    {:24} {}'.format('--neo4j', args.neo4j))
     logging.info('    {:24} {}'.format('--overwrite', args.overwrite))
     logging.info('    {:24} {}'.format('--random-seed', args.random_seed))
+    logging.info('    {:24} {}'.format('--test', args.test))
 
     logging.info('Environment variables:')
     logging.info('    {:24} {}'.format('PYTHONHASHSEED', os.getenv('PYTHONHASHSEED')))
@@ -88,14 +94,15 @@ def parse_args():
 
 def prepare_ruler(args):
     rules_tsv_path = args.rules_tsv
-    url = args.url
-    username = args.username
-    password = args.password
     split_dir_path = args.split_dir
     ruler_pkl_path = args.ruler_pkl
 
+    grounder_name = args.grounder
+    max_facts = args.max_facts
     min_conf = args.min_conf
+    neo4j = args.neo4j
     overwrite = args.overwrite
+    test = args.test
 
     #
     # Check that (input) POWER Rules TSV exists
@@ -139,8 +146,7 @@ def prepare_ruler(args):
     good_rules = [rule for rule in rules if rule.conf > min_conf]
     good_rules.sort(key=lambda rule: rule.conf, reverse=True)
 
-    short_rules = [rule for rule in good_rules if len(rule.body) == 1]
-    log_rules('Rules', short_rules)
+    log_rules('Rules', good_rules)
 
     #
     # Load train facts
@@ -153,66 +159,62 @@ def prepare_ruler(args):
                    for head, _, rel, _, tail, _ in train_triples}
 
     #
-    # Process rules
+    # Create grounder
     #
 
-    logging.info('Process rules ...')
+    if neo4j:
+        logging.info('Connect to Neo4j ...')
 
-    driver = GraphDatabase.driver(url, auth=(username, password))
-    unsupported_rules = 0
+        url, username, password = neo4j
+        grounder = Neo4jGrounder(url, username, password, ent_to_lbl)
 
-    pred = defaultdict(get_defaultdict)
-
-    with driver.session() as session:
-        for rule in short_rules:
+    else:
+        logging.info('Index graph facts ...')
 
-            logging.info(f'Process rule {rule}')
+        if test:
+            known_triples = split_dir.test_facts_known_tsv.load()
+        else:
+            known_triples = split_dir.valid_facts_known_tsv.load()
 
-            #
-            # Process rule body
-            #
+        graph_triples = [(head, rel, tail) for head, _, rel, _, tail, _ in train_triples + known_triples]
 
-            body_fact = rule.body[0]
+        if grounder_name == 'index':
+            grounder = IndexGrounder(graph_triples, ent_to_lbl)
+        else:
+            grounder = MatrixGrounder(graph_triples, ent_to_lbl)
 
-            if type(body_fact.head) == Var and type(body_fact.tail) == Ent:
-                records = session.write_transaction(query_facts_by_rel_tail, rel=body_fact.rel, tail=body_fact.tail)
-                ents = [Ent(head['id'], ent_to_lbl[head['id']]) for head, _, _ in records]
+    #
+    # Process rules
+    #
 
-            elif type(body_fact.head) == Ent and type(body_fact.tail) == Var:
-                records = session.write_transaction(query_facts_by_head_rel, head=body_fact.head, rel=body_fact.rel)
-                ents = [Ent(tail['id'], ent_to_lbl[tail['id']]) for _, _, tail in records]
+    logging.info('Process rules ...')
 
-            else:
-                logging.warning(f'Unsupported rule body in rule {rule}. Skipping.')
-                unsupported_rules += 1
-                continue
+    unsupported_rules = 0
 
-            #
-            # Process rule head
-            #
+    pred = defaultdict(get_defaultdict)
 
-            head_fact = rule.head
+    for rule in good_rules:
+        logging.debug(f'Process rule {rule}')
 
-            if type(head_fact.head) == Var and type(head_fact.tail) == Ent:
-                pred_facts = [Fact(ent, head_fact.rel, head_fact.tail) for ent in ents]
+        pred_facts = grounder.ground(rule, max_facts)
 
-            elif type(head_fact.head) == Ent and type(head_fact.tail) == Var:
-                pred_facts = [Fact(head_fact.head, head_fact.rel, ent) for ent in ents]
+        if pred_facts is None:
+            logging.debug(f'Unsupported rule {rule}. Skipping.')
+            unsupported_rules += 1
+            continue
 
-            else:
-                logging.warning(f'Unsupported rule head in rule {rule}. Skipping.')
-                unsupported_rules += 1
-                continue
+        #
+        # Filter out train facts and save predicted valid facts
+        #
 
-            #
-            # Filter out train facts and save predicted valid facts
-            #
+        for fact in pred_facts:
+            if fact not in train_facts:
+                pred[fact.head][(fact.rel, fact.tail)].append(rule)
 
-            for fact in pred_facts:
-                if fact not in train_facts:
-                    pred[fact.head][(fact.rel, fact.tail)].append(rule)
+    grounder.close()
 
-    driver.close()
+    logging.info(f'Processed {len(good_rules) - unsupported_rules} rules, skipped {unsupported_rules} unsupported'
+                 f' rules')
 
     #
     # Persist ruler
@@ -220,8 +222,7 @@ def prepare_ruler(args):
 
     logging.info('Persist ruler ...')
 
-    ruler = Ruler()
-    ruler.pred = pred
+    ruler = Ruler.from_pred(pred)
 
     ruler_pkl.save(ruler)
 
@@ -230,30 +231,6 @@ def get_defaultdict():
     return defaultdict(list)
 
 
-def query_facts_by_rel_tail(tx, rel: Rel, tail: Ent):
-    cypher = f'''
-        MATCH (head)-[rel:R_{rel.id}]->(tail)
-        WHERE tail.id = $tail_id
-        RETURN head, rel, tail
-    '''
-
-    records = tx.run(cypher, tail_id=tail.id)
-
-    return list(records)
-
-
-def query_facts_by_head_rel(tx, head: Ent, rel: Rel):
-    cypher = f'''
-        MATCH (head)-[rel:R_{rel.id}]->(tail)
-        WHERE head.id = $head_id
-        RETURN head, rel, tail
-    '''
-
-    records = tx.run(cypher, head_id=head.id)
-
-    return list(records)
-
-
 def log_rules(msg: str, rules: List[Rule], display_max=10):
     if logging.getLogger().level == logging.DEBUG:
 
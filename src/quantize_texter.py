@@ -0,0 +1,228 @@
+import logging
+import os
+import random
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+import torch
+from sklearn.metrics import precision_recall_fscore_support
+
+from data.power.samples.samples_dir import SamplesDir
+from data.power.samples.samples_tsv import Sample
+from data.power.texter_pkl import TexterPkl
+from power.texter import Texter
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s | %(levelname)-7s | %(message)s', level=logging.INFO)
+
+    args = parse_args()
+
+    if args.random_seed:
+        random.seed(args.random_seed)
+
+    quantize_texter(args)
+
+    logging.info('Finished successfully')
+
+
+def parse_args():
+    parser = ArgumentParser()
+
+    parser.add_argument('texter_pkl', metavar='texter-pkl',
+                        help='Path to (input) POWER Texter PKL')
+
+    parser.add_argument('samples_dir', metavar='samples-dir',
+                        help='Path to (input) POWER Samples Directory used for the accuracy check')
+
+    parser.add_argument('class_count', metavar='class-count', type=int,
+                        help='Number of classes distinguished by the classifier')
+
+    parser.add_argument('sent_count', metavar='sent-count', type=int,
+                        help='Number of sentences per entity')
+
+    parser.add_argument('quantized_texter_pkl', metavar='quantized-texter-pkl',
+                        help='Path to (output) POWER Texter PKL containing the quantized Texter')
+
+    default_batch_size = 16
+    parser.add_argument('--batch-size', dest='batch_size', type=int, metavar='INT', default=default_batch_size,
+                        help='Batch size for the accuracy check (default: {})'.format(default_batch_size))
+
+    default_max_f1_drop = 0.01
+    parser.add_argument('--max-f1-drop', dest='max_f1_drop', type=float, metavar='FLOAT', default=default_max_f1_drop,
+                        help='Warn if the quantized Texter\'s macro F1 is lower than the original one\'s'
+                             ' by more than that (default: {})'.format(default_max_f1_drop))
+
+    parser.add_argument('--overwrite', dest='overwrite', action='store_true',
+                        help='Overwrite output files if they already exist')
+
+    parser.add_argument('--random-seed', dest='random_seed', metavar='STR',
+                        help='Use together with PYTHONHASHSEED for reproducibility')
+
+    default_sent_len = 64
+    parser.add_argument('--sent-len', dest='sent_len', type=int, metavar='INT', default=default_sent_len,
+                        help='Sentence length short sentences are padded and long sentences cropped to'
+                             ' (default: {})'.format(default_sent_len))
+
+    parser.add_argument('--test', dest='test', action='store_true',
+                        help='Check accuracy on test samples instead of valid samples')
+
+    args = parser.parse_args()
+
+    #
+    # Log applied config
+    #
+
+    logging.info('Applied config:')
+    logging.info('    {:24} {}'.format('texter-pkl', args.texter_pkl))
+    logging.info('    {:24} {}'.format('samples-dir', args.samples_dir))
+    logging.info('    {:24} {}'.format('class-count', args.class_count))
+    logging.info('    {:24} {}'.format('sent-count', args.sent_count))
+    logging.info('    {:24} {}'.format('quantized-texter-pkl', args.quantized_texter_pkl))
+    logging.info('    {:24} {}'.format('--batch-size', args.batch_size))
+    logging.info('    {:24} {}'.format('--max-f1-drop', args.max_f1_drop))
+    logging.info('    {:24} {}'.format('--overwrite', args.overwrite))
+    logging.info('    {:24} {}'.format('--random-seed', args.random_seed))
+    logging.info('    {:24} {}'.format('--sent-len', args.sent_len))
+    logging.info('    {:24} {}'.format('--test', args.test))
+
+    logging.info('Environment variables:')
+    logging.info('    {:24} {}'.format('PYTHONHASHSEED', os.getenv('PYTHONHASHSEED')))
+
+    return args
+
+
+def quantize_texter(args):
+    texter_pkl_path = args.texter_pkl
+    samples_dir_path = args.samples_dir
+    class_count = args.class_count
+    sent_count = args.sent_count
+    quantized_texter_pkl_path = args.quantized_texter_pkl
+
+    batch_size = args.batch_size
+    max_f1_drop = args.max_f1_drop
+    overwrite = args.overwrite
+    sent_len = args.sent_len
+    test = args.test
+
+    #
+    # Check that (input) POWER Texter PKL exists
+    #
+
+    logging.info('Check that (input) POWER Texter PKL exists ...')
+
+    texter_pkl = TexterPkl(Path(texter_pkl_path))
+    texter_pkl.check()
+
+    #
+    # Check that (input) POWER Samples Directory exists
+    #
+
+    logging.info('Check that (input) POWER Samples Directory exists ...')
+
+    samples_dir = SamplesDir(Path(samples_dir_path))
+    samples_dir.check()
+
+    #
+    # Check that (output) quantized POWER Texter PKL does not exist
+    #
+
+    logging.info('Check that (output) quantized POWER Texter PKL does not exist ...')
+
+    quantized_texter_pkl = TexterPkl(Path(quantized_texter_pkl_path))
+
+    if not overwrite:
+        quantized_texter_pkl.check(should_exist=False)
+
+    #
+    # Load and quantize texter
+    #
+
+    logging.info('Load and quantize texter ...')
+
+    texter = texter_pkl.load().cpu()
+    quantized_texter = texter.quantize()
+
+    #
+    # Check accuracy
+    #
+
+    logging.info('Check accuracy ...')
+
+    if test:
+        samples = samples_dir.test_samples_tsv.load(class_count, sent_count)
+    else:
+        samples = samples_dir.valid_samples_tsv.load(class_count, sent_count)
+
+    gt_stack = np.array([sample.classes for sample in samples])
+
+    probs_stack, secs = predict_samples(texter, samples, batch_size, sent_len)
+    quantized_probs_stack, quantized_secs = predict_samples(quantized_texter, samples, batch_size, sent_len)
+
+    pred_stack = (probs_stack > 0.5).astype(int)
+    quantized_pred_stack = (quantized_probs_stack > 0.5).astype(int)
+
+    prec, rec, f1, _ = precision_recall_fscore_support(gt_stack, pred_stack, average='macro', zero_division=0)
+    quantized_prec, quantized_rec, quantized_f1, _ = precision_recall_fscore_support(
+        gt_stack, quantized_pred_stack, average='macro', zero_division=0)
+
+    agreement = (pred_stack == quantized_pred_stack).mean()
+    max_prob_diff = np.abs(probs_stack - quantized_probs_stack).max()
+
+    logging.info('    {:24} {:>10} {:>10}'.format('', 'fp32', 'int8'))
+    logging.info('    {:24} {:10.4f} {:10.4f}'.format('Macro Prec', prec, quantized_prec))
+    logging.info('    {:24} {:10.4f} {:10.4f}'.format('Macro Rec', rec, quantized_rec))
+    logging.info('    {:24} {:10.4f} {:10.4f}'.format('Macro F1', f1, quantized_f1))
+    logging.info('    {:24} {:10.2f} {:10.2f}'.format('Inference secs', secs, quantized_secs))
+    logging.info('    {:24} {:10.4f}'.format('Pred agreement', agreement))
+    logging.info('    {:24} {:10.4f}'.format('Max prob diff', max_prob_diff))
+
+    if f1 - quantized_f1 > max_f1_drop:
+        logging.warning(f'Quantization drops macro F1 by {f1 - quantized_f1:.4f},'
+                        f' which is more than the tolerated {max_f1_drop}')
+
+    #
+    # Persist quantized texter
+    #
+
+    logging.info('Persist quantized texter ...')
+
+    quantized_texter_pkl.save(quantized_texter)
+
+
+def predict_samples(texter: Texter, samples: List[Sample], batch_size: int, sent_len: int) \
+        -> Tuple[np.ndarray, float]:
+    """
+    :return: probs_stack (sample_count, class_count), inference seconds
+    """
+
+    texter.eval()
+
+    probs_batches = []
+    secs = 0.0
+
+    with torch.no_grad():
+        for i in range(0, len(samples), batch_size):
+            batch = samples[i:i + batch_size]
+
+            flat_sents = [sent for sample in batch for sent in sample.sents]
+            encoded = texter.tokenizer(flat_sents, padding=True, truncation=True, max_length=sent_len,
+                                       return_tensors='pt')
+
+            toks_batch = encoded.input_ids.reshape(len(batch), -1, encoded.input_ids.shape[-1])
+            masks_batch = encoded.attention_mask.reshape(len(batch), -1, encoded.attention_mask.shape[-1])
+
+            start = time.perf_counter()
+            logits_batch, _ = texter(toks_batch, masks_batch)
+            secs += time.perf_counter() - start
+
+            probs_batches.append(torch.sigmoid(logits_batch).numpy())
+
+    return np.concatenate(probs_batches), secs
+
+
+if __name__ == '__main__':
+    main()
@@ -1,26 +1,39 @@
 import logging
+import os
 import random
+import resource
+import socket
+import time
 from argparse import ArgumentParser
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, Future
+from math import ceil
 from pathlib import Path
-from random import shuffle
-from typing import List, Tuple, Dict
+from random import sample
+from typing import List, Tuple, Dict, Optional, Iterator, Any
 
 import numpy as np
 import torch
-from sklearn.metrics import precision_recall_fscore_support
+import torch.distributed as dist
+import torch.multiprocessing as mp
 from torch import Tensor, tensor
-from torch.nn import BCEWithLogitsLoss
-from torch.utils.data import DataLoader
+from torch.autograd.profiler import profile
+from torch.nn import BCEWithLogitsLoss, Parameter
+from torch.utils.data import DataLoader, Dataset, Subset, Sampler
 from torch.utils.tensorboard import SummaryWriter
 from tqdm import tqdm
-from transformers import AdamW
+from transformers import AdamW, DistilBertTokenizer
 
+from data.power.checkpoint_pt import CheckpointPt
 from data.power.samples.samples_dir import SamplesDir
 from data.power.samples.samples_tsv import Sample
+from data.power.samples.toks_dir import ToksDir
+from data.power.sent_embs.sent_embs_dir import SentEmbsDir
 from data.power.split.split_dir import SplitDir
 from data.power.texter_pkl import TexterPkl
 from models.ent import Ent
 from models.rel import Rel
+from power.sent_cache import SentCache
 from power.texter import Texter
 
 
@@ -29,12 +42,44 @@ def main():
 
     args = parse_args()
 
+    if args.workers > 1:
+        init_method = f'tcp://127.0.0.1:{find_free_port()}'
+        mp.spawn(train_worker, args=(args, init_method), nprocs=args.workers)
+
+    else:
+        if args.random_seed:
+            random.seed(args.random_seed)
+
+        train_texter(args)
+
+    logging.info('Finished successfully')
+
+
+def train_worker(rank: int, args, init_method: str):
+    """
+    Entry point of the data-parallel training processes. Only rank 0 logs.
+    """
+
+    log_level = logging.INFO if rank == 0 else logging.WARNING
+    logging.basicConfig(format='%(asctime)s | %(levelname)s | %(message)s', level=log_level)
+
+    # Share the cores among the processes instead of oversubscribing them
+    torch.set_num_threads(max(1, os.cpu_count() // args.workers))
+
+    dist.init_process_group('gloo', init_method=init_method, rank=rank, world_size=args.workers)
+
     if args.random_seed:
         random.seed(args.random_seed)
 
     train_texter(args)
 
-    logging.info('Finished successfully')
+    dist.destroy_process_group()
+
+
+def find_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
 
 
 def parse_args():
@@ -61,14 +106,43 @@ def parse_args():
                         help='Where to perform tensor operations, one of {} (default: {})'.format(
                             device_choices, default_device))
 
+    parser.add_argument('--auto-batch-size', dest='auto_batch_size', action='store_true',
+                        help='Find the largest micro batch size that fits the memory budget, by doubling it'
+                             ' from 1 up to the batch size and bisecting below the first one that does not fit')
+
+    default_checkpoint = None
+    parser.add_argument('--checkpoint', dest='checkpoint', metavar='STR', default=default_checkpoint,
+                        help='Path to (input/output) POWER Checkpoint PT that is written in the background'
+                             ' after every epoch and every --checkpoint-interval optimizer steps'
+                             ' (default: {})'.format(default_checkpoint))
+
+    default_checkpoint_interval = None
+    parser.add_argument('--checkpoint-interval', dest='checkpoint_interval', type=int, metavar='INT',
+                        default=default_checkpoint_interval,
+                        help='Additionally checkpoint every that many optimizer steps'
+                             ' (default: {})'.format(default_checkpoint_interval))
+
     default_batch_size = 4
     parser.add_argument('--batch-size', dest='batch_size', type=int, metavar='INT', default=default_batch_size,
-                        help='Batch size (default: {})'.format(default_batch_size))
+                        help='Effective batch size, i.e. number of samples per optimizer step. Batches larger'
+                             ' than the micro batch size are split and their gradients accumulated'
+                             ' (default: {})'.format(default_batch_size))
 
     default_epoch_count = 20
     parser.add_argument('--epoch-count', dest='epoch_count', type=int, metavar='INT', default=default_epoch_count,
                         help='Number of training epochs (default: {})'.format(default_epoch_count))
 
+    default_frozen_encoder = None
+    parser.add_argument('--frozen-encoder', dest='frozen_encoder', metavar='STR', default=default_frozen_encoder,
+                        help='Path to (input/output) POWER Sentence Embeddings Directory. If given, the'
+                             ' sentences are embedded only once, by the pre-trained encoder, and cached there.'
+                             ' Then, only the class head is trained on the cached embeddings'
+                             ' (default: {})'.format(default_frozen_encoder))
+
+    parser.add_argument('--group-by-length', dest='group_by_length', action='store_true',
+                        help='Group the train samples into batches of similar sentence lengths, which are shuffled'
+                             ' in buckets of batches, to reduce the padding')
+
     default_log_dir = None
     parser.add_argument('--log-dir', dest='log_dir', metavar='STR', default=default_log_dir,
                         help='Tensorboard log directory (default: {})'.format(default_log_dir))
@@ -80,20 +154,104 @@ def parse_args():
     parser.add_argument('--lr', dest='lr', type=float, metavar='FLOAT', default=default_learning_rate,
                         help='Learning rate (default: {})'.format(default_learning_rate))
 
+    default_memory_budget = None
+    parser.add_argument('--memory-budget', dest='memory_budget', type=float, metavar='FLOAT',
+                        default=default_memory_budget,
+                        help='Memory in GiB that --auto-batch-size may use, 90%% of the device\'s memory if'
+                             ' not specified (default: {})'.format(default_memory_budget))
+
+    default_micro_batch_size = None
+    parser.add_argument('--micro-batch-size', dest='micro_batch_size', type=int, metavar='INT',
+                        default=default_micro_batch_size,
+                        help='Number of samples per forward/backward pass, the batch size if not specified'
+                             ' (default: {})'.format(default_micro_batch_size))
+
+    default_num_workers = 0
+    parser.add_argument('--num-workers', dest='num_workers', type=int, metavar='INT', default=default_num_workers,
+                        help='Number of worker processes that load and tokenize batches, 0 loads them in the'
+                             ' main process (default: {})'.format(default_num_workers))
+
     parser.add_argument('--overwrite', dest='overwrite', action='store_true',
                         help='Overwrite output files if they already exist')
 
+    default_patience = None
+    parser.add_argument('--patience', dest='patience', type=int, metavar='INT', default=default_patience,
+                        help='Stop early after that many validations without improvement of the valid F1,'
+                             ' never stop early if not specified (default: {})'.format(default_patience))
+
+    parser.add_argument('--pin-memory', dest='pin_memory', action='store_true',
+                        help='Load batches into pinned memory for faster, asynchronous copies to the GPU')
+
+    precision_choices = ['fp32', 'bf16']
+    default_precision = 'fp32'
+    parser.add_argument('--precision', dest='precision', choices=precision_choices, default=default_precision,
+                        help='Precision of the encoder, the class head always uses fp32'
+                             ' (default: {})'.format(default_precision))
+
+    parser.add_argument('--pre-tokenized', dest='pre_tokenized', action='store_true',
+                        help='Load the samples from the POWER Tokens Directories created by'
+                             ' create_texter_dataset.py --tokenize instead of tokenizing them during training')
+
+    default_prefetch_factor = 2
+    parser.add_argument('--prefetch-factor', dest='prefetch_factor', type=int, metavar='INT',
+                        default=default_prefetch_factor,
+                        help='Number of batches loaded in advance by each worker (default: {})'.format(
+                            default_prefetch_factor))
+
+    parser.add_argument('--profile', dest='profile', action='store_true',
+                        help='Time the stages of every train step (load, copy, forward, backward, sync, step,'
+                             ' metrics, other) and log them to Tensorboard. Synchronizes CUDA after every stage')
+
     parser.add_argument('--random-seed', dest='random_seed', metavar='STR',
                         help='Use together with PYTHONHASHSEED for reproducibility')
 
+    parser.add_argument('--resume', dest='resume', action='store_true',
+                        help='Resume training from --checkpoint if it exists, exactly when loading batches'
+                             ' in the main process')
+
     default_sent_len = 64
     parser.add_argument('--sent-len', dest='sent_len', type=int, metavar='INT', default=default_sent_len,
                         help='Sentence length short sentences are padded and long sentences cropped to'
                              ' (default: {})'.format(default_sent_len))
 
+    parser.add_argument('--trace', dest='trace', metavar='STR',
+                        help='Path to (output) Chrome trace JSON of the torch profiler, recorded during'
+                             ' --trace-steps')
+
+    default_trace_steps = [10, 20]
+    parser.add_argument('--trace-steps', dest='trace_steps', type=int, nargs=2, metavar=('FIRST', 'LAST'),
+                        default=default_trace_steps,
+                        help='Optimizer steps traced by --trace, from FIRST to LAST (exclusive)'
+                             ' (default: {} {})'.format(*default_trace_steps))
+
     parser.add_argument('--try-batch-size', dest='try_batch_size', action='store_true',
                         help='Try to perform a single train and valid loop to see whether the batch_size is ok')
 
+    default_valid_batch_size = None
+    parser.add_argument('--valid-batch-size', dest='valid_batch_size', type=int, metavar='INT',
+                        default=default_valid_batch_size,
+                        help='Batch size for the gradient-free validation, the batch size if not specified'
+                             ' (default: {})'.format(default_valid_batch_size))
+
+    default_valid_interval = None
+    parser.add_argument('--valid-interval', dest='valid_interval', type=int, metavar='INT',
+                        default=default_valid_interval,
+                        help='Validate every that many optimizer steps and fully validate the best Texter'
+                             ' at the end, validate after every epoch if not specified'
+                             ' (default: {})'.format(default_valid_interval))
+
+    default_valid_subsample = None
+    parser.add_argument('--valid-subsample', dest='valid_subsample', type=int, metavar='INT',
+                        default=default_valid_subsample,
+                        help='Number of valid samples in the fixed random subsample used by --valid-interval,'
+                             ' all valid samples if not specified (default: {})'.format(default_valid_subsample))
+
+    default_workers = 1
+    parser.add_argument('--workers', dest='workers', type=int, metavar='INT', default=default_workers,
+                        help='Number of data-parallel training processes that each train on a shard of the'
+                             ' samples and all-reduce their gradients over gloo. Not to be confused with'
+                             ' --num-workers (default: {})'.format(default_workers))
+
     args = parser.parse_args()
 
     #
@@ -106,36 +264,95 @@ def parse_args():
     logging.info('    {:24} {}'.format('sent-count', args.sent_count))
     logging.info('    {:24} {}'.format('split-dir', args.split_dir))
     logging.info('    {:24} {}'.format('texter-pkl', args.texter_pkl))
+    logging.info('    {:24} {}'.format('--auto-batch-size', args.auto_batch_size))
     logging.info('    {:24} {}'.format('--batch-size', args.batch_size))
+    logging.info('    {:24} {}'.format('--checkpoint', args.checkpoint))
+    logging.info('    {:24} {}'.format('--checkpoint-interval', args.checkpoint_interval))
     logging.info('    {:24} {}'.format('--device', args.device))
     logging.info('    {:24} {}'.format('--epoch-count', args.epoch_count))
+    logging.info('    {:24} {}'.format('--frozen-encoder', args.frozen_encoder))
+    logging.info('    {:24} {}'.format('--group-by-length', args.group_by_length))
     logging.info('    {:24} {}'.format('--log-dir', args.log_dir))
     logging.info('    {:24} {}'.format('--log-steps', args.log_steps))
     logging.info('    {:24} {}'.format('--lr', args.lr))
+    logging.info('    {:24} {}'.format('--memory-budget', args.memory_budget))
+    logging.info('    {:24} {}'.format('--micro-batch-size', args.micro_batch_size))
+    logging.info('    {:24} {}'.format('--num-workers', args.num_workers))
     logging.info('    {:24} {}'.format('--overwrite', args.overwrite))
+    logging.info('    {:24} {}'.format('--patience', args.patience))
+    logging.info('    {:24} {}'.format('--pin-memory', args.pin_memory))
+    logging.info('    {:24} {}'.format('--precision', args.precision))
+    logging.info('    {:24} {}'.format('--pre-tokenized', args.pre_tokenized))
+    logging.info('    {:24} {}'.format('--prefetch-factor', args.prefetch_factor))
+    logging.info('    {:24} {}'.format('--profile', args.profile))
     logging.info('    {:24} {}'.format('--random-seed', args.random_seed))
+    logging.info('    {:24} {}'.format('--resume', args.resume))
     logging.info('    {:24} {}'.format('--sent-len', args.sent_len))
+    logging.info('    {:24} {}'.format('--trace', args.trace))
+    logging.info('    {:24} {}'.format('--trace-steps', args.trace_steps))
     logging.info('    {:24} {}'.format('--try-batch-size', args.try_batch_size))
+    logging.info('    {:24} {}'.format('--valid-batch-size', args.valid_batch_size))
+    logging.info('    {:24} {}'.format('--valid-interval', args.valid_interval))
+    logging.info('    {:24} {}'.format('--valid-subsample', args.valid_subsample))
+    logging.info('    {:24} {}'.format('--workers', args.workers))
 
     return args
 
 
-def train_texter(args):
+def train_texter(args) -> int:
     samples_dir_path = args.samples_dir
     class_count = args.class_count
     sent_count = args.sent_count
     split_dir_path = args.split_dir
     texter_pkl_path = args.texter_pkl
 
+    auto_batch_size = args.auto_batch_size
     batch_size = args.batch_size
+    checkpoint_path = args.checkpoint
+    checkpoint_interval = args.checkpoint_interval
     device = args.device
     epoch_count = args.epoch_count
+    frozen_encoder_path = args.frozen_encoder
+    group_by_length = args.group_by_length
     log_dir = args.log_dir
     log_steps = args.log_steps
     lr = args.lr
+    memory_budget = args.memory_budget
+    micro_batch_size = args.micro_batch_size
+    num_workers = args.num_workers
     overwrite = args.overwrite
+    patience = args.patience
+    pin_memory = args.pin_memory
+    precision = args.precision
+    pre_tokenized = args.pre_tokenized
+    prefetch_factor = args.prefetch_factor
+    profile_stages = args.profile
+    resume = args.resume
     sent_len = args.sent_len
+    trace_path = args.trace
+    trace_first, trace_last = args.trace_steps
     try_batch_size = args.try_batch_size
+    valid_batch_size = args.valid_batch_size
+    valid_interval = args.valid_interval
+    valid_subsample = args.valid_subsample
+
+    # Single process unless started by train_worker()
+    rank = dist.get_rank() if dist.is_initialized() else 0
+    world_size = dist.get_world_size() if dist.is_initialized() else 1
+
+    # All processes shuffle alike and draw the same valid subsample
+    if world_size > 1:
+        shared_seed = tensor(random.getrandbits(63) if rank == 0 else 0)
+        dist.broadcast(shared_seed, src=0)
+        random.seed(shared_seed.item())
+
+    if frozen_encoder_path and pre_tokenized:
+        raise ValueError('--frozen-encoder embeds the sentences of the POWER Samples TSVs,'
+                         ' it cannot be combined with --pre-tokenized')
+
+    if frozen_encoder_path and group_by_length:
+        raise ValueError('--frozen-encoder trains on sentence embeddings without padding,'
+                         ' it cannot be combined with --group-by-length')
 
     #
     # Check that (input) POWER Samples Directory exists
@@ -163,9 +380,24 @@ def train_texter(args):
 
     texter_pkl = TexterPkl(Path(texter_pkl_path))
 
-    if not overwrite:
+    # A resumed training continues to persist the best Texter of the interrupted one
+    if not overwrite and not resume:
         texter_pkl.check(should_exist=False)
 
+    #
+    # Load checkpoint
+    #
+
+    checkpoint_pt = CheckpointPt(Path(checkpoint_path)) if checkpoint_path else None
+    checkpoint = None
+
+    if resume:
+        if checkpoint_pt is not None and checkpoint_pt.path.is_file():
+            logging.info('Load checkpoint ...')
+            checkpoint = checkpoint_pt.load()
+        else:
+            logging.warning('No checkpoint to resume from. Start training from scratch.')
+
     #
     # Load entity/relation labels
     #
@@ -186,6 +418,14 @@ def train_texter(args):
 
     pre_trained = 'distilbert-base-uncased'
     texter = Texter(pre_trained, classes)
+    texter.precision = precision
+
+    # All processes start with rank 0's weights, but use different dropout masks
+    if world_size > 1:
+        for value in texter.state_dict().values():
+            dist.broadcast(value, src=0)
+
+        torch.manual_seed(shared_seed.item() + rank)
 
     #
     # Load datasets and create dataloaders
@@ -193,37 +433,93 @@ def train_texter(args):
 
     logging.info('Load datasets and create dataloaders ...')
 
-    train_set = samples_dir.train_samples_tsv.load(class_count, sent_count)
-    valid_set = samples_dir.valid_samples_tsv.load(class_count, sent_count)
+    if pre_tokenized:
+        samples_dir.train_toks_dir.check()
+        samples_dir.valid_toks_dir.check()
 
-    def generate_batch(batch: List[Sample]) -> Tuple[Tensor, Tensor, Tensor, Tensor]:
-        """
-        :param    batch:            [Sample(ent, ent_lbl, [class], [sent])]
+        train_set = ToksDataset(samples_dir.train_toks_dir, class_count, sent_count, sent_len)
+        valid_set = ToksDataset(samples_dir.valid_toks_dir, class_count, sent_count, sent_len)
 
-        :return:  ent_batch:        IntTensor[batch_size],
-                  tok_lists_batch:  IntTensor[batch_size, sent_count, sent_len],
-                  masks_batch:      IntTensor[batch_size, sent_count, sent_len],
-                  classes_batch:    IntTensor[batch_size, class_count]
-        """
+        generate_batch = generate_toks_batch
 
-        ent_batch, _, classes_batch, sents_batch = zip(*batch)
+    else:
+        train_set = samples_dir.train_samples_tsv.load(class_count, sent_count)
+        valid_set = samples_dir.valid_samples_tsv.load(class_count, sent_count)
 
-        for sents in sents_batch:
-            shuffle(sents)
+        generate_batch = SamplesBatchGenerator(texter.tokenizer, sent_count, sent_len)
 
-        flat_sents_batch = [sent for sents in sents_batch for sent in sents]
+    if frozen_encoder_path:
+        logging.info('Embed sentences ...')
 
-        encoded = texter.tokenizer(flat_sents_batch, padding=True, truncation=True, max_length=sent_len,
-                                   return_tensors='pt')
+        sent_embs_dir = SentEmbsDir(Path(frozen_encoder_path))
+        sent_embs_dir.create(overwrite=True)
 
-        b_size = len(ent_batch)  # usually b_size == batch_size, except for last batch in samples
-        tok_lists_batch = encoded.input_ids.reshape(b_size, sent_count, -1)
-        masks_batch = encoded.attention_mask.reshape(b_size, sent_count, -1)
+        texter = texter.to(device)
 
-        return tensor(ent_batch), tok_lists_batch, masks_batch, tensor(classes_batch)
+        # Let rank 0 fill the cache before the other processes read it
+        if rank != 0:
+            dist.barrier()
+
+        texter.sent_cache = SentCache(sent_embs_dir, texter.fingerprint(), texter.bert.config.dim)
 
-    train_loader = DataLoader(train_set, batch_size=batch_size, collate_fn=generate_batch, shuffle=True)
-    valid_loader = DataLoader(valid_set, batch_size=batch_size, collate_fn=generate_batch)
+        train_rows = embed_samples(texter, train_set, sent_len)
+        valid_rows = embed_samples(texter, valid_set, sent_len)
+
+        if world_size > 1 and rank == 0:
+            dist.barrier()
+
+        sent_embs = texter.sent_cache.disk_embs
+
+        # Do not persist the cache with the Texter
+        texter.sent_cache = None
+
+        train_set = EmbsDataset(train_set, train_rows, sent_embs)
+        valid_set = EmbsDataset(valid_set, valid_rows, sent_embs)
+
+        generate_batch = generate_embs_batch
+
+    # Seed the shuffling and the workers' RNGs from the (optionally seeded) Python RNG
+    generator = torch.Generator()
+    generator.manual_seed(random.getrandbits(63))
+
+    loader_kwargs = {'collate_fn': generate_batch, 'num_workers': num_workers, 'pin_memory': pin_memory}
+
+    if num_workers > 0:
+        loader_kwargs['prefetch_factor'] = prefetch_factor
+        loader_kwargs['persistent_workers'] = True
+
+    if valid_batch_size is None:
+        valid_batch_size = batch_size
+
+    if group_by_length:
+        if pre_tokenized:
+            sent_lens = train_set.lens.max(axis=1)
+        else:
+            sent_lens = calc_max_sent_lens(texter.tokenizer, train_set, sent_len)
+
+        train_sampler = LengthGroupedSampler(sent_lens, batch_size, generator, rank, world_size)
+    else:
+        train_sampler = ResumableRandomSampler(len(train_set), generator, rank, world_size)
+
+    train_loader = DataLoader(train_set, batch_size=batch_size, sampler=train_sampler, generator=generator,
+                              **loader_kwargs)
+
+    # Each process validates every world_size-th sample
+    valid_shard = Subset(valid_set, range(rank, len(valid_set), world_size)) if world_size > 1 else valid_set
+    valid_loader = DataLoader(valid_shard, batch_size=valid_batch_size, **loader_kwargs)
+
+    # Fixed random subsample for the frequent validations during an epoch
+    if valid_subsample is not None and valid_subsample < len(valid_set):
+        if checkpoint is not None:
+            valid_sub_idxs = checkpoint['valid_sub_idxs']
+        else:
+            valid_sub_idxs = sorted(sample(range(len(valid_set)), valid_subsample))
+
+        valid_sub_set = Subset(valid_set, valid_sub_idxs[rank::world_size])
+        valid_sub_loader = DataLoader(valid_sub_set, batch_size=valid_batch_size, **loader_kwargs)
+    else:
+        valid_sub_idxs = None
+        valid_sub_loader = valid_loader
 
     #
     # Calc class weights
@@ -231,8 +527,11 @@ def train_texter(args):
 
     logging.info('Calc class weights ...')
 
-    _, _, train_classes_stack, _ = zip(*train_set)
-    train_freqs = np.array(train_classes_stack).mean(axis=0)
+    if pre_tokenized or frozen_encoder_path:
+        train_freqs = np.array(train_set.classes).mean(axis=0)
+    else:
+        _, _, train_classes_stack, _ = zip(*train_set)
+        train_freqs = np.array(train_classes_stack).mean(axis=0)
 
     class_weights = tensor(1 / train_freqs)
 
@@ -244,19 +543,48 @@ def train_texter(args):
 
     texter = texter.to(device)
 
+    if frozen_encoder_path:
+        texter.bert.requires_grad_(False)
+
     criterion = BCEWithLogitsLoss(pos_weight=class_weights.to(device))
 
+    trained_parameters = [(n, p) for n, p in texter.named_parameters() if p.requires_grad]
+    trained_params = [p for _, p in trained_parameters]
+
     no_decay = ['bias', 'LayerNorm.weight']
     optimizer_grouped_parameters = [
-        {'params': [p for n, p in texter.named_parameters() if not any(nd in n for nd in no_decay)],
+        {'params': [p for n, p in trained_parameters if not any(nd in n for nd in no_decay)],
          'weight_decay': 0.01},
-        {'params': [p for n, p in texter.named_parameters() if any(nd in n for nd in no_decay)],
+        {'params': [p for n, p in trained_parameters if any(nd in n for nd in no_decay)],
          'weight_decay': 0.0}
     ]
 
     optimizer = AdamW(optimizer_grouped_parameters, lr=lr)
 
-    writer = SummaryWriter(log_dir=log_dir)
+    writer = SummaryWriter(log_dir=log_dir) if rank == 0 else NullWriter()
+
+    #
+    # Choose micro batch size
+    #
+
+    # The class head alone fits into memory anyway
+    if auto_batch_size and not frozen_encoder_path:
+        logging.info('Find micro batch size ...')
+
+        if memory_budget is None:
+            # The processes share the device
+            memory_budget_bytes = int(0.9 * get_device_memory(device) / world_size)
+        else:
+            memory_budget_bytes = int(memory_budget * 2 ** 30)
+
+        micro_batch_size = find_micro_batch_size(texter, criterion, device, class_count, sent_count, sent_len,
+                                                 batch_size, memory_budget_bytes)
+
+    elif micro_batch_size is None:
+        micro_batch_size = batch_size
+
+    logging.info(f'Use micro batch size {micro_batch_size}, i.e. accumulate gradients over up to'
+                 f' {ceil(batch_size / micro_batch_size)} micro batches per batch of {batch_size}')
 
     #
     # Train
@@ -265,144 +593,1031 @@ def train_texter(args):
     logging.info('Train ...')
 
     best_valid_f1 = 0
+    stale_valid_count = 0  # Validations since the best valid F1
 
     # Global progress for Tensorboard
     train_steps = 0
-    valid_steps = 0
 
-    for epoch in range(epoch_count):
+    optimizer_steps = 0
+
+    start_epoch = 0
+    start_epoch_metrics = None
+    start_epoch_batch_count = 0
+
+    #
+    # Restore training state from checkpoint
+    #
+
+    if checkpoint is not None:
+        logging.info(f'Resume training at epoch {checkpoint["epoch"]}, batch {checkpoint["epoch_batch_count"]} ...')
+
+        texter.load_state_dict(checkpoint['texter'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+
+        best_valid_f1 = checkpoint['best_valid_f1']
+        stale_valid_count = checkpoint['stale_valid_count']
+        train_steps = checkpoint['train_steps']
+        optimizer_steps = checkpoint['optimizer_steps']
+
+        start_epoch = checkpoint['epoch']
+        start_epoch_batch_count = checkpoint['epoch_batch_count']
+
+        # Replay the interrupted epoch's shuffling and skip the samples that have been trained on
+        generator.set_state(checkpoint['generator_state'])
+        train_sampler.skip_count = start_epoch_batch_count * batch_size
+
+        random.setstate(checkpoint['python_rng_state'])
+        torch.set_rng_state(checkpoint['torch_rng_state'])
+
+        if device == 'cuda':
+            torch.cuda.set_rng_state_all(checkpoint['cuda_rng_states'])
+
+        # The checkpointed epoch metrics are already summed over all processes
+        if rank == 0:
+            start_epoch_metrics = {split: {key: value.to(device) for key, value in counts.items()}
+                                   for split, counts in checkpoint['epoch_metrics'].items()}
+        else:
+            start_epoch_metrics = {'train': create_counts(class_count, device)}
+
+        # Derive different dropout masks from rank 0's checkpointed RNG state
+        if world_size > 1:
+            torch.manual_seed(torch.randint(2 ** 62, ()).item() + rank)
+
+    resumed_train_steps = train_steps
+
+    #
+    # Checkpoint in the background
+    #
+
+    checkpoint_executor = ThreadPoolExecutor(max_workers=1)
+    pending_checkpoint: Optional[Future] = None
+
+    def save_checkpoint(epoch: int, epoch_batch_count: int, epoch_metrics: Dict, epoch_generator_state: Tensor) \
+            -> None:
+        """
+        Copy the training state to the CPU and write it in the background. The
+        training only waits if the previous checkpoint has not been written yet.
+        Must be called by all processes, only rank 0 writes the checkpoint.
+
+        :param epoch: Epoch to resume
+        :param epoch_batch_count: Number of the epoch's batches that have been trained on
+        :param epoch_generator_state: Generator state at the start of the epoch
+        """
+
+        nonlocal pending_checkpoint
+
+        if world_size > 1:
+            epoch_metrics = copy_to_cpu(epoch_metrics)
+            for counts in epoch_metrics.values():
+                all_reduce_counts(counts)
 
-        epoch_metrics = {
-            'train': {'loss': 0.0, 'pred_classes_stack': [], 'gt_classes_stack': []},
-            'valid': {'loss': 0.0, 'pred_classes_stack': [], 'gt_classes_stack': []}
+        if rank != 0:
+            return
+
+        if pending_checkpoint is not None:
+            pending_checkpoint.result()
+
+        checkpoint = {
+            'texter': copy_to_cpu(texter.state_dict()),
+            'optimizer': copy_to_cpu(optimizer.state_dict()),
+
+            'best_valid_f1': best_valid_f1,
+            'stale_valid_count': stale_valid_count,
+            'train_steps': train_steps,
+            'optimizer_steps': optimizer_steps,
+
+            'epoch': epoch,
+            'epoch_metrics': copy_to_cpu(epoch_metrics),
+            'epoch_batch_count': epoch_batch_count,
+            'valid_sub_idxs': valid_sub_idxs,
+
+            'generator_state': epoch_generator_state,
+            'python_rng_state': random.getstate(),
+            'torch_rng_state': torch.get_rng_state(),
+            'cuda_rng_states': torch.cuda.get_rng_state_all() if device == 'cuda' else None,
         }
 
+        pending_checkpoint = checkpoint_executor.submit(checkpoint_pt.save, checkpoint)
+
+    # In try mode, validate only a single batch
+    max_valid_batches = 1 if try_batch_size else None
+
+    def validate_and_persist(loader: DataLoader, x: int) -> bool:
+        """
+        Validate the Texter, log the valid metrics at x and persist the Texter
+        if it achieves the best valid F1 so far
+
+        :return: Whether to stop early
+        """
+
+        nonlocal best_valid_f1, stale_valid_count
+
+        valid_counts = validate(texter, loader, criterion, device, pin_memory, bool(frozen_encoder_path),
+                                max_valid_batches)
+
+        writer.add_scalars('loss', {'valid': valid_counts['loss'].item()}, x)
+
+        log_class_metrics({'valid': valid_counts}, writer, x, class_count)
+        valid_f1 = log_macro_metrics({'valid': valid_counts}, writer, x)
+
+        if valid_f1 > best_valid_f1:
+            best_valid_f1 = valid_f1
+            stale_valid_count = 0
+
+            if rank == 0:
+                texter_pkl.save(texter)
+
+        else:
+            stale_valid_count += 1
+
+        return patience is not None and stale_valid_count >= patience
+
+    stop_early = False
+
+    stage_timer = StageTimer(profile_stages, device)
+
+    # Torch profiler, active during the traced optimizer steps
+    tracer = None
+
+    for epoch in range(start_epoch, epoch_count):
+
+        if epoch == start_epoch and start_epoch_metrics is not None:
+            epoch_metrics = start_epoch_metrics
+            epoch_batch_count = start_epoch_batch_count
+        else:
+            epoch_metrics = {'train': create_counts(class_count, device)}
+            epoch_batch_count = 0
+
+        epoch_generator_state = generator.get_state()
+
+        # Throughput and padding ratio of the (resumed) epoch's batches
+        epoch_throughput_counts = tensor([0, 0, 0])  # [entities, real tokens, padded size]
+        epoch_stage_seconds = defaultdict(float)
+        epoch_start_time = time.time()
+
         #
         # Train
         #
 
         texter.train()
 
-        for _, sents_batch, masks_batch, gt_batch in tqdm(train_loader, desc=f'Epoch {epoch}'):
-            train_steps += len(sents_batch)
+        stage_timer.start()
 
-            sents_batch = sents_batch.to(device)
-            masks_batch = masks_batch.to(device)
-            gt_batch = gt_batch.to(device).float()
+        for _, sents_batch, masks_batch, gt_batch in tqdm(train_loader, desc=f'Epoch {epoch}', disable=rank != 0):
+            stage_timer.stop('load')
 
-            logits_batch = texter(sents_batch, masks_batch)[0]
-            loss = criterion(logits_batch, gt_batch)
+            if trace_path and rank == 0 and optimizer_steps == trace_first and tracer is None:
+                tracer = profile(use_cuda=True) if device == 'cuda' else profile()
+                tracer.__enter__()
 
-            optimizer.zero_grad()
-            loss.backward()
-            optimizer.step()
+            train_steps += len(sents_batch) * world_size
+            epoch_batch_count += 1
 
-            #
-            # Log metrics
-            #
+            epoch_throughput_counts += tensor([len(sents_batch), int(masks_batch.sum()), masks_batch.numel()])
+
+            sents_batch = sents_batch.to(device, non_blocking=pin_memory)
+            masks_batch = masks_batch.to(device, non_blocking=pin_memory)
+            gt_batch = gt_batch.to(device, non_blocking=pin_memory).float()
 
-            pred_batch = (logits_batch > 0).int()
+            stage_timer.stop('copy')
 
-            step_loss = loss.item()
-            step_pred_batch = pred_batch.cpu().numpy().tolist()
-            step_gt_batch = gt_batch.cpu().numpy().tolist()
+            optimizer.zero_grad()
 
-            epoch_metrics['train']['loss'] += step_loss
-            epoch_metrics['train']['pred_classes_stack'] += step_pred_batch
-            epoch_metrics['train']['gt_classes_stack'] += step_gt_batch
+            # Weight the micro batches' losses by their share of the batch to get the batch's mean loss
+            loss = 0
+            logits_chunks = []
 
-            if log_steps:
-                writer.add_scalars('loss', {'train': step_loss}, train_steps)
+            for micro_sents_batch, micro_masks_batch, micro_gt_batch in zip(sents_batch.split(micro_batch_size),
+                                                                            masks_batch.split(micro_batch_size),
+                                                                            gt_batch.split(micro_batch_size)):
+                micro_logits_batch = run_texter(texter, micro_sents_batch, micro_masks_batch,
+                                                bool(frozen_encoder_path))[0]
+                micro_loss = criterion(micro_logits_batch, micro_gt_batch) * len(micro_gt_batch) / len(gt_batch)
 
-                step_metrics = {'train': {
-                    'pred_classes_stack': step_pred_batch,
-                    'gt_classes_stack': step_gt_batch
-                }}
+                stage_timer.stop('forward')
 
-                log_class_metrics(step_metrics, writer, train_steps, class_count)
-                log_macro_metrics(step_metrics, writer, train_steps)
+                micro_loss.backward()
 
-            if try_batch_size:
-                break
+                loss += micro_loss.detach()
+                logits_chunks.append(micro_logits_batch.detach())
 
-        #
-        # Validate
-        #
+                stage_timer.stop('backward')
+
+            if world_size > 1:
+                average_grads(trained_params, world_size)
 
-        texter.eval()
+                stage_timer.stop('sync')
 
-        for _, sents_batch, masks_batch, gt_batch in tqdm(valid_loader, desc=f'Epoch {epoch}'):
-            valid_steps += len(sents_batch)
+            optimizer.step()
+            optimizer_steps += 1
 
-            sents_batch = sents_batch.to(device)
-            masks_batch = masks_batch.to(device)
-            gt_batch = gt_batch.to(device).float()
+            stage_timer.stop('step')
 
-            logits_batch = texter(sents_batch, masks_batch)[0]
-            loss = criterion(logits_batch, gt_batch)
+            logits_batch = torch.cat(logits_chunks)
 
             #
             # Log metrics
             #
 
-            pred_batch = (logits_batch > 0).int()
+            step_counts = count_batch(loss, logits_batch, gt_batch)
+            add_counts(epoch_metrics['train'], step_counts)
 
-            step_loss = loss.item()
-            step_pred_batch = pred_batch.cpu().numpy().tolist()
-            step_gt_batch = gt_batch.cpu().numpy().tolist()
+            if log_steps:
+                if world_size > 1:
+                    all_reduce_counts(step_counts)
+                    step_counts['loss'] /= world_size
 
-            epoch_metrics['valid']['loss'] += step_loss
-            epoch_metrics['valid']['pred_classes_stack'] += step_pred_batch
-            epoch_metrics['valid']['gt_classes_stack'] += step_gt_batch
+                writer.add_scalars('loss', {'train': step_counts['loss'].item()}, train_steps)
 
-            if log_steps:
-                writer.add_scalars('loss', {'valid': step_loss}, valid_steps)
+                step_metrics = {'train': step_counts}
+
+                log_class_metrics(step_metrics, writer, train_steps, class_count)
+                log_macro_metrics(step_metrics, writer, train_steps)
+
+            stage_timer.stop('metrics')
+
+            #
+            # Validate on (subsampled) valid set
+            #
+
+            if valid_interval is not None and optimizer_steps % valid_interval == 0:
+                stop_early = validate_and_persist(valid_sub_loader, train_steps)
+                texter.train()
 
-                step_metrics = {'valid': {
-                    'pred_classes_stack': step_pred_batch,
-                    'gt_classes_stack': step_gt_batch
-                }}
+                if stop_early:
+                    break
 
-                log_class_metrics(step_metrics, writer, valid_steps, class_count)
-                log_macro_metrics(step_metrics, writer, valid_steps)
+            if checkpoint_pt is not None and checkpoint_interval is not None \
+                    and optimizer_steps % checkpoint_interval == 0:
+                save_checkpoint(epoch, epoch_batch_count, epoch_metrics, epoch_generator_state)
+
+            if tracer is not None and optimizer_steps == trace_last:
+                tracer.__exit__(None, None, None)
+                tracer.export_chrome_trace(trace_path)
+                logging.info(f'Saved trace of optimizer steps {trace_first} to {trace_last} to {trace_path}')
+
+            stage_timer.stop('other')
+
+            if profile_stages:
+                step_stage_seconds = stage_timer.pop()
+                writer.add_scalars('stage_seconds', step_stage_seconds, train_steps)
+
+                for stage, seconds in step_stage_seconds.items():
+                    epoch_stage_seconds[stage] += seconds
 
             if try_batch_size:
                 break
 
+        epoch_seconds = time.time() - epoch_start_time
+
         #
-        # Log loss
+        # Log train loss and metrics
         #
 
-        train_loss = epoch_metrics['train']['loss'] / len(train_loader)
-        valid_loss = epoch_metrics['valid']['loss'] / len(valid_loader)
+        if world_size > 1:
+            all_reduce_counts(epoch_metrics['train'])
+
+        train_loss = epoch_metrics['train']['loss'].item() / max(epoch_batch_count * world_size, 1)
 
-        writer.add_scalars('loss', {'train': train_loss, 'valid': valid_loss}, epoch)
+        writer.add_scalars('loss', {'train': train_loss}, epoch)
+
+        log_class_metrics(epoch_metrics, writer, epoch, class_count)
+        log_macro_metrics(epoch_metrics, writer, epoch)
 
         #
-        # Log metrics
+        # Log throughput and stage times
         #
 
-        log_class_metrics(epoch_metrics, writer, epoch, class_count)
-        valid_f1 = log_macro_metrics(epoch_metrics, writer, epoch)
+        if world_size > 1:
+            dist.all_reduce(epoch_throughput_counts)
+
+        # With frozen encoder, the masks are sentence masks, so that sentences are counted instead of tokens
+        ent_count, tok_count, padded_count = epoch_throughput_counts.tolist()
+
+        if frozen_encoder_path:
+            writer.add_scalars('throughput', {'ents_per_second': ent_count / epoch_seconds,
+                                              'sents_per_second': tok_count / epoch_seconds}, epoch)
+
+            logging.info(f'Epoch {epoch}: {ent_count / epoch_seconds:.1f} entities/s,'
+                         f' {tok_count / epoch_seconds:.0f} sentences/s')
+
+        else:
+            padding_ratio = 1 - tok_count / max(padded_count, 1)
+
+            writer.add_scalars('padding', {'train': padding_ratio}, epoch)
+            writer.add_scalars('throughput', {'ents_per_second': ent_count / epoch_seconds,
+                                              'toks_per_second': tok_count / epoch_seconds}, epoch)
+
+            logging.info(f'Epoch {epoch}: {ent_count / epoch_seconds:.1f} entities/s,'
+                         f' {tok_count / epoch_seconds:.0f} tokens/s, Padding ratio = {padding_ratio:.4f}')
+
+        if profile_stages:
+            total_seconds = sum(epoch_stage_seconds.values())
+            logging.info(f'Epoch {epoch}: ' + ', '.join(f'{stage} {seconds / total_seconds:.1%}'
+                                                       for stage, seconds in epoch_stage_seconds.items()))
 
         #
-        # Persist Texter
+        # Validate and persist Texter
         #
 
-        if valid_f1 > best_valid_f1:
-            best_valid_f1 = valid_f1
-            texter_pkl.save(texter)
+        if valid_interval is None and not stop_early:
+            stop_early = validate_and_persist(valid_loader, epoch)
+
+        if checkpoint_pt is not None:
+            save_checkpoint(epoch + 1, 0, {'train': create_counts(class_count, device)}, generator.get_state())
+
+        if stop_early:
+            logging.info(f'Stop early after {stale_valid_count} validations without improvement.'
+                         f' Best valid F1 = {best_valid_f1:.4f}')
+            break
 
         if try_batch_size:
             break
 
+    # The training ended during the traced optimizer steps
+    if tracer is not None and optimizer_steps < trace_last:
+        tracer.__exit__(None, None, None)
+        tracer.export_chrome_trace(trace_path)
+        logging.info(f'Saved trace of optimizer steps {trace_first} to {optimizer_steps} to {trace_path}')
+
+    if pending_checkpoint is not None:
+        pending_checkpoint.result()
+
+    checkpoint_executor.shutdown()
+
+    #
+    # Fully validate best Texter
+    #
+
+    if valid_interval is not None:
+        logging.info('Fully validate best Texter ...')
+
+        # Wait for rank 0 to persist the best Texter
+        if world_size > 1:
+            dist.barrier()
+
+        best_texter = texter_pkl.load().to(device) if best_valid_f1 > 0 else texter
+
+        valid_counts = validate(best_texter, valid_loader, criterion, device, pin_memory,
+                                bool(frozen_encoder_path), max_valid_batches)
+
+        log_macro_metrics({'valid_full': valid_counts}, writer, train_steps)
+
+        prec, rec, f1 = (metric.mean().item() for metric in calc_prfs(valid_counts))
+        logging.info(f'Best Texter: Valid Loss = {valid_counts["loss"].item():.4f}, Macro Prec = {prec:.4f},'
+                     f' Macro Rec = {rec:.4f}, Macro F1 = {f1:.4f}')
+
+    # Samples trained on by this run (not by the resumed one), for the throughput
+    return train_steps - resumed_train_steps
+
+
+def validate(texter: Texter, valid_loader: DataLoader, criterion: BCEWithLogitsLoss, device: str,
+             pin_memory: bool, frozen_encoder: bool, max_batches: Optional[int] = None) -> Dict[str, Tensor]:
+    """
+    Validate in eval mode without building autograd graphs. With multiple
+    processes, the counts are summed over all processes' valid shards.
+
+    :return: Counts as returned by create_counts(), the loss is the mean over the batches
+    """
+
+    texter.eval()
+
+    valid_counts = create_counts(len(texter.classes), device)
+    batch_count = 0
+
+    with torch.no_grad():
+        for _, sents_batch, masks_batch, gt_batch in tqdm(valid_loader, desc='Validate', leave=False,
+                                                          disable=not is_main_process()):
+            sents_batch = sents_batch.to(device, non_blocking=pin_memory)
+            masks_batch = masks_batch.to(device, non_blocking=pin_memory)
+            gt_batch = gt_batch.to(device, non_blocking=pin_memory).float()
+
+            logits_batch = run_texter(texter, sents_batch, masks_batch, frozen_encoder)[0]
+            loss = criterion(logits_batch, gt_batch)
+
+            add_counts(valid_counts, count_batch(loss, logits_batch, gt_batch))
+            batch_count += 1
+
+            if batch_count == max_batches:
+                break
+
+    if dist.is_initialized():
+        batch_count = tensor(batch_count)
+        dist.all_reduce(batch_count)
+
+        all_reduce_counts(valid_counts)
+
+    valid_counts['loss'] /= batch_count
+
+    return valid_counts
+
+
+def is_main_process() -> bool:
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+
+def average_grads(params: List[Parameter], world_size: int) -> None:
+    """
+    Average the gradients over all processes, with a single all-reduce over
+    the flattened gradients
+    """
+
+    grads = [param.grad if param.grad is not None else torch.zeros_like(param) for param in params]
+
+    flat_grads = torch.cat([grad.reshape(-1) for grad in grads])
+    dist.all_reduce(flat_grads)
+    flat_grads /= world_size
+
+    offset = 0
+    for param, grad in zip(params, grads):
+        param.grad = flat_grads[offset:offset + grad.numel()].view_as(grad)
+        offset += grad.numel()
+
+
+def all_reduce_counts(counts: Dict[str, Tensor]) -> None:
+    """
+    Sum the counts over all processes, in place
+    """
+
+    for value in counts.values():
+        dist.all_reduce(value)
+
+
+class StageTimer:
+    """
+    Accumulates the wall time of consecutive stages of the train steps. Each
+    stage lasts from the previous stop() to its own stop(). With CUDA, the
+    device is synchronized at every stop() so that asynchronously launched
+    kernels are timed in their stage. Does nothing if disabled.
+    """
+
+    enabled: bool
+    sync_cuda: bool
+
+    stage_seconds: Dict[str, float]
+    last_time: float
+
+    def __init__(self, enabled: bool, device: str):
+        self.enabled = enabled
+        self.sync_cuda = enabled and device == 'cuda'
+
+        self.stage_seconds = defaultdict(float)
+        self.last_time = time.perf_counter()
+
+    def start(self) -> None:
+        self.last_time = time.perf_counter()
+
+    def stop(self, stage: str) -> None:
+        if not self.enabled:
+            return
+
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+
+        now = time.perf_counter()
+        self.stage_seconds[stage] += now - self.last_time
+        self.last_time = now
+
+    def pop(self) -> Dict[str, float]:
+        stage_seconds, self.stage_seconds = self.stage_seconds, defaultdict(float)
+
+        return dict(stage_seconds)
+
+
+class NullWriter:
+    """
+    Stands in for the SummaryWriter in the processes other than rank 0
+    """
+
+    def add_scalars(self, *args, **kwargs) -> None:
+        pass
+
+
+def run_texter(texter: Texter, sents_batch: Tensor, masks_batch: Tensor, frozen_encoder: bool) \
+        -> Tuple[Tensor, Tensor]:
+    """
+    :param sents_batch: (batch_size, sent_count, sent_len) tokens, or (batch_size, sent_count, emb_size)
+                        sentence embeddings with frozen encoder
+    :param masks_batch: (batch_size, sent_count, sent_len) token masks, or (batch_size, sent_count)
+                        sentence masks with frozen encoder
+    :return: logits_batch (batch_size, class_count), softs_batch (batch_size, class_count, sent_count)
+    """
+
+    if frozen_encoder:
+        return texter.classify(sents_batch, masks_batch)
+    else:
+        return texter(sents_batch, masks_batch)
+
+
+def embed_samples(texter: Texter, samples: List[Sample], sent_len: int, batch_size: int = 256) -> np.ndarray:
+    """
+    Embed the samples' sentences into the Texter's sentence cache, as the
+    Texter does during prediction
+
+    :return: (sample_count, sent_count) rows of the sentences' embeddings in the cache
+    """
+
+    texter.eval()
+
+    sent_cache = texter.sent_cache
+    rows = []
+
+    with torch.no_grad():
+        for i in tqdm(range(0, len(samples), batch_size), desc='Embed', disable=not is_main_process()):
+            sents_per_ent = [sample.sents for sample in samples[i:i + batch_size]]
+            _, pool_lens = texter.embed(sents_per_ent, sent_len=sent_len)
+
+            flat_sents = [sent for sents in sents_per_ent for sent in sents]
+            rows += [sent_cache.key_to_row[sent_cache.key(sent, pool_len)]
+                     for sent, pool_len in zip(flat_sents, pool_lens.tolist())]
+
+    return np.array(rows, dtype=np.int64).reshape(len(samples), -1)
+
+
+class EmbsDataset(Dataset):
+    """
+    Samples whose sentences are given by the rows of their embeddings in a
+    memory-mapped embeddings matrix. Items are (ent, embs (sent_count, emb_size),
+    classes (class_count)).
+    """
+
+    ents: np.ndarray
+    classes: np.ndarray
+    rows: np.ndarray
+    sent_embs: np.ndarray
+
+    def __init__(self, samples: List[Sample], rows: np.ndarray, sent_embs: np.ndarray):
+        """
+        :param rows: (sample_count, sent_count)
+        :param sent_embs: (row_count, emb_size)
+        """
+
+        self.ents = np.array([sample.ent for sample in samples])
+        self.classes = np.array([sample.classes for sample in samples])
+        self.rows = rows
+        self.sent_embs = sent_embs
+
+    def __len__(self) -> int:
+        return len(self.ents)
+
+    def __getitem__(self, index: int) -> Tuple[int, np.ndarray, np.ndarray]:
+        return self.ents[index], self.sent_embs[self.rows[index]], self.classes[index]
+
+
+def generate_embs_batch(batch: List[Tuple[int, np.ndarray, np.ndarray]]) -> Tuple[Tensor, Tensor, Tensor, Tensor]:
+    """
+    Like SamplesBatchGenerator, but for samples from an EmbsDataset. The order
+    of the sentences does not matter to the class head.
+
+    :param    batch:             [(ent, embs, classes)]
+
+    :return:  ent_batch:         IntTensor[batch_size],
+              sents_batch:       FloatTensor[batch_size, sent_count, emb_size],
+              sent_masks_batch:  BoolTensor[batch_size, sent_count],
+              classes_batch:     IntTensor[batch_size, class_count]
+    """
+
+    ent_batch, embs_batch, classes_batch = zip(*batch)
+
+    sents_batch = torch.from_numpy(np.stack(embs_batch))
+    sent_masks_batch = torch.ones(sents_batch.shape[:2], dtype=torch.bool)
+
+    return tensor(ent_batch), sents_batch, sent_masks_batch, torch.from_numpy(np.stack(classes_batch)).long()
+
+
+def copy_to_cpu(obj: Any) -> Any:
+    """
+    Copy the tensors in the (nested) dicts and lists to the CPU, so that they
+    are not modified while a checkpoint is written
+    """
+
+    if isinstance(obj, Tensor):
+        return obj.detach().cpu().clone()
+    elif isinstance(obj, dict):
+        return {key: copy_to_cpu(value) for key, value in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(copy_to_cpu(value) for value in obj)
+    else:
+        return obj
+
+
+class ResumableRandomSampler(Sampler):
+    """
+    Random permutation like the one used by `DataLoader(shuffle=True)`, that
+    can skip the samples of an interrupted epoch that have been trained on.
+
+    With multiple processes, all processes draw the same permutation from
+    equally seeded generators and each takes every world_size-th sample.
+    The permutation is padded with its first samples, so that all processes
+    perform the same number of steps.
+    """
+
+    data_len: int
+    generator: torch.Generator
+    rank: int
+    world_size: int
+
+    # Skipped in the next epoch only
+    skip_count: int
+
+    def __init__(self, data_len: int, generator: torch.Generator, rank: int = 0, world_size: int = 1):
+        self.data_len = data_len
+        self.generator = generator
+        self.rank = rank
+        self.world_size = world_size
+
+        self.skip_count = 0
+
+    def __iter__(self) -> Iterator[int]:
+        perm = self.permute()
+
+        padded_len = ceil(self.data_len / self.world_size) * self.world_size
+        perm += perm[:padded_len - self.data_len]
+
+        skip_count, self.skip_count = self.skip_count, 0
+
+        yield from perm[self.rank::self.world_size][skip_count:]
+
+    def __len__(self) -> int:
+        return ceil(self.data_len / self.world_size) - self.skip_count
+
+    def permute(self) -> List[int]:
+        return torch.randperm(self.data_len, generator=self.generator).tolist()
+
+
+class LengthGroupedSampler(ResumableRandomSampler):
+    """
+    Permutation whose batches contain samples of similar sentence lengths, so
+    that less padding is needed. The samples are shuffled, split into buckets
+    of `bucket_batch_count` (global) batches and sorted by length within each
+    bucket. Then, the full batches of all buckets are shuffled, and the last,
+    partial batch comes last.
+
+    With multiple processes, the global batches have `world_size * batch_size`
+    samples, of which each process takes every world_size-th.
+    """
+
+    sent_lens: np.ndarray
+    batch_size: int
+    bucket_batch_count: int
+
+    def __init__(self, sent_lens: np.ndarray, batch_size: int, generator: torch.Generator, rank: int = 0,
+                 world_size: int = 1, bucket_batch_count: int = 50):
+        """
+        :param sent_lens: Length of each sample's longest sentence, which determines its padding
+        """
+
+        super().__init__(len(sent_lens), generator, rank, world_size)
+
+        self.sent_lens = sent_lens
+        self.batch_size = batch_size
+        self.bucket_batch_count = bucket_batch_count
+
+    def permute(self) -> List[int]:
+        perm = super().permute()
+
+        global_batch_size = self.batch_size * self.world_size
+        bucket_size = global_batch_size * self.bucket_batch_count
+
+        batches = []
+        for i in range(0, len(perm), bucket_size):
+            bucket = sorted(perm[i:i + bucket_size], key=lambda idx: self.sent_lens[idx], reverse=True)
+            batches += [bucket[j:j + global_batch_size] for j in range(0, len(bucket), global_batch_size)]
+
+        last_batch = batches.pop() if len(batches[-1]) < global_batch_size else []
+
+        batch_perm = torch.randperm(len(batches), generator=self.generator).tolist()
+
+        return [idx for batch_idx in batch_perm for idx in batches[batch_idx]] + last_batch
+
+
+class SamplesBatchGenerator:
+    """
+    Collate function for samples from a `POWER Samples TSV`. It is a class
+    rather than a closure so that it can be sent to DataLoader workers, and
+    it does not modify the samples, which are shared between batches.
+    """
+
+    tokenizer: DistilBertTokenizer
+    sent_count: int
+    sent_len: int
+
+    def __init__(self, tokenizer: DistilBertTokenizer, sent_count: int, sent_len: int):
+        self.tokenizer = tokenizer
+        self.sent_count = sent_count
+        self.sent_len = sent_len
+
+    def __call__(self, batch: List[Sample]) -> Tuple[Tensor, Tensor, Tensor, Tensor]:
+        """
+        :param    batch:            [Sample(ent, ent_lbl, [class], [sent])]
+
+        :return:  ent_batch:        IntTensor[batch_size],
+                  tok_lists_batch:  IntTensor[batch_size, sent_count, sent_len],
+                  masks_batch:      IntTensor[batch_size, sent_count, sent_len],
+                  classes_batch:    IntTensor[batch_size, class_count]
+        """
+
+        ent_batch, _, classes_batch, sents_batch = zip(*batch)
+
+        # Shuffle copies of the sentence lists
+        sents_batch = [sample(sents, len(sents)) for sents in sents_batch]
+
+        flat_sents_batch = [sent for sents in sents_batch for sent in sents]
+
+        encoded = self.tokenizer(flat_sents_batch, padding=True, truncation=True, max_length=self.sent_len,
+                                 return_tensors='pt')
+
+        b_size = len(ent_batch)  # usually b_size == batch_size, except for last batch in samples
+        tok_lists_batch = encoded.input_ids.reshape(b_size, self.sent_count, -1)
+        masks_batch = encoded.attention_mask.reshape(b_size, self.sent_count, -1)
+
+        return tensor(ent_batch), tok_lists_batch, masks_batch, tensor(classes_batch)
+
+
+class ToksDataset(Dataset):
+    """
+    Samples from a memory-mapped `POWER Tokens Directory`. Items are
+    (ent, toks (sent_count, sent_len), lens (sent_count), classes (class_count)).
+    """
+
+    ents: np.ndarray
+    classes: np.ndarray
+    toks: np.ndarray
+    lens: np.ndarray
+
+    def __init__(self, toks_dir: ToksDir, class_count: int, sent_count: int, sent_len: int):
+        self.ents = toks_dir.ents_npy.load()
+        self.classes = toks_dir.classes_npy.load()[:, :class_count]
+        self.toks = toks_dir.toks_npy.load()[:, -sent_count:]
+        self.lens = toks_dir.lens_npy.load()[:, -sent_count:]
+
+        # Cropping the pre-tokenized sentences would cut off their [SEP] token
+        _, _, toks_sent_len = self.toks.shape
+        if toks_sent_len != sent_len:
+            raise ValueError(f'Sentences in {toks_dir.path} are tokenized to length {toks_sent_len},'
+                             f' not {sent_len}. Recreate them with create_texter_dataset.py --sent-len {sent_len}')
+
+    def __len__(self) -> int:
+        return len(self.ents)
+
+    def __getitem__(self, index: int) -> Tuple[int, np.ndarray, np.ndarray, np.ndarray]:
+        return self.ents[index], self.toks[index], self.lens[index], self.classes[index]
+
+
+def generate_toks_batch(batch: List[Tuple[int, np.ndarray, np.ndarray, np.ndarray]]) \
+        -> Tuple[Tensor, Tensor, Tensor, Tensor]:
+    """
+    Like SamplesBatchGenerator, but for pre-tokenized samples from a ToksDataset.
+    The sentences are shuffled and padded like the tokenizer would.
+
+    :param    batch:            [(ent, toks, lens, classes)]
+
+    :return:  ent_batch:        IntTensor[batch_size],
+              tok_lists_batch:  IntTensor[batch_size, sent_count, sent_len],
+              masks_batch:      IntTensor[batch_size, sent_count, sent_len],
+              classes_batch:    IntTensor[batch_size, class_count]
+    """
+
+    ent_batch, toks_batch, lens_batch, classes_batch = zip(*batch)
+
+    # Shuffle sentences by fancy indexing, which copies the memory-mapped arrays
+    sent_count = len(lens_batch[0])
+    perms = [sample(range(sent_count), sent_count) for _ in batch]
+
+    toks_batch = np.stack([toks[perm] for toks, perm in zip(toks_batch, perms)])
+    lens_batch = np.stack([lens[perm] for lens, perm in zip(lens_batch, perms)])
+
+    # Crop to the longest sentence in the batch
+    max_len = lens_batch.max()
+    tok_lists_batch = torch.from_numpy(toks_batch[:, :, :max_len].astype(np.int64))
+
+    positions = torch.arange(max_len)
+    masks_batch = (positions < torch.from_numpy(lens_batch).unsqueeze(-1)).long()
+
+    return tensor(ent_batch), tok_lists_batch, masks_batch, torch.from_numpy(np.stack(classes_batch)).long()
+
+
+def calc_max_sent_lens(tokenizer: DistilBertTokenizer, samples: List[Sample], sent_len: int,
+                       batch_size: int = 1024) -> np.ndarray:
+    """
+    :return: Token count of each sample's longest sentence, truncated like by SamplesBatchGenerator
+    """
+
+    max_sent_lens = []
+
+    for i in tqdm(range(0, len(samples), batch_size), desc='Measure sentences', disable=not is_main_process()):
+        sents_per_ent = [ent_sample.sents for ent_sample in samples[i:i + batch_size]]
+        flat_sents = [sent for sents in sents_per_ent for sent in sents]
+
+        flat_tok_lists = tokenizer(flat_sents, truncation=True, max_length=sent_len).input_ids
+
+        offset = 0
+        for sents in sents_per_ent:
+            max_sent_lens.append(max(len(tok_list) for tok_list in flat_tok_lists[offset:offset + len(sents)]))
+            offset += len(sents)
+
+    return np.array(max_sent_lens)
+
+
+def get_device_memory(device: str) -> int:
+    """
+    :return: Total memory of the GPU, or of the host for the CPU, in bytes
+    """
+
+    if device == 'cuda':
+        return torch.cuda.get_device_properties(device).total_memory
+    else:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def find_micro_batch_size(texter: Texter, criterion: BCEWithLogitsLoss, device: str, class_count: int,
+                          sent_count: int, sent_len: int, batch_size: int, memory_budget: int) -> int:
+    """
+    Double the micro batch size, starting at 1, as long as a train step on a
+    batch of full-length sentences stays within the memory budget. Then,
+    bisect between the last fitting and the first failing micro batch size.
+
+    :param memory_budget: In bytes
+    :return: Largest fitting micro batch size, at most the batch size
+    """
+
+    # AdamW allocates two moment tensors per parameter on its first step, which has not happened yet
+    optimizer_memory = 2 * sum(param.numel() * param.element_size() for param in texter.parameters())
+
+    texter.train()
+
+    def fits(try_batch_size: int) -> bool:
+        try:
+            peak_memory = measure_train_step(texter, criterion, device, try_batch_size, class_count, sent_count,
+                                             sent_len)
+
+        except RuntimeError as e:
+            if 'out of memory' not in str(e):
+                raise
+
+            texter.zero_grad()
+            torch.cuda.empty_cache()
+
+            logging.info(f'Micro batch size {try_batch_size} runs out of memory')
+            return False
+
+        logging.info(f'Micro batch size {try_batch_size} uses {(peak_memory + optimizer_memory) / 2 ** 30:.2f}'
+                     f' of {memory_budget / 2 ** 30:.2f} GiB')
+
+        return peak_memory + optimizer_memory <= memory_budget
+
+    # Largest fitting micro batch size so far, 0 if none
+    fitting_batch_size = 0
+    try_batch_size = 1
+
+    while try_batch_size <= batch_size and fits(try_batch_size):
+        fitting_batch_size = try_batch_size
+        try_batch_size *= 2
+
+    # Smallest failing micro batch size so far, or one above the batch size
+    failing_batch_size = min(try_batch_size, batch_size + 1)
+
+    while failing_batch_size - fitting_batch_size > 1:
+        try_batch_size = (fitting_batch_size + failing_batch_size) // 2
+
+        if fits(try_batch_size):
+            fitting_batch_size = try_batch_size
+        else:
+            failing_batch_size = try_batch_size
+
+    if fitting_batch_size == 0:
+        logging.warning('Not even micro batch size 1 fits the memory budget. Use it anyway.')
+        fitting_batch_size = 1
+
+    return fitting_batch_size
+
+
+def measure_train_step(texter: Texter, criterion: BCEWithLogitsLoss, device: str, batch_size: int,
+                       class_count: int, sent_count: int, sent_len: int) -> int:
+    """
+    Perform forward and backward pass (without optimizer step) on a dummy
+    batch of full-length sentences
+
+    :return: Peak memory usage during the step in bytes, of the CUDA device or the process
+    """
+
+    toks_batch = torch.zeros(batch_size, sent_count, sent_len, dtype=torch.long, device=device)
+    masks_batch = torch.ones_like(toks_batch)
+    gt_batch = torch.zeros(batch_size, class_count, device=device)
+
+    if device == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+    else:
+        peak_rss_reset = reset_peak_rss()
+
+    logits_batch = texter(toks_batch, masks_batch)[0]
+    criterion(logits_batch, gt_batch).backward()
+
+    texter.zero_grad()
+
+    if device == 'cuda':
+        return torch.cuda.max_memory_allocated(device)
+
+    if peak_rss_reset:
+        return get_peak_rss()
+
+    # The process' peak since its start, which can only overestimate the step's peak.
+    # On Linux, ru_maxrss is given in KiB.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_rss() -> bool:
+    """
+    Reset the process' peak resident set size to its current one, which is only
+    supported by Linux
+
+    :return: Whether the peak has been reset
+    """
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+
+        return True
+
+    except OSError:
+        return False
+
+
+def get_peak_rss() -> int:
+    """
+    :return: Peak resident set size of the process since the last reset_peak_rss(), in bytes
+    """
+
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+
+    raise ValueError('No VmHWM in /proc/self/status')
+
+
+def create_counts(class_count: int, device: str) -> Dict[str, Tensor]:
+    """
+    :return: {'loss': FloatTensor[], 'tp': LongTensor[class_count], 'fp': LongTensor[class_count],
+              'fn': LongTensor[class_count]}, all zero and on the device
+    """
+
+    return {'loss': torch.zeros((), device=device),
+            'tp': torch.zeros(class_count, dtype=torch.long, device=device),
+            'fp': torch.zeros(class_count, dtype=torch.long, device=device),
+            'fn': torch.zeros(class_count, dtype=torch.long, device=device)}
+
+
+def count_batch(loss: Tensor, logits_batch: Tensor, gt_batch: Tensor) -> Dict[str, Tensor]:
+    """
+    Count true positives, false positives and false negatives per class
+    without leaving the device
+
+    :param loss:          FloatTensor[]
+    :param logits_batch:  FloatTensor[batch_size, class_count]
+    :param gt_batch:      FloatTensor[batch_size, class_count]
+
+    :return: Counts as returned by create_counts()
+    """
+
+    pred_batch = logits_batch.detach() > 0
+    gt_batch = gt_batch.bool()
+
+    return {'loss': loss.detach(),
+            'tp': (pred_batch & gt_batch).sum(dim=0),
+            'fp': (pred_batch & ~gt_batch).sum(dim=0),
+            'fn': (~pred_batch & gt_batch).sum(dim=0)}
+
+
+def add_counts(counts: Dict[str, Tensor], other_counts: Dict[str, Tensor]) -> None:
+    for key, value in other_counts.items():
+        counts[key] += value
+
+
+def calc_prfs(counts: Dict[str, Tensor]) -> Tuple[Tensor, Tensor, Tensor]:
+    """
+    Calculate class-wise precision, recall and F1 from the counts, 0 where undefined,
+    like sklearn's precision_recall_fscore_support(zero_division=0)
+
+    :return: prec, rec, f1, each a DoubleTensor[class_count]
+    """
+
+    tp, fp, fn = counts['tp'].double(), counts['fp'].double(), counts['fn'].double()
+
+    # Where a denominator is 0, the numerator tp is 0 as well
+    prec = tp / (tp + fp).clamp(min=1)
+    rec = tp / (tp + fn).clamp(min=1)
+    f1 = 2 * tp / (2 * tp + fp + fn).clamp(min=1)
+
+    return prec, rec, f1
+
 
 def log_class_metrics(data: Dict, writer: SummaryWriter, x: int, class_count: int) -> None:
     """
     Calculate class-wise metrics and log metrics of most/least common metrics to Tensorboard
 
-    :param data: {'train': {'gt_classes_stack': [[gt_class]], 'pred_classes_stack': [[pred_class]]},
-                  'valid': {'gt_classes_stack': [[gt_class]], 'pred_classes_stack': [[pred_class]]}}
+    :param data: {'train': counts, 'valid': counts}, counts as returned by create_counts()
 
     :param class_count: Log <class_count> most common and <class_count> least common classes
     """
@@ -411,14 +1626,11 @@ def log_class_metrics(data: Dict, writer: SummaryWriter, x: int, class_count: in
     least_common_classes = range(class_count - 3, class_count)
     log_classes = [*most_common_classes, *least_common_classes]
 
-    for split, metrics in data.items():
-        prfs_list = precision_recall_fscore_support(metrics['gt_classes_stack'],
-                                                    metrics['pred_classes_stack'],
-                                                    average=None,
-                                                    zero_division=0)
+    for split, counts in data.items():
+        precs, recs, f1s = (metric.tolist() for metric in calc_prfs(counts))
 
         # c = class
-        for c, (prec, rec, f1, _), in enumerate(zip(*prfs_list)):
+        for c, (prec, rec, f1), in enumerate(zip(precs, recs, f1s)):
             if c not in log_classes:
                 continue
 
@@ -431,19 +1643,15 @@ def log_macro_metrics(data: Dict, writer: SummaryWriter, x: int) -> float:
     """
     Calculate macro metrics across all classes and log them to Tensorboard
 
-    :param data: {'train': {'gt_classes_stack': [[gt_class]], 'pred_classes_stack': [[pred_class]]},
-                  'valid': {'gt_classes_stack': [[gt_class]], 'pred_classes_stack': [[pred_class]]}}
+    :param data: {'train': counts, 'valid': counts}, counts as returned by create_counts()
 
     :param x: Value on x-axis
 
     :return F1 score
     """
 
-    for split, metrics in data.items():
-        prec, rec, f1, _ = precision_recall_fscore_support(metrics['gt_classes_stack'],
-                                                           metrics['pred_classes_stack'],
-                                                           average='macro',
-                                                           zero_division=0)
+    for split, counts in data.items():
+        prec, rec, f1 = (metric.mean().item() for metric in calc_prfs(counts))
 
         writer.add_scalars('precision', {split: prec}, x)
         writer.add_scalars('recall', {split: rec}, x)
@@ -1,132 +1,335 @@
 import logging
-from argparse import Namespace
+import multiprocessing
+import os
+import random
+import time
+from argparse import ArgumentParser, Namespace
+from collections import deque
+from dataclasses import dataclass
+from datetime import timedelta
+from multiprocessing.connection import wait
+from pathlib import Path
+from typing import Optional
 
-from train_texter import train_texter
+import torch
+
+from data.power.sweep_tsv import SweepTsv
+from train_texter import train_texter, get_device_memory
 
 
 def main():
     logging.basicConfig(format='%(asctime)s | %(levelname)s | %(message)s', level=logging.INFO)
 
+    args = parse_args()
+
+    train_texter_datasets(args)
+
+    logging.info('Finished successfully')
+
+
+def parse_args():
+    parser = ArgumentParser()
+
+    parser.add_argument('sweep_tsv', metavar='sweep-tsv',
+                        help='Path to (input) POWER Sweep TSV')
+
+    default_job_log_dir = 'logs/'
+    parser.add_argument('--job-log-dir', dest='job_log_dir', metavar='STR', default=default_job_log_dir,
+                        help='Directory of the jobs\' log files (default: {})'.format(default_job_log_dir))
+
+    parser.add_argument('--job-memory', dest='job_memory', type=float, metavar='FLOAT',
+                        help='Memory budget per job in GiB, the device\'s memory is shared among the --jobs if'
+                             ' not specified. It only limits the automatic micro batch size, jobs are launched'
+                             ' regardless of the free memory, so --jobs times --job-memory must fit the device')
+
+    parser.add_argument('--job-threads', dest='job_threads', type=int, metavar='INT',
+                        help='Number of CPU threads per job, the CPU cores are shared among the --jobs if not'
+                             ' specified')
+
+    default_jobs = 1
+    parser.add_argument('--jobs', dest='jobs', type=int, metavar='INT', default=default_jobs,
+                        help='Number of concurrently running jobs (default: {})'.format(default_jobs))
+
+    default_retries = 2
+    parser.add_argument('--retries', dest='retries', type=int, metavar='INT', default=default_retries,
+                        help='Number of times a failed job is resumed from its last checkpoint'
+                             ' (default: {})'.format(default_retries))
+
+    args = parser.parse_args()
+
+    #
+    # Log applied config
+    #
+
+    logging.info('Applied config:')
+    logging.info('    {:24} {}'.format('sweep-tsv', args.sweep_tsv))
+    logging.info('    {:24} {}'.format('--job-log-dir', args.job_log_dir))
+    logging.info('    {:24} {}'.format('--job-memory', args.job_memory))
+    logging.info('    {:24} {}'.format('--job-threads', args.job_threads))
+    logging.info('    {:24} {}'.format('--jobs', args.jobs))
+    logging.info('    {:24} {}'.format('--retries', args.retries))
+
+    return args
+
+
+@dataclass
+class Job:
+    texter_pkl: Path
+    args: Namespace
+
+    attempts: int = 0
+    seconds: float = 0
+    sample_count: int = 0  # Trained on by the successful attempt
+    sample_seconds: float = 0  # Of the successful attempt
+
+
+def train_texter_datasets(args):
+    sweep_tsv_path = args.sweep_tsv
+
+    job_log_dir_path = args.job_log_dir
+    job_memory = args.job_memory
+    job_threads = args.job_threads
+    job_count = args.jobs
+    retries = args.retries
+
+    if job_threads is None:
+        job_threads = max(1, os.cpu_count() // job_count)
+
+    #
+    # Check that (input) POWER Sweep TSV exists
+    #
+
+    logging.info('Check that (input) POWER Sweep TSV exists ...')
+
+    sweep_tsv = SweepTsv(Path(sweep_tsv_path))
+    sweep_tsv.check()
+
+    job_log_dir = Path(job_log_dir_path)
+    job_log_dir.mkdir(parents=True, exist_ok=True)
+
+    #
+    # Create jobs, skip the ones whose POWER Texter PKL exists
+    #
+
+    logging.info('Create jobs ...')
+
+    jobs = []
+    skipped_jobs = []
+
+    for row in sweep_tsv.load():
+        job_args = create_job_args()
+
+        for name, value in row.items():
+            if not hasattr(job_args, name):
+                raise ValueError(f'Unknown train_texter arg "{name}" in POWER Sweep TSV')
+
+            setattr(job_args, name, value)
+
+        for name in ['samples_dir', 'sent_count', 'split_dir', 'texter_pkl', 'batch_size']:
+            if getattr(job_args, name) is None:
+                raise ValueError(f'Missing train_texter arg "{name}" in POWER Sweep TSV')
+
+        # Jobs run in a single process each, the sweep parallelizes across jobs (--jobs)
+        if job_args.workers != 1:
+            raise ValueError(f'train_texter arg "workers" must be 1 in POWER Sweep TSV, got {job_args.workers}')
+
+        texter_pkl = Path(job_args.texter_pkl)
+
+        if texter_pkl.is_file():
+            logging.info(f'Skip {texter_pkl}, it already exists')
+            skipped_jobs.append(texter_pkl)
+            continue
+
+        # Train to a partial POWER Texter PKL that replaces the final one on success, so that
+        # the final one only exists for completed jobs
+        job_args.texter_pkl = str(texter_pkl) + '.part'
+
+        if job_args.checkpoint is None:
+            job_args.checkpoint = str(texter_pkl) + '.checkpoint.pt'
+
+        jobs.append(Job(texter_pkl, job_args))
+
     #
-    # Specify config
+    # Run jobs concurrently
     #
 
+    logging.info(f'Run {len(jobs)} jobs, {job_count} at a time with {job_threads} threads each ...')
+
+    start_time = time.time()
+
+    context = multiprocessing.get_context('spawn')
+
+    pending_jobs = deque(jobs)
+    running_jobs = {}  # {sentinel: (job, process, sample_count, start time)}
+
+    finished_jobs = []
+    failed_jobs = []
+
+    while pending_jobs or running_jobs:
+        while pending_jobs and len(running_jobs) < job_count:
+            job = pending_jobs.popleft()
+
+            # A failed job's partial POWER Texter PKL can only be continued from its checkpoint
+            job.args.resume = Path(job.args.checkpoint).is_file()
+            job.args.overwrite = True
+
+            log_path = job_log_dir / f'train_texter_{job.texter_pkl.stem}.log'
+
+            logging.info(f'{"Resume" if job.args.resume else "Start"} {job.texter_pkl} (log: {log_path}) ...')
+
+            sample_count = context.Value('q', -1)
+            process = context.Process(target=run_job,
+                                      args=(job.args, job_threads, job_memory, job_count, log_path, sample_count))
+            process.start()
+
+            running_jobs[process.sentinel] = (job, process, sample_count, time.time())
+
+        for sentinel in wait(list(running_jobs)):
+            job, process, sample_count, job_start_time = running_jobs.pop(sentinel)
+            process.join()
+
+            seconds = time.time() - job_start_time
+            job.seconds += seconds
+            job.attempts += 1
+
+            if process.exitcode == 0:
+                job.sample_count = sample_count.value
+                job.sample_seconds = seconds
+
+                finish_job(job)
+                finished_jobs.append(job)
+
+                logging.info(f'Finished {job.texter_pkl} after {format_seconds(job.seconds)}:'
+                             f' {job.sample_count / seconds:.1f} samples/s')
+
+            elif job.attempts <= retries:
+                logging.warning(f'{job.texter_pkl} failed with exit code {process.exitcode}. Retry.')
+                pending_jobs.append(job)
+
+            else:
+                logging.error(f'{job.texter_pkl} failed with exit code {process.exitcode}. Give up.')
+                failed_jobs.append(job)
+
+    #
+    # Report throughput
+    #
+
+    seconds = time.time() - start_time
+
+    logging.info(f'{len(finished_jobs)} jobs finished, {len(failed_jobs)} failed and {len(skipped_jobs)} skipped'
+                 f' in {format_seconds(seconds)}')
+
+    for job in finished_jobs:
+        logging.info(f'    {str(job.texter_pkl):60} {job.attempts} attempts, {format_seconds(job.seconds):>10},'
+                     f' {job.sample_count / job.sample_seconds:8.1f} samples/s')
+
+    for job in failed_jobs:
+        logging.info(f'    {str(job.texter_pkl):60} {job.attempts} attempts, {format_seconds(job.seconds):>10},'
+                     f' failed')
+
+    sample_count = sum(job.sample_count for job in finished_jobs)
+    logging.info(f'Total: {sample_count / seconds:.1f} samples/s')
+
+
+def create_job_args() -> Namespace:
+    """
+    :return: Defaults for the train_texter args that are not specified by the POWER Sweep TSV
+    """
+
     args = Namespace()
 
-    # args.samples_dir
+    args.samples_dir = None
     args.class_count = 100
-    # args.sent_count
-    # args.split_dir
-    # args.texter_pkl
+    args.sent_count = None
+    args.split_dir = None
+    args.texter_pkl = None
 
-    # args.batch_size
+    args.auto_batch_size = True
+    # Effective batch sizes that worked on a GTX 1080 Ti with 11GB RAM were 128, 32, 8 and 4 for 1, 5,
+    # 15 and 30 sentences. On other hosts, train_texter finds the largest fitting micro batch size and
+    # accumulates gradients to reach them.
+    args.batch_size = None
+    args.checkpoint = None
+    args.checkpoint_interval = None
     args.device = 'cuda'
     args.epoch_count = 20
-    # args.log_dir
+    args.frozen_encoder = None
+    args.group_by_length = False
+    args.log_dir = None
     args.log_steps = False
     args.lr = 1e-5
-    # args.overwrite
+    args.memory_budget = None
+    args.micro_batch_size = None
+    args.num_workers = 0
+    args.overwrite = False
+    args.patience = None
+    args.pin_memory = False
+    args.precision = 'fp32'
+    args.pre_tokenized = False
+    args.prefetch_factor = 2
+    args.profile = False
+    args.random_seed = None
+    args.resume = False
     args.sent_len = 64
-    # args.try_batch_size
+    args.trace = None
+    args.trace_steps = [10, 20]
+    args.try_batch_size = False
+    args.valid_batch_size = None
+    args.valid_interval = None
+    args.valid_subsample = None
+    args.workers = 1
 
-    #
-    # Combinations
-    #
+    return args
 
-    a = 'data/power/samples'
-    b = 'data/power/split'
-    c = 'data/power/texter'
-
-    # [(samples_dir, sent_count, split_dir, texter_pkl, batch_size, log_dir)]
-    # Start out with twice the batch size that works on a GTX 1080 Ti with 11GB RAM.
-    # [[(dataset, sent count), BASE batch size, OWER batch size]]
-    combos = [
-        [f'{a}/cde-cde-1-clean/', 1, f'{b}/cde-0/', f'{c}/cde-cde-1-clean.pkl', 256, 'runs/cde-cde-1-clean/'],
-        [f'{a}/cde-cde-5-clean/', 5, f'{b}/cde-0/', f'{c}/cde-cde-5-clean.pkl', 64, 'runs/cde-cde-5-clean/'],
-        [f'{a}/cde-cde-15-clean/', 15, f'{b}/cde-0/', f'{c}/cde-cde-15-clean.pkl', 16, 'runs/cde-cde-15-clean/'],
-        [f'{a}/cde-cde-30-clean/', 30, f'{b}/cde-0/', f'{c}/cde-cde-30-clean.pkl', 8, 'runs/cde-cde-30-clean/'],
-        [f'{a}/cde-irt-1-clean/', 1, f'{b}/cde-0/', f'{c}/cde-irt-1-clean.pkl', 256, 'runs/cde-irt-1-clean/'],
-        [f'{a}/cde-irt-1-marked/', 1, f'{b}/cde-0/', f'{c}/cde-irt-1-marked.pkl', 256, 'runs/cde-irt-1-marked/'],
-        [f'{a}/cde-irt-1-masked/', 1, f'{b}/cde-0/', f'{c}/cde-irt-1-masked.pkl', 256, 'runs/cde-irt-1-masked/'],
-        [f'{a}/cde-irt-5-clean/', 5, f'{b}/cde-0/', f'{c}/cde-irt-5-clean.pkl', 64, 'runs/cde-irt-5-clean/'],
-        [f'{a}/cde-irt-5-marked/', 5, f'{b}/cde-0/', f'{c}/cde-irt-5-marked.pkl', 64, 'runs/cde-irt-5-marked/'],
-        [f'{a}/cde-irt-5-masked/', 5, f'{b}/cde-0/', f'{c}/cde-irt-5-masked.pkl', 64, 'runs/cde-irt-5-masked/'],
-        [f'{a}/cde-irt-15-clean/', 15, f'{b}/cde-0/', f'{c}/cde-irt-15-clean.pkl', 16, 'runs/cde-irt-15-clean/'],
-        [f'{a}/cde-irt-15-marked/', 15, f'{b}/cde-0/', f'{c}/cde-irt-15-marked.pkl', 16, 'runs/cde-irt-15-marked/'],
-        [f'{a}/cde-irt-15-masked/', 15, f'{b}/cde-0/', f'{c}/cde-irt-15-masked.pkl', 16, 'runs/cde-irt-15-masked/'],
-        [f'{a}/cde-irt-30-clean/', 30, f'{b}/cde-0/', f'{c}/cde-irt-30-clean.pkl', 8, 'runs/cde-irt-30-clean/'],
-        [f'{a}/cde-irt-30-marked/', 30, f'{b}/cde-0/', f'{c}/cde-irt-30-marked.pkl', 8, 'runs/cde-irt-30-marked/'],
-        [f'{a}/cde-irt-30-masked/', 30, f'{b}/cde-0/', f'{c}/cde-irt-30-masked.pkl', 8, 'runs/cde-irt-30-masked/'],
-        [f'{a}/fb-irt-1-clean/', 1, f'{b}/fb-0/', f'{c}/fb-irt-1-clean.pkl', 256, 'runs/fb-irt-1-clean/'],
-        [f'{a}/fb-irt-1-marked/', 1, f'{b}/fb-0/', f'{c}/fb-irt-1-marked.pkl', 256, 'runs/fb-irt-1-marked/'],
-        [f'{a}/fb-irt-1-masked/', 1, f'{b}/fb-0/', f'{c}/fb-irt-1-masked.pkl', 256, 'runs/fb-irt-1-masked/'],
-        [f'{a}/fb-irt-5-clean/', 5, f'{b}/fb-0/', f'{c}/fb-irt-5-clean.pkl', 64, 'runs/fb-irt-5-clean/'],
-        [f'{a}/fb-irt-5-marked/', 5, f'{b}/fb-0/', f'{c}/fb-irt-5-marked.pkl', 64, 'runs/fb-irt-5-marked/'],
-        [f'{a}/fb-irt-5-masked/', 5, f'{b}/fb-0/', f'{c}/fb-irt-5-masked.pkl', 64, 'runs/fb-irt-5-masked/'],
-        [f'{a}/fb-irt-15-clean/', 15, f'{b}/fb-0/', f'{c}/fb-irt-15-clean.pkl', 16, 'runs/fb-irt-15-clean/'],
-        [f'{a}/fb-irt-15-marked/', 15, f'{b}/fb-0/', f'{c}/fb-irt-15-marked.pkl', 16, 'runs/fb-irt-15-marked/'],
-        [f'{a}/fb-irt-15-masked/', 15, f'{b}/fb-0/', f'{c}/fb-irt-15-masked.pkl', 16, 'runs/fb-irt-15-masked/'],
-        [f'{a}/fb-irt-30-clean/', 30, f'{b}/fb-0/', f'{c}/fb-irt-30-clean.pkl', 8, 'runs/fb-irt-30-clean/'],
-        [f'{a}/fb-irt-30-marked/', 30, f'{b}/fb-0/', f'{c}/fb-irt-30-marked.pkl', 8, 'runs/fb-irt-30-marked/'],
-        [f'{a}/fb-irt-30-masked/', 30, f'{b}/fb-0/', f'{c}/fb-irt-30-masked.pkl', 8, 'runs/fb-irt-30-masked/'],
-        [f'{a}/fb-owe-1-clean/', 1, f'{b}/fb-0/', f'{c}/fb-owe-1-clean.pkl', 256, 'runs/fb-owe-1-clean/'],
-    ]
 
-    #
-    # Try batches sizes. Decrease if graphics RAM is not sufficient until it fits.
-    #
+def run_job(args: Namespace, threads: int, memory: Optional[float], job_count: int, log_path: Path,
+            sample_count: multiprocessing.Value) -> None:
+    """
+    Entry point of the job processes. Log to the job's log file and
+    return the number of trained samples via `sample_count`.
+    """
 
-    for combo in combos:
-        samples_dir, sent_count, split_dir, _, batch_size, _ = combo
+    logging.basicConfig(filename=log_path, format='%(asctime)s | %(levelname)s | %(message)s', level=logging.INFO)
 
-        args.samples_dir = samples_dir
-        args.sent_count = sent_count
-        args.texter_pkl = 'data/power/texter/try_batch_size.pkl'
-        args.split_dir = split_dir
+    torch.set_num_threads(threads)
 
-        args.batch_size = batch_size
-        args.log_dir = 'runs/try_batch_size/'
-        args.overwrite = True
-        args.try_batch_size = True
+    if args.random_seed:
+        random.seed(args.random_seed)
 
-        while True:
-            try:
-                logging.info(f'Try batch size {batch_size} for samples {samples_dir}')
-                train_texter(args)
+    if args.memory_budget is None:
+        if memory is None:
+            memory = 0.9 * get_device_memory(args.device) / job_count / 2 ** 30
 
-                # Halve once more, just to be safe
-                batch_size //= 2
-                combo[-2] = batch_size
+        args.memory_budget = memory
 
-                logging.info(f'Works. Use batch size {batch_size} for samples {samples_dir}')
-                break
+    try:
+        sample_count.value = train_texter(args)
+    except Exception:
+        logging.exception('Training failed')
+        raise
 
-            except RuntimeError:
-                logging.warning(f'Batch size {batch_size} too large for samples {samples_dir}.'
-                                f' Halve batch size to {batch_size // 2}.')
 
-                batch_size //= 2
-                combo[-2] = batch_size
-                args.batch_size = batch_size
+def finish_job(job: Job) -> None:
+    """
+    Replace the final POWER Texter PKL by the partial one and remove the
+    checkpoint that is not needed anymore
+    """
 
-    #
-    # Perform grid search
-    #
+    partial_texter_pkl = Path(job.args.texter_pkl)
+
+    if partial_texter_pkl.is_file():
+        os.replace(partial_texter_pkl, job.texter_pkl)
+    else:
+        logging.warning(f'{job.texter_pkl} has not been saved, as no validation scored a valid F1 > 0')
+
+    checkpoint_pt = Path(job.args.checkpoint)
 
-    for i in range(3):
-        for samples_dir, sent_count, split_dir, texter_pkl, batch_size, log_dir in combos:
-            args.samples_dir = samples_dir
-            args.sent_count = sent_count
-            args.split_dir = split_dir
-            args.texter_pkl = texter_pkl
+    if checkpoint_pt.is_file():
+        checkpoint_pt.unlink()
 
-            args.batch_size = batch_size
-            args.log_dir = log_dir
-            args.overwrite = False
-            args.try_batch_size = False
 
-            logging.info(f'Training on samples {samples_dir}')
-            train_texter(args)
+def format_seconds(seconds: float) -> str:
+    return str(timedelta(seconds=round(seconds)))
 
 
 if __name__ == '__main__':
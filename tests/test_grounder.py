@@ -0,0 +1,253 @@
+import random
+import re
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.joinpath('src')))
+
+import power.grounder
+from models.ent import Ent
+from models.fact import Fact
+from models.rel import Rel
+from models.rule import Rule
+from models.var import Var
+from power.grounder import Grounder, IndexGrounder, MatrixGrounder, Neo4jGrounder
+
+ent_to_lbl = {ent: f'ent {ent}' for ent in range(8)}
+
+# (head, rel, tail)
+train_triples = [(0, 0, 1), (2, 0, 1), (3, 0, 1), (1, 1, 4), (4, 2, 5), (5, 2, 4), (6, 1, 7), (0, 2, 0)]
+valid_known_triples = [(6, 0, 1), (3, 1, 4), (1, 1, 6)]
+
+graph_triples = train_triples + valid_known_triples
+
+X, Y = Var('X'), Var('Y')
+
+
+def ent(ent_id: int) -> Ent:
+    return Ent(ent_id, ent_to_lbl[ent_id])
+
+
+def rel(rel_id: int) -> Rel:
+    return Rel(rel_id, f'rel {rel_id}')
+
+
+def rule(head: Fact, body) -> Rule:
+    return Rule(10, 5, 0.5, head, body)
+
+
+class FakeTransaction:
+    """
+    Answers the Cypher queries of the Neo4jGrounder from the graph triples
+    """
+
+    def run(self, cypher, head_id=None, tail_id=None):
+        rel_id = int(re.search(r'R_(\d+)', cypher).group(1))
+
+        return [({'id': h}, {'id': r}, {'id': t}) for h, r, t in sorted(set(graph_triples))
+                if r == rel_id and head_id in (None, h) and tail_id in (None, t)]
+
+
+class FakeSession:
+
+    def write_transaction(self, fn, **kwargs):
+        return fn(FakeTransaction(), **kwargs)
+
+    def close(self):
+        pass
+
+
+class FakeDriver:
+
+    def session(self):
+        return FakeSession()
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def grounders(monkeypatch):
+    monkeypatch.setattr(power.grounder.GraphDatabase, 'driver', lambda url, auth: FakeDriver())
+
+    return [Neo4jGrounder('bolt://localhost:7687', 'neo4j', 'password', ent_to_lbl),
+            IndexGrounder(graph_triples, ent_to_lbl),
+            MatrixGrounder(graph_triples, ent_to_lbl)]
+
+
+single_body_rules = [
+    rule(Fact(X, rel(1), ent(4)), [Fact(X, rel(0), ent(1))]),
+    rule(Fact(X, rel(1), ent(4)), [Fact(ent(4), rel(2), X)]),
+    rule(Fact(ent(6), rel(0), Y), [Fact(ent(1), rel(1), Y)]),
+    rule(Fact(ent(6), rel(0), Y), [Fact(Y, rel(2), ent(4))]),
+    rule(Fact(X, rel(2), ent(3)), [Fact(X, rel(3), ent(1))]),
+]
+
+
+def test_grounder_is_abstract():
+    with pytest.raises(TypeError):
+        Grounder(ent_to_lbl)
+
+
+@pytest.mark.parametrize('single_body_rule', single_body_rules)
+def test_single_body_rules(grounders, single_body_rule):
+    neo4j_facts, index_facts, matrix_facts = [set(grounder.ground(single_body_rule)) for grounder in grounders]
+
+    assert neo4j_facts == index_facts == matrix_facts
+
+
+def test_single_body_groundings(grounders):
+    expected = {Fact(ent(0), rel(1), ent(4)), Fact(ent(2), rel(1), ent(4)), Fact(ent(3), rel(1), ent(4)),
+                Fact(ent(6), rel(1), ent(4))}
+
+    for grounder in grounders:
+        assert set(grounder.ground(single_body_rules[0])) == expected
+
+
+R = rel(9)
+A, B = Var('A'), Var('B')
+
+matrix_rules_and_groundings = [
+    # Cyclic, self-loop (0, 2, 0) is not grounded
+    (rule(Fact(X, R, Y), [Fact(X, rel(2), Y)]),
+     {(4, 5), (5, 4)}),
+
+    (rule(Fact(X, R, Y), [Fact(X, rel(0), A), Fact(A, rel(1), Y)]),
+     {(0, 4), (0, 6), (2, 4), (2, 6), (3, 4), (3, 6), (6, 4)}),
+
+    (rule(Fact(X, R, Y), [Fact(X, rel(0), A), Fact(A, rel(1), B), Fact(B, rel(2), Y)]),
+     {(0, 5), (2, 5), (3, 5), (6, 5)}),
+
+    # Cyclic, paths 4-5-4-5 and 5-4-5-4 bind B to X
+    (rule(Fact(X, R, Y), [Fact(X, rel(2), A), Fact(A, rel(2), B), Fact(B, rel(2), Y)]),
+     set()),
+
+    # Cyclic, written backwards
+    (rule(Fact(X, R, Y), [Fact(A, rel(1), Y), Fact(X, rel(0), A)]),
+     {(0, 4), (0, 6), (2, 4), (2, 6), (3, 4), (3, 6), (6, 4)}),
+
+    # Acyclic, ending in an entity, X must not be bound to entity 6
+    (rule(Fact(X, R, ent(7)), [Fact(X, rel(0), A), Fact(A, rel(1), ent(6))]),
+     {(0, 7), (2, 7), (3, 7)}),
+
+    (rule(Fact(X, R, ent(2)), [Fact(X, rel(0), A), Fact(A, rel(1), B), Fact(B, rel(2), ent(5))]),
+     {(0, 2), (3, 2), (6, 2)}),
+
+    (rule(Fact(ent(2), R, Y), [Fact(Y, rel(2), ent(4))]),
+     {(2, 5)}),
+
+    # Acyclic, dangling
+    (rule(Fact(X, R, ent(3)), [Fact(X, rel(1), A)]),
+     {(1, 3), (6, 3)}),
+
+    (rule(Fact(X, R, ent(7)), [Fact(X, rel(0), A), Fact(A, rel(1), B)]),
+     {(0, 7), (2, 7), (3, 7), (6, 7)}),
+
+    # Acyclic, dangling, paths 4-5-4, 5-4-5 and 0-0-0 bind B to X
+    (rule(Fact(X, R, ent(7)), [Fact(X, rel(2), A), Fact(A, rel(2), B)]),
+     set()),
+]
+
+
+@pytest.mark.parametrize('matrix_rule, groundings', matrix_rules_and_groundings)
+def test_matrix_groundings(matrix_rule, groundings):
+    grounder = MatrixGrounder(graph_triples, ent_to_lbl)
+
+    facts = grounder.ground(matrix_rule)
+
+    assert len(facts) == len(set(facts))
+    assert {(fact.head.id, fact.tail.id) for fact in facts} == groundings
+    assert all(fact.rel == R for fact in facts)
+
+
+def test_matrix_max_facts():
+    grounder = MatrixGrounder(graph_triples, ent_to_lbl)
+
+    facts = grounder.ground(matrix_rules_and_groundings[1][0], max_facts=2)
+
+    assert [(fact.head.id, fact.tail.id) for fact in facts] == [(0, 4), (0, 6)]
+
+
+@pytest.mark.parametrize('unsupported_rule', [
+    rule(Fact(X, R, Y), [Fact(X, rel(1), X)]),
+    rule(Fact(X, R, ent(3)), [Fact(X, rel(1), A), Fact(A, rel(2), X)]),
+    rule(Fact(X, R, ent(3)), [Fact(X, rel(0), A), Fact(A, rel(1), B), Fact(B, rel(2), Var('C'))]),
+    rule(Fact(X, R, Y), [Fact(X, rel(0), A), Fact(A, rel(1), B), Fact(B, rel(2), Var('C')), Fact(Var('C'), R, Y)]),
+])
+def test_matrix_unsupported(unsupported_rule):
+    grounder = MatrixGrounder(graph_triples, ent_to_lbl)
+
+    assert grounder.ground(unsupported_rule) is None
+
+
+def ground_naively(grounding_rule: Rule, triples) -> set:
+    """
+    :return: {(head, tail)}, by trying all variable bindings under object identity
+    """
+
+    rule_ents = {node.id for fact in [grounding_rule.head] + grounding_rule.body for node in (fact.head, fact.tail)
+                 if type(node) == Ent}
+
+    def bind(facts, var_to_ent):
+        if not facts:
+            yield var_to_ent
+            return
+
+        for head, rel_id, tail in triples:
+            if rel_id != facts[0].rel.id:
+                continue
+
+            new_var_to_ent = dict(var_to_ent)
+            matches = True
+
+            for node, ent_id in ((facts[0].head, head), (facts[0].tail, tail)):
+                if type(node) == Ent:
+                    matches &= node.id == ent_id
+                elif node in new_var_to_ent:
+                    matches &= new_var_to_ent[node] == ent_id
+                else:
+                    new_var_to_ent[node] = ent_id
+
+            ents = list(new_var_to_ent.values())
+            if matches and len(set(ents)) == len(ents) and not set(ents) & rule_ents:
+                yield from bind(facts[1:], new_var_to_ent)
+
+    head_fact = grounding_rule.head
+
+    return {(var_to_ent[head_fact.head] if type(head_fact.head) == Var else head_fact.head.id,
+             var_to_ent[head_fact.tail] if type(head_fact.tail) == Var else head_fact.tail.id)
+            for var_to_ent in bind(grounding_rule.body, {})}
+
+
+def test_matrix_groundings_random():
+    rnd = random.Random(0)
+
+    ent_count = 12
+    triples = list({(rnd.randrange(ent_count), rnd.randrange(3), rnd.randrange(ent_count)) for _ in range(60)})
+    grounder = MatrixGrounder(triples, {ent: f'ent {ent}' for ent in range(ent_count)})
+
+    def rand_fact(head, tail):
+        if rnd.random() < 0.5:
+            return Fact(head, rel(rnd.randrange(3)), tail)
+        else:
+            return Fact(tail, rel(rnd.randrange(3)), head)
+
+    def rand_ent():
+        return ent(rnd.randrange(8))
+
+    for _ in range(200):
+        length = rnd.randint(1, 3)
+        path = [X] + [A, B][:length - 1]
+
+        if rnd.random() < 0.5:
+            head_fact, path = Fact(X, R, Y), path + [Y]
+        else:
+            head_fact, path = Fact(X, R, rand_ent()), path + [rand_ent() if rnd.random() < 0.5 or length == 3 else Y]
+
+        random_rule = rule(head_fact, [rand_fact(path[i], path[i + 1]) for i in range(length)])
+
+        facts = grounder.ground(random_rule)
+
+        assert {(fact.head.id, fact.tail.id) for fact in facts} == ground_naively(random_rule, triples), random_rule
@@ -0,0 +1,120 @@
+import pickle
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import List
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.joinpath('src')))
+
+from data.power.ruler_export.ruler_export_dir import RulerExportDir
+from data.power.ruler_pkl import RulerPkl
+from models.ent import Ent
+from models.fact import Fact
+from models.pred import Pred
+from models.rel import Rel
+from models.rule import Rule
+from models.var import Var
+from power.ruler import Ruler
+
+ents = [Ent(id, f'ent {id}') for id in range(6)]
+rels = [Rel(id, f'rel {id}') for id in range(3)]
+
+X, Y = Var('X'), Var('Y')
+
+
+def get_defaultdict():
+    return defaultdict(list)
+
+
+def create_pred():
+    """
+    :return: Nested dicts {head: {(rel, tail): [rule]}} like built by the old
+             prepare_ruler, incl. rules shared between facts and tied confidences
+    """
+
+    rule_a = Rule(10, 9, 0.9, Fact(X, rels[0], ents[1]), [Fact(X, rels[1], ents[2])])
+    rule_b = Rule(10, 5, 0.5, Fact(X, rels[0], ents[1]), [Fact(X, rels[2], ents[3])])
+    rule_c = Rule(10, 5, 0.5, Fact(X, rels[0], Y), [Fact(X, rels[1], Y)])
+    rule_d = Rule(10, 2, 0.2, Fact(X, rels[2], ents[0]), [Fact(X, rels[0], ents[1])])
+
+    pred = defaultdict(get_defaultdict)
+
+    # Insert the rules unranked, like the grounding does
+    pred[ents[4]][(rels[0], ents[1])].extend([rule_b, rule_a, rule_c])
+    pred[ents[4]][(rels[2], ents[0])].append(rule_d)
+    pred[ents[0]][(rels[0], ents[1])].extend([rule_c, rule_b])
+    pred[ents[2]][(rels[1], ents[5])].append(rule_c)
+
+    return pred
+
+
+def predict_old(pred, ent: Ent, top_rules: int = None) -> List[Pred]:
+    """
+    The old Ruler's predict(), extended by the top rules cut
+    """
+
+    preds = []
+
+    for (rel, tail), rules in pred[ent].items():
+        rules = list(rules)
+        rules.sort(key=lambda rule: rule.conf, reverse=True)
+
+        preds.append(Pred(Fact(ent, rel, tail), rules[0].conf, [], rules[:top_rules]))
+
+    return preds
+
+
+def create_old_ruler() -> Ruler:
+    """
+    :return: Ruler in the old format, whose only attribute is the nested dicts
+    """
+
+    old_ruler = Ruler.__new__(Ruler)
+    old_ruler.__dict__['pred'] = create_pred()
+
+    return old_ruler
+
+
+def assert_same_preds(ruler: Ruler, pred) -> None:
+    for ent in ents:
+        for top_rules in [None, 1, 2, 5]:
+            assert ruler.predict(ent, top_rules) == predict_old(pred, ent, top_rules)
+
+
+def test_from_pred():
+    assert_same_preds(Ruler.from_pred(create_pred()), create_pred())
+
+
+def test_old_pickle(tmp_path: Path):
+    ruler_pkl = RulerPkl(tmp_path.joinpath('ruler.pkl'))
+    ruler_pkl.save(create_old_ruler())
+
+    ruler = ruler_pkl.load()
+
+    assert 'pred' not in ruler.__dict__
+    assert ruler.confs.dtype == 'float64'
+    assert_same_preds(ruler, create_pred())
+
+    # Shared rules are stored once
+    assert len(ruler.rules) == 4
+
+
+@pytest.mark.parametrize('ent', [ents[1], ents[3], Ent(99, 'unknown')])
+def test_unpredicted_ent(ent: Ent):
+    ruler = pickle.loads(pickle.dumps(create_old_ruler()))
+
+    assert ruler.predict(ent) == []
+    assert ruler.predict(ent, top_rules=1) == []
+
+
+def test_export(tmp_path: Path):
+    ruler_export_dir = RulerExportDir(tmp_path.joinpath('ruler'))
+    ruler_export_dir.create()
+
+    Ruler.from_pred(create_pred()).save(ruler_export_dir)
+
+    ruler = Ruler.load(ruler_export_dir)
+
+    assert_same_preds(ruler, create_pred())
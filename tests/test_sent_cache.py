@@ -0,0 +1,75 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent.joinpath('src')))
+
+from data.power.sent_embs.sent_embs_dir import SentEmbsDir
+from power.sent_cache import SentCache
+
+EMB_SIZE = 4
+
+
+def create_embs(keys):
+    return np.array([[i] * EMB_SIZE for i in keys], dtype=np.float32)
+
+
+def open_cache(tmp_path: Path) -> SentCache:
+    sent_embs_dir = SentEmbsDir(tmp_path)
+    sent_embs_dir.create(overwrite=True)
+
+    return SentCache(sent_embs_dir, 'fingerprint', EMB_SIZE)
+
+
+def check_cache(cache: SentCache, keys):
+    for key in keys:
+        assert np.array_equal(cache.get(str(key)), create_embs([key])[0])
+
+
+def test_torn_append(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.put(['0', '1'], create_embs([0, 1]))
+
+    # Crash after appending the embeddings, but before appending the keys
+    cache.sent_embs_dir.embs_bin.append(create_embs([2, 3]))
+
+    cache = open_cache(tmp_path)
+    check_cache(cache, [0, 1])
+    assert cache.get('2') is None
+
+    cache.put(['4', '5'], create_embs([4, 5]))
+
+    # Crash while appending an embedding
+    with open(cache.sent_embs_dir.embs_bin.path, 'ab') as f:
+        f.write(create_embs([6])[0].tobytes()[:5])
+
+    cache = open_cache(tmp_path)
+    check_cache(cache, [0, 1, 4, 5])
+
+    cache.put(['7'], create_embs([7]))
+
+    # Crash while appending a key
+    cache.sent_embs_dir.embs_bin.append(create_embs([8]))
+    with open(cache.sent_embs_dir.keys_txt.path, 'a') as f:
+        f.write('8')
+
+    cache = open_cache(tmp_path)
+    cache.put(['9'], create_embs([9]))
+
+    cache = open_cache(tmp_path)
+    check_cache(cache, [0, 1, 4, 5, 7, 9])
+    assert cache.get('8') is None
+
+
+def test_shared_dir(tmp_path):
+    cache_a = open_cache(tmp_path)
+    cache_b = open_cache(tmp_path)
+
+    cache_a.put(['0', '1'], create_embs([0, 1]))
+    cache_b.put(['1', '2'], create_embs([1, 2]))
+    cache_a.put(['3'], create_embs([3]))
+
+    cache = open_cache(tmp_path)
+    check_cache(cache, [0, 1, 2, 3])
+    assert len(cache.disk_embs) == 4
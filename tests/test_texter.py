@@ -0,0 +1,47 @@
+import sys
+from pathlib import Path
+
+import torch
+from torch.nn import Module, Parameter
+from transformers import DistilBertConfig, DistilBertModel, DistilBertTokenizer
+
+sys.path.insert(0, str(Path(__file__).parent.parent.joinpath('src')))
+
+from models.ent import Ent
+from models.rel import Rel
+from power.texter import Texter
+
+
+def create_texter(tmp_path: Path) -> Texter:
+    """
+    :return: Texter with a tiny, randomly initialized encoder that does not need a download
+    """
+
+    vocab_txt = tmp_path.joinpath('vocab.txt')
+    vocab_txt.write_text('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', 'trace', 'me']))
+
+    texter = Texter.__new__(Texter)
+    Module.__init__(texter)
+
+    torch.manual_seed(0)
+
+    texter.tokenizer = DistilBertTokenizer(str(vocab_txt))
+    texter.tokenizer.add_tokens(['[MENTION_START]', '[MENTION_END]'], special_tokens=True)
+
+    config = DistilBertConfig(vocab_size=len(texter.tokenizer), dim=32, hidden_dim=64, n_layers=2, n_heads=2)
+    texter.bert = DistilBertModel(config)
+
+    texter.classes = [(Rel(0, 'rel 0'), Ent(0, 'ent 0')), (Rel(1, 'rel 1'), Ent(1, 'ent 1'))]
+    texter.class_embs = Parameter(torch.randn(2, 32))
+    texter.multi_weight = Parameter(torch.randn(2, 32))
+    texter.multi_bias = Parameter(torch.randn(2))
+
+    return texter
+
+
+def test_fingerprint_quantized(tmp_path):
+    texter = create_texter(tmp_path)
+    quantized_texter = texter.quantize()
+
+    assert quantized_texter.fingerprint() == quantized_texter.fingerprint()
+    assert quantized_texter.fingerprint() != texter.fingerprint()
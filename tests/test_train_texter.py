@@ -0,0 +1,356 @@
+import random
+import sys
+from pathlib import Path
+from typing import Any, List
+
+import numpy as np
+import pytest
+import torch
+from sklearn.metrics import precision_recall_fscore_support
+from torch import Tensor
+from torch.nn import BCEWithLogitsLoss, Linear, Module, Parameter
+from transformers import DistilBertConfig, DistilBertModel, DistilBertTokenizer
+
+sys.path.insert(0, str(Path(__file__).parent.parent.joinpath('src')))
+
+import train_texter
+from data.power.checkpoint_pt import CheckpointPt
+from data.power.samples.samples_dir import SamplesDir
+from data.power.split.split_dir import SplitDir
+from power.texter import Texter
+from train_texter import LengthGroupedSampler, SamplesBatchGenerator, add_counts, calc_prfs, count_batch, \
+    create_counts, find_micro_batch_size, get_peak_rss, reset_peak_rss
+
+WORDS = ['the', 'a', 'is', 'of', 'city', 'river', 'actor', 'film', 'band', 'player', 'team', 'capital']
+
+
+def create_batches(batch_count: int, batch_size: int, class_count: int, seed: int):
+    """
+    :return: [(logits_batch, gt_batch)]. The last two classes have no positives,
+             one of them is never predicted either.
+    """
+
+    generator = torch.Generator().manual_seed(seed)
+
+    batches = []
+    for _ in range(batch_count):
+        logits_batch = torch.randn(batch_size, class_count, generator=generator)
+        gt_batch = (torch.rand(batch_size, class_count, generator=generator) < 0.3).float()
+
+        gt_batch[:, -2:] = 0
+        logits_batch[:, -1] = -1
+
+        batches.append((logits_batch, gt_batch))
+
+    return batches
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_calc_prfs(seed: int):
+    class_count = 7
+    batches = create_batches(batch_count=4, batch_size=9, class_count=class_count, seed=seed)
+
+    counts = create_counts(class_count, 'cpu')
+    for logits_batch, gt_batch in batches:
+        add_counts(counts, count_batch(torch.tensor(0.0), logits_batch, gt_batch))
+
+    pred = torch.cat([logits_batch > 0 for logits_batch, _ in batches]).numpy()
+    gt = torch.cat([gt_batch for _, gt_batch in batches]).numpy()
+
+    assert counts['tp'][-2:].tolist() == [0, 0]
+    assert counts['fp'][-1].item() == 0
+
+    # Class-wise and macro
+    precs, recs, f1s = calc_prfs(counts)
+    sk_precs, sk_recs, sk_f1s, _ = precision_recall_fscore_support(gt, pred, average=None, zero_division=0)
+
+    assert precs.numpy() == pytest.approx(sk_precs)
+    assert recs.numpy() == pytest.approx(sk_recs)
+    assert f1s.numpy() == pytest.approx(sk_f1s)
+
+    sk_macro = precision_recall_fscore_support(gt, pred, average='macro', zero_division=0)[:3]
+    assert [metric.mean().item() for metric in (precs, recs, f1s)] == pytest.approx(sk_macro)
+
+    # Micro, from the counts summed over the classes
+    micro_counts = {key: value.sum(dim=0, keepdim=True) for key, value in counts.items() if key != 'loss'}
+
+    sk_micro = precision_recall_fscore_support(gt, pred, average='micro', zero_division=0)[:3]
+    assert [metric.item() for metric in calc_prfs(micro_counts)] == pytest.approx(sk_micro)
+
+
+def create_dirs(tmp_path: Path, class_count: int, sent_count: int, ent_count: int) -> None:
+    """
+    Create a POWER Split Directory and a POWER Samples Directory with random
+    samples. Train entities have IDs below 100, valid entities from 100.
+    """
+
+    rnd = random.Random(0)
+
+    split_dir = SplitDir(tmp_path.joinpath('split'))
+    split_dir.create()
+
+    ent_to_lbl = {ent: f'ent {ent}' for ent in range(300)}
+    rel_to_lbl = {rel: f'rel {rel}' for rel in range(class_count)}
+
+    split_dir.entities_tsv.save(ent_to_lbl)
+    split_dir.relations_tsv.save(rel_to_lbl)
+
+    for entities_tsv in [split_dir.train_entities_tsv, split_dir.valid_entities_tsv, split_dir.test_entities_tsv]:
+        entities_tsv.save({})
+
+    for facts_tsv in [split_dir.train_facts_tsv, split_dir.valid_facts_known_tsv, split_dir.valid_facts_unknown_tsv,
+                      split_dir.test_facts_known_tsv, split_dir.test_facts_unknown_tsv]:
+        facts_tsv.save([])
+
+    samples_dir = SamplesDir(tmp_path.joinpath('samples'))
+    samples_dir.create()
+
+    for db in ['train', 'valid', 'test']:
+        samples_dir.tmp_dir.path.joinpath(f'{db}.db').touch()
+
+    samples_dir.classes_tsv.save([(c, 200 + c, 0.1, f'rel {c} ent {200 + c}') for c in range(class_count)])
+
+    for samples_tsv, first_ent in [(samples_dir.train_samples_tsv, 0), (samples_dir.valid_samples_tsv, 100),
+                                   (samples_dir.test_samples_tsv, 100)]:
+        samples_tsv.save([(ent, f'ent {ent}', [rnd.randint(0, 1) for _ in range(class_count)],
+                           [' '.join(rnd.choices(WORDS, k=rnd.randint(2, 10))) for _ in range(sent_count)])
+                          for ent in range(first_ent, first_ent + ent_count)])
+
+
+@pytest.fixture
+def tiny_texter(tmp_path: Path, monkeypatch):
+    """
+    Let train_texter() create Texters with a tiny, randomly initialized
+    encoder that does not need a download
+    """
+
+    vocab_txt = tmp_path.joinpath('vocab.txt')
+    vocab_txt.write_text('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + WORDS))
+
+    def create_tokenizer(pre_trained: str) -> DistilBertTokenizer:
+        tokenizer = DistilBertTokenizer(str(vocab_txt))
+        tokenizer.add_tokens(['[MENTION_START]', '[MENTION_END]'], special_tokens=True)
+
+        return tokenizer
+
+    def init(self: Texter, pre_trained: str, classes: List) -> None:
+        Module.__init__(self)
+
+        self.tokenizer = create_tokenizer(pre_trained)
+
+        config = DistilBertConfig(vocab_size=len(self.tokenizer), dim=32, hidden_dim=64, n_layers=2, n_heads=2)
+        self.bert = DistilBertModel(config)
+
+        self.class_embs = Parameter(torch.randn(len(classes), 32))
+        self.multi_weight = Parameter(torch.randn(len(classes), 32))
+        self.multi_bias = Parameter(torch.randn(len(classes)))
+
+        self.classes = classes
+
+    monkeypatch.setattr(Texter, 'create_tokenizer', staticmethod(create_tokenizer))
+    monkeypatch.setattr(Texter, '__init__', init)
+
+
+def run_train_texter(tmp_path: Path, run_dir: Path, monkeypatch, ent_batches: List[List[int]],
+                     resume: bool = False) -> None:
+    """
+    Train like `train_texter.py` does when run as a script
+
+    :param ent_batches: Receives the entities of the train batches, in order
+    """
+
+    monkeypatch.setattr(sys, 'argv', ['train_texter.py', str(tmp_path.joinpath('samples')), '4', '3',
+                                      str(tmp_path.joinpath('split')), str(run_dir.joinpath('texter.pkl')),
+                                      '--batch-size', '3',
+                                      '--checkpoint', str(run_dir.joinpath('checkpoint.pt')),
+                                      '--checkpoint-interval', '3',
+                                      '--device', 'cpu',
+                                      '--epoch-count', '3',
+                                      '--log-dir', str(run_dir.joinpath('runs')),
+                                      '--num-workers', '0',
+                                      '--random-seed', '0',
+                                      '--sent-len', '16',
+                                      *(['--resume'] if resume else [])])
+
+    generate_batch = SamplesBatchGenerator.__call__
+
+    def record_batch(self: SamplesBatchGenerator, batch: List) -> Any:
+        collated = generate_batch(self, batch)
+
+        ents = collated[0].tolist()
+        if ents[0] < 100:
+            ent_batches.append(ents)
+
+        return collated
+
+    with monkeypatch.context() as batch_monkeypatch:
+        batch_monkeypatch.setattr(SamplesBatchGenerator, '__call__', record_batch)
+
+        args = train_texter.parse_args()
+
+        # Like main(). Also start from the same Texter weights.
+        random.seed(args.random_seed)
+        torch.manual_seed(0)
+
+        train_texter.train_texter(args)
+
+
+def assert_equal(obj: Any, other: Any) -> None:
+    if isinstance(obj, Tensor):
+        assert torch.equal(obj, other)
+    elif isinstance(obj, dict):
+        assert obj.keys() == other.keys()
+        for key in obj:
+            assert_equal(obj[key], other[key])
+    elif isinstance(obj, (list, tuple)):
+        assert len(obj) == len(other)
+        for value, other_value in zip(obj, other):
+            assert_equal(value, other_value)
+    else:
+        assert obj == other
+
+
+def test_resume(tmp_path: Path, tiny_texter, monkeypatch):
+    """
+    Interrupt the training after its third checkpoint, at the second of the
+    four batches of epoch 1, and resume it. The resumed training must
+    continue with the same batches and end in the same state as an
+    uninterrupted one.
+    """
+
+    create_dirs(tmp_path, class_count=4, sent_count=3, ent_count=10)
+
+    full_dir = tmp_path.joinpath('full')
+    full_dir.mkdir()
+
+    full_batches = []
+    run_train_texter(tmp_path, full_dir, monkeypatch, full_batches)
+
+    assert len(full_batches) == 12
+    for epoch in range(3):
+        assert sorted(sum(full_batches[epoch * 4:(epoch + 1) * 4], [])) == list(range(10))
+
+    # Interrupt the run as soon as it waits for the third checkpoint
+    resumed_dir = tmp_path.joinpath('resumed')
+    resumed_dir.mkdir()
+
+    save = CheckpointPt.save
+    save_count = 0
+
+    def interrupting_save(self: CheckpointPt, checkpoint: dict) -> None:
+        nonlocal save_count
+
+        save(self, checkpoint)
+        save_count += 1
+
+        if save_count == 3:
+            raise KeyboardInterrupt()
+
+    monkeypatch.setattr(CheckpointPt, 'save', interrupting_save)
+
+    interrupted_batches = []
+    with pytest.raises(KeyboardInterrupt):
+        run_train_texter(tmp_path, resumed_dir, monkeypatch, interrupted_batches)
+
+    checkpoint = CheckpointPt(resumed_dir.joinpath('checkpoint.pt')).load()
+    assert (checkpoint['epoch'], checkpoint['epoch_batch_count']) == (1, 2)
+
+    monkeypatch.setattr(CheckpointPt, 'save', save)
+
+    # The batches after the checkpoint are trained on again
+    resumed_batches = []
+    run_train_texter(tmp_path, resumed_dir, monkeypatch, resumed_batches, resume=True)
+
+    assert interrupted_batches[:6] + resumed_batches == full_batches
+
+    full_checkpoint = CheckpointPt(full_dir.joinpath('checkpoint.pt')).load()
+    resumed_checkpoint = CheckpointPt(resumed_dir.joinpath('checkpoint.pt')).load()
+
+    assert_equal(resumed_checkpoint, full_checkpoint)
+
+
+@pytest.mark.parametrize('data_len', [1, 4, 29, 64, 300])
+def test_length_grouped_sampler(data_len: int):
+    batch_size = 4
+    bucket_size = batch_size * 3
+
+    rnd = random.Random(data_len)
+    sent_lens = np.array([rnd.randint(1, 16) for _ in range(data_len)])
+
+    generator = torch.Generator().manual_seed(0)
+    sampler = LengthGroupedSampler(sent_lens, batch_size, generator, bucket_batch_count=3)
+
+    for _ in range(3):
+        # The buckets are split from the random permutation the sampler draws first
+        shuffled = torch.randperm(data_len, generator=torch.Generator().set_state(generator.get_state())).tolist()
+        buckets = [set(shuffled[i:i + bucket_size]) for i in range(0, data_len, bucket_size)]
+
+        perm = list(sampler)
+        assert len(perm) == len(sampler)
+
+        # Every sample exactly once per epoch
+        assert sorted(perm) == list(range(data_len))
+
+        batches = [perm[i:i + batch_size] for i in range(0, data_len, batch_size)]
+
+        # Only the last batch may be partial
+        assert all(len(batch) == batch_size for batch in batches[:-1])
+
+        # Each batch holds samples of a single bucket, whose other samples are at least
+        # as long as the batch's longest or at most as long as its shortest sample
+        for batch in batches:
+            bucket = next(bucket for bucket in buckets if batch[0] in bucket)
+            assert set(batch) <= bucket
+
+            batch_lens = sent_lens[batch]
+            assert list(batch_lens) == sorted(batch_lens, reverse=True)
+
+            for idx in bucket - set(batch):
+                assert sent_lens[idx] >= batch_lens.max() or sent_lens[idx] <= batch_lens.min()
+
+
+@pytest.mark.parametrize('batch_size', [1, 6, 64, 100])
+@pytest.mark.parametrize('max_fitting', [0, 1, 5, 37, 64, 100])
+@pytest.mark.parametrize('oom', [False, True])
+def test_find_micro_batch_size(batch_size: int, max_fitting: int, oom: bool, monkeypatch):
+    """
+    Let micro batch sizes above `max_fitting` exceed the memory budget or run out of memory
+    """
+
+    texter = Linear(1, 1)
+    optimizer_memory = 2 * 2 * 4
+
+    tried_batch_sizes = []
+
+    def measure_train_step(texter, criterion, device, try_batch_size, class_count, sent_count, sent_len) -> int:
+        tried_batch_sizes.append(try_batch_size)
+
+        if oom and try_batch_size > max_fitting:
+            raise RuntimeError('CUDA out of memory')
+
+        return 1000 * try_batch_size
+
+    monkeypatch.setattr(train_texter, 'measure_train_step', measure_train_step)
+
+    micro_batch_size = find_micro_batch_size(texter, BCEWithLogitsLoss(), 'cpu', 4, 3, 16, batch_size,
+                                             memory_budget=1000 * max_fitting + optimizer_memory)
+
+    assert micro_batch_size == max(1, min(max_fitting, batch_size))
+
+    # Each micro batch size is tried at most once, in logarithmically many steps
+    assert len(tried_batch_sizes) == len(set(tried_batch_sizes))
+    assert len(tried_batch_sizes) <= 2 * batch_size.bit_length()
+
+
+def test_peak_rss():
+    if not reset_peak_rss():
+        pytest.skip('Peak RSS cannot be reset')
+
+    np.ones(2 ** 26, dtype=np.uint8)
+    large_peak = get_peak_rss()
+
+    reset_peak_rss()
+    np.ones(2 ** 20, dtype=np.uint8)
+    small_peak = get_peak_rss()
+
+    assert large_peak - small_peak > 2 ** 25